@@ -0,0 +1,17 @@
+import os
+
+APP_DIR_NAME = "dostup_k_muzyke"
+
+
+def cache_dir(*parts):
+    """
+    Возвращает (и создает) папку кэша приложения или ее подпапку.
+    Windows: %LOCALAPPDATA%, остальные системы: $XDG_CACHE_HOME или ~/.cache.
+    """
+    if os.name == 'nt':
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, APP_DIR_NAME, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,381 @@
+import io
+import os
+import stat
+import ctypes
+import struct
+import logging
+import tarfile
+import zipfile
+import threading
+from collections import OrderedDict
+
+# Архивы, содержимое которых показывается как виртуальные папки.
+# Сжатые tar (.tar.gz и т.п.) не поддерживаются: в них нельзя перейти к члену без распаковки всего начала
+ARCHIVE_EXTENSIONS = ('.zip', '.tar')
+# Сколько оглавлений архивов держится в памяти (ключ - путь, mtime и размер архива)
+MAX_CACHED_INDEXES = 32
+# Сколько проверенных путей с расширением архива запоминается (файл архива или папка с таким именем)
+MAX_KNOWN_ARCHIVE_PATHS = 4096
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4s22xHH')
+
+
+class ArchiveStat:
+    """Минимальный аналог os.stat_result для члена архива: время изменения берется у самого архива."""
+    __slots__ = ('st_mode', 'st_size', 'st_mtime_ns')
+
+    def __init__(self, st_mode, st_size, st_mtime_ns):
+        self.st_mode = st_mode
+        self.st_size = st_size
+        self.st_mtime_ns = st_mtime_ns
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+
+class ArchiveIndex:
+    """Оглавление архива: файлы (внутренний путь -> (размер, запись)) и листинги виртуальных папок."""
+    __slots__ = ('path', 'kind', 'mtime_ns', 'members', 'dirs')
+
+    def __init__(self, path, kind, mtime_ns):
+        self.path = path
+        self.kind = kind
+        self.mtime_ns = mtime_ns
+        self.members = {}
+        # Внутренняя папка ('' - корень архива) -> {имя: является_папкой}
+        self.dirs = {'': {}}
+
+    def _add_dir(self, inner):
+        while inner and inner not in self.dirs:
+            self.dirs[inner] = {}
+            parent, _, name = inner.rpartition('/')
+            self.dirs.setdefault(parent, {})[name] = True
+            inner = parent
+
+    def _add_file(self, inner, size, entry):
+        parent, _, name = inner.rpartition('/')
+        self._add_dir(parent)
+        self.dirs[parent][name] = False
+        self.members[inner] = (size, entry)
+
+    def listdir(self, inner):
+        entries = self.dirs.get(inner)
+        return tuple(entries.items()) if entries is not None else None
+
+
+def _has_archive_component(path):
+    lower = path.lower()
+    return any(extension + os.sep in lower or lower.endswith(extension) for extension in ARCHIVE_EXTENSIONS)
+
+
+_known_archive_paths = OrderedDict()
+_known_archive_paths_lock = threading.Lock()
+
+
+def _is_archive_file(archive_path):
+    """
+    True - файл архива, False - папка с расширением архива в имени, None - пути нет.
+    Ответ запоминается: члены архива проверяются на каждом обращении к ним,
+    и без этого каждое из них стоило бы isfile/isdir на диске (на сетевом ресурсе - запрос к серверу).
+    """
+    with _known_archive_paths_lock:
+        is_file = _known_archive_paths.get(archive_path)
+        if is_file is not None:
+            _known_archive_paths.move_to_end(archive_path)
+            return is_file
+    if os.path.isfile(archive_path):
+        is_file = True
+    elif os.path.isdir(archive_path):
+        is_file = False
+    else:
+        # Отсутствующий путь не запоминается: архив может появиться позже
+        return None
+    with _known_archive_paths_lock:
+        _known_archive_paths[archive_path] = is_file
+        while len(_known_archive_paths) > MAX_KNOWN_ARCHIVE_PATHS:
+            _known_archive_paths.popitem(last=False)
+    return is_file
+
+
+def _forget_archive_path(archive_path):
+    with _known_archive_paths_lock:
+        _known_archive_paths.pop(archive_path, None)
+
+
+def split_archive_path(path):
+    """
+    Делит путь на (путь к архиву, путь внутри архива через '/') или возвращает None.
+    Папка, имя которой просто оканчивается на .zip, архивом не считается.
+    """
+    if not _has_archive_component(path):
+        return None
+    parts = path.split(os.sep)
+    for i in range(1, len(parts)):
+        if parts[i].lower().endswith(ARCHIVE_EXTENSIONS):
+            archive_path = os.sep.join(parts[:i + 1]) or os.sep
+            is_file = _is_archive_file(archive_path)
+            if is_file:
+                return archive_path, '/'.join(parts[i + 1:])
+            if is_file is None:
+                return None
+    return None
+
+
+def is_archive_member(path):
+    split = split_archive_path(path)
+    return split is not None and split[1] != ''
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _build_index(archive_path, mtime_ns):
+    if archive_path.lower().endswith('.zip'):
+        index = ArchiveIndex(archive_path, 'zip', mtime_ns)
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                inner = info.filename.strip('/')
+                if not inner:
+                    continue
+                if info.is_dir():
+                    index._add_dir(inner)
+                else:
+                    index._add_file(inner, info.file_size, info)
+        return index
+    index = ArchiveIndex(archive_path, 'tar', mtime_ns)
+    # Только несжатый tar: у каждого члена известно смещение данных в файле
+    with tarfile.open(archive_path, 'r:') as archive:
+        for info in archive:
+            inner = info.name.strip('/')
+            if not inner:
+                continue
+            if info.isdir():
+                index._add_dir(inner)
+            elif info.isfile():
+                index._add_file(inner, info.size, info)
+    return index
+
+
+def archive_index(archive_path):
+    """Оглавление архива из кэша (перечитывается при изменении архива) или None, если архив не читается."""
+    try:
+        stat_result = os.stat(archive_path)
+    except OSError:
+        # Архив удален или переименован - запомненный путь больше не верен
+        _forget_archive_path(archive_path)
+        return None
+    key = (archive_path, stat_result.st_mtime_ns, stat_result.st_size)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    try:
+        index = _build_index(archive_path, stat_result.st_mtime_ns)
+    except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+        logging.error(f"Архив {archive_path} не читается: {e}")
+        return None
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def listdir(path):
+    """Листинг виртуальной папки архива в формате FileSystem.listdir или None."""
+    split = split_archive_path(path)
+    if split is None:
+        return None
+    index = archive_index(split[0])
+    return index.listdir(split[1]) if index is not None else None
+
+
+def member_stat(path):
+    """ArchiveStat для файла или виртуальной папки внутри архива или None."""
+    split = split_archive_path(path)
+    if split is None or not split[1]:
+        return None
+    index = archive_index(split[0])
+    if index is None:
+        return None
+    member = index.members.get(split[1])
+    if member is not None:
+        return ArchiveStat(stat.S_IFREG | 0o444, member[0], index.mtime_ns)
+    if split[1] in index.dirs:
+        return ArchiveStat(stat.S_IFDIR | 0o555, 0, index.mtime_ns)
+    return None
+
+
+def stat_path(path):
+    """os.stat для обычного пути и ArchiveStat для члена архива; OSError, если пути нет."""
+    try:
+        return os.stat(path)
+    except OSError:
+        result = member_stat(path)
+        if result is None:
+            raise
+        return result
+
+
+class _MemberSlice(io.RawIOBase):
+    """Непрерывный участок файла архива (несжатый член) с произвольным доступом без копирования."""
+
+    def __init__(self, archive_path, offset, size):
+        super().__init__()
+        self._file = open(archive_path, 'rb')
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self._size - self._position)
+        if count <= 0:
+            return 0
+        self._file.seek(self._offset + self._position)
+        count = self._file.readinto(memoryview(buffer)[:count])
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def open_member(path):
+    """
+    Открывает файл внутри архива как двоичный поток с seek. Несжатые члены zip и члены tar
+    читаются напрямую из файла архива, сжатые - через zipfile (seek назад распаковывает заново).
+    """
+    split = split_archive_path(path)
+    index = archive_index(split[0]) if split is not None else None
+    member = index.members.get(split[1]) if index is not None else None
+    if member is None:
+        raise FileNotFoundError(path)
+    size, info = member
+    archive_path = split[0]
+    if index.kind == 'tar':
+        if info.issparse():
+            raise OSError(f"Разреженный член tar не поддерживается: {path}")
+        return io.BufferedReader(_MemberSlice(archive_path, info.offset_data, size))
+    if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+        with open(archive_path, 'rb') as file:
+            file.seek(info.header_offset)
+            signature, name_length, extra_length = _ZIP_LOCAL_HEADER.unpack(file.read(_ZIP_LOCAL_HEADER.size))
+        if signature != b'PK\x03\x04':
+            raise OSError(f"Поврежден локальный заголовок zip: {path}")
+        data_offset = info.header_offset + _ZIP_LOCAL_HEADER.size + name_length + extra_length
+        return io.BufferedReader(_MemberSlice(archive_path, data_offset, size))
+    archive = zipfile.ZipFile(archive_path)
+    try:
+        # Открытый член держит файл архива, пока не будет закрыт сам
+        return archive.open(info)
+    finally:
+        archive.close()
+
+
+def open_file(path):
+    """Открывает обычный файл или член архива для чтения в двоичном режиме."""
+    if is_archive_member(path):
+        return open_member(path)
+    return open(path, 'rb')
+
+
+def read_file(path):
+    with open_file(path) as file:
+        return file.read()
+
+
+class VlcArchiveStreams:
+    """
+    Воспроизведение членов архивов без временных файлов: vlc.Media создается через
+    media_new_callbacks, и libvlc читает данные через open/read/seek/close в своих потоках.
+    Обратные вызовы ctypes живут столько же, сколько объект, поэтому он создается один раз на плеер.
+    """
+
+    def __init__(self, vlc_module):
+        self._lock = threading.Lock()
+        self._sources = {}
+        self._streams = {}
+        self._next_id = 1
+        self._open_cb = vlc_module.CallbackDecorators.MediaOpenCb(self._open)
+        self._read_cb = vlc_module.CallbackDecorators.MediaReadCb(self._read)
+        self._seek_cb = vlc_module.CallbackDecorators.MediaSeekCb(self._seek)
+        self._close_cb = vlc_module.CallbackDecorators.MediaCloseCb(self._close)
+
+    def _new_id(self):
+        with self._lock:
+            value = self._next_id
+            self._next_id += 1
+            return value
+
+    def media(self, instance, path):
+        """
+        vlc.Media для члена архива. Источники предыдущих Media забываются: объект обслуживает
+        один плеер, который останавливается перед сменой трека, и повторно они не откроются.
+        """
+        source_id = self._new_id()
+        with self._lock:
+            self._sources = {source_id: path}
+        return instance.media_new_callbacks(self._open_cb, self._read_cb, self._seek_cb, self._close_cb,
+                                            ctypes.c_void_p(source_id))
+
+    def _open(self, opaque, datap, sizep):
+        try:
+            with self._lock:
+                path = self._sources.get(opaque)
+            if path is None:
+                return -1
+            stream = open_member(path)
+            stream_id = self._new_id()
+            with self._lock:
+                self._streams[stream_id] = stream
+            datap[0] = stream_id
+            sizep[0] = member_stat(path).st_size
+            return 0
+        except Exception as e:
+            logging.error(f"Архив: не удалось открыть поток: {e}")
+            return -1
+
+    def _read(self, opaque, buffer, length):
+        try:
+            data = self._streams[opaque].read(length)
+            ctypes.memmove(buffer, data, len(data))
+            return len(data)
+        except Exception as e:
+            logging.error(f"Архив: ошибка чтения потока: {e}")
+            return -1
+
+    def _seek(self, opaque, offset):
+        try:
+            self._streams[opaque].seek(offset)
+            return 0
+        except Exception as e:
+            logging.error(f"Архив: ошибка перемотки потока: {e}")
+            return -1
+
+    def _close(self, opaque):
+        with self._lock:
+            stream = self._streams.pop(opaque, None)
+        if stream is not None:
+            stream.close()
@@ -0,0 +1,129 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QImageReader
+
+import archive
+
+# Размеры (по большей стороне), в которых хранятся декодированные обложки
+COVER_LEVELS = (64, 128, 256, 512)
+
+
+def _level_for(max_side):
+    """Наименьший уровень, не меньший запрошенного размера."""
+    for level in COVER_LEVELS:
+        if level >= max_side:
+            return level
+    return COVER_LEVELS[-1]
+
+
+def decode_image(source, max_side):
+    """
+    Декодирует изображение из байтов или пути к файлу не больше max_side по большей стороне.
+    Для JPEG QImageReader сам декодирует в уменьшенном разрешении,
+    для остальных форматов полноразмерное изображение существует только во время чтения.
+    Изображения внутри архивов читаются через archive.read_file.
+    """
+    if isinstance(source, str) and archive.is_archive_member(source):
+        try:
+            source = archive.read_file(source)
+        except OSError as e:
+            logging.debug(f"CoverCache: не удалось прочитать {source}: {e}")
+            source = b''
+    if isinstance(source, (bytes, bytearray)):
+        buffer = QBuffer()
+        buffer.setData(QByteArray(bytes(source)))
+        buffer.open(QIODevice.ReadOnly)
+        reader = QImageReader(buffer)
+    else:
+        buffer = None
+        reader = QImageReader(source)
+
+    size = reader.size()
+    if size.isValid() and max(size.width(), size.height()) > max_side:
+        reader.setScaledSize(size.scaled(max_side, max_side, Qt.KeepAspectRatio))
+    image = reader.read()
+    if buffer is not None:
+        buffer.close()
+    if image.isNull():
+        logging.debug(f"CoverCache: не удалось декодировать изображение: {reader.errorString()}")
+    return image
+
+
+class CoverCache:
+    """
+    Кэш декодированных обложек с общим ограничением памяти.
+    Для каждой обложки хранится небольшой набор уровней из COVER_LEVELS;
+    при превышении лимита вытесняются давно не использованные изображения.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, cover_key, loader, max_side):
+        """
+        Возвращает QImage обложки не меньше max_side (если исходник позволяет).
+        loader() вызывается только при промахе и должен вернуть байты или путь к файлу.
+        """
+        level = _level_for(max_side)
+        with self._lock:
+            image = self._lookup(cover_key, level)
+        if image is not None:
+            return image
+
+        # Уже декодированный больший уровень уменьшаем без повторного чтения исходника
+        with self._lock:
+            larger = next((self._images[(cover_key, l)] for l in COVER_LEVELS
+                           if l > level and (cover_key, l) in self._images), None)
+        if larger is not None:
+            image = larger.scaled(level, level, Qt.KeepAspectRatio, Qt.SmoothTransformation) \
+                if max(larger.width(), larger.height()) > level else larger
+        else:
+            source = loader()
+            if not source:
+                return None
+            image = decode_image(source, level)
+            if image.isNull():
+                return None
+
+        with self._lock:
+            self._store((cover_key, level), image)
+        return image
+
+    def put(self, cover_key, image):
+        """Кладет уже декодированное изображение (например, обложку из снимка сеанса) на его уровень."""
+        level = _level_for(max(image.width(), image.height()))
+        with self._lock:
+            self._store((cover_key, level), image)
+
+    def discard(self, cover_key):
+        with self._lock:
+            for level in COVER_LEVELS:
+                image = self._images.pop((cover_key, level), None)
+                if image is not None:
+                    self._total_bytes -= image.sizeInBytes()
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def _lookup(self, cover_key, level):
+        image = self._images.get((cover_key, level))
+        if image is not None:
+            self._images.move_to_end((cover_key, level))
+        return image
+
+    def _store(self, key, image):
+        old = self._images.pop(key, None)
+        if old is not None:
+            self._total_bytes -= old.sizeInBytes()
+        self._images[key] = image
+        self._total_bytes += image.sizeInBytes()
+        while self._total_bytes > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self._total_bytes -= evicted.sizeInBytes()
@@ -0,0 +1,85 @@
+import io
+import colorsys
+import logging
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    # Без NumPy цвета обложек не вычисляются, интерфейс остается в базовой палитре
+    np = None
+
+# Сторона уменьшенной копии обложки, по которой считается палитра
+SAMPLE_SIDE = 48
+# Бит на канал при квантовании: 4 бита дают 4096 корзин цветов
+QUANT_BITS = 4
+# Акцентный цвет должен быть заметно насыщенным и не слишком темным
+MIN_ACCENT_SATURATION = 0.3
+MIN_ACCENT_VALUE = 0.25
+
+
+def _sample_pixels(data):
+    """Декодирует обложку сразу в уменьшенном виде и возвращает массив пикселей (N, 3) uint8."""
+    with Image.open(io.BytesIO(data)) as image:
+        # Для JPEG draft декодирует в уменьшенном масштабе (1/2..1/8) без полноразмерного буфера
+        image.draft('RGB', (SAMPLE_SIDE * 2, SAMPLE_SIDE * 2))
+        image = image.convert('RGB')
+        image.thumbnail((SAMPLE_SIDE, SAMPLE_SIDE), Image.BILINEAR)
+        return np.asarray(image, dtype=np.uint8).reshape(-1, 3)
+
+
+def extract_colors(data):
+    """
+    Основной и акцентный цвета обложки в виде целых 0xRRGGBB или None.
+    Пиксели квантуются до QUANT_BITS бит на канал и считаются одной гистограммой (bincount);
+    основной цвет - средний цвет самой населенной корзины, акцентный - корзина
+    с наибольшим произведением населенности на насыщенность среди достаточно ярких.
+    """
+    if np is None or not data:
+        return None
+    try:
+        pixels = _sample_pixels(data)
+    except Exception as e:
+        logging.debug(f"Цвета обложки: не удалось декодировать изображение: {e}")
+        return None
+    if not len(pixels):
+        return None
+
+    shift = 8 - QUANT_BITS
+    quantized = (pixels >> shift).astype(np.int32)
+    bins = (quantized[:, 0] << (2 * QUANT_BITS)) | (quantized[:, 1] << QUANT_BITS) | quantized[:, 2]
+    size = 1 << (3 * QUANT_BITS)
+    counts = np.bincount(bins, minlength=size)
+    used = np.nonzero(counts)[0]
+    population = counts[used].astype(np.float32)
+    # Средний цвет каждой занятой корзины точнее ее центра
+    means = np.stack([np.bincount(bins, weights=pixels[:, channel], minlength=size)[used]
+                      for channel in range(3)], axis=1) / population[:, None]
+
+    high = means.max(axis=1)
+    low = means.min(axis=1)
+    value = high / 255.0
+    saturation = np.where(high > 0, (high - low) / np.maximum(high, 1), 0.0)
+
+    dominant = means[np.argmax(population)]
+    score = population * saturation
+    score[(saturation < MIN_ACCENT_SATURATION) | (value < MIN_ACCENT_VALUE)] = 0
+    accent = means[np.argmax(score)] if score.max() > 0 else dominant
+    return _pack(dominant), _pack(accent)
+
+
+def _pack(rgb):
+    r, g, b = (int(round(channel)) for channel in rgb)
+    return (r << 16) | (g << 8) | b
+
+
+def hue_bucket(color, buckets, min_saturation=MIN_ACCENT_SATURATION):
+    """Номер корзины оттенка 0..buckets-1 для цвета 0xRRGGBB или None для серых и почти черных цветов."""
+    if color is None:
+        return None
+    h, s, v = colorsys.rgb_to_hsv(((color >> 16) & 0xFF) / 255.0, ((color >> 8) & 0xFF) / 255.0,
+                                  (color & 0xFF) / 255.0)
+    if s < min_saturation or v < MIN_ACCENT_VALUE:
+        return None
+    return int(round(h * buckets)) % buckets
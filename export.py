@@ -0,0 +1,488 @@
+import io
+import os
+import json
+import time
+import base64
+import shutil
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PIL import Image
+from mutagen import File as MutagenFile
+from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3, APIC, ID3NoHeaderError
+from mutagen.oggvorbis import OggVorbis
+from mutagen.oggopus import OggOpus
+from mutagen.flac import Picture
+
+from fs_layer import LocalFileSystem
+from metadata_service import read_tags
+import archive
+
+try:
+    import vlc
+except (ImportError, OSError):
+    vlc = None
+
+MANIFEST_NAME = ".export_manifest.json"
+# Теги, переносимые в экспортированный файл (ключи в записи EasyID3 / Vorbis comment)
+COPIED_TAGS = ('title', 'artist', 'album', 'albumartist', 'tracknumber', 'discnumber', 'date', 'genre')
+# Обложка уменьшается до этого размера по большей стороне и сохраняется в JPEG
+COVER_MAX_SIDE = 500
+COVER_JPEG_QUALITY = 85
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportFormat:
+    """Целевой формат экспорта и его параметры для кодировщиков."""
+    __slots__ = ('name', 'extension', 'bitrate', 'sample_rate', 'vlc_codec', 'vlc_mux',
+                 'ffmpeg_codec', 'ffmpeg_muxer', 'tag_writer')
+
+    def __init__(self, name, extension, bitrate, sample_rate, vlc_codec, vlc_mux, ffmpeg_codec, ffmpeg_muxer,
+                 tag_writer):
+        self.name = name
+        self.extension = extension
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.vlc_codec = vlc_codec
+        self.vlc_mux = vlc_mux
+        self.ffmpeg_codec = ffmpeg_codec
+        self.ffmpeg_muxer = ffmpeg_muxer
+        self.tag_writer = tag_writer
+
+    @property
+    def profile(self):
+        """Строка параметров; при ее изменении ранее экспортированные файлы перекодируются."""
+        return f"{self.name}:{self.bitrate}:{self.sample_rate}"
+
+
+def _write_id3_tags(path, tags, cover):
+    try:
+        audio = EasyID3(path)
+    except ID3NoHeaderError:
+        audio = EasyID3()
+    for key, values in tags.items():
+        audio[key] = values
+    audio.save(path)
+    if cover is not None:
+        id3 = ID3(path)
+        id3.delall('APIC')
+        id3.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=cover[0]))
+        id3.save(path)
+
+
+def _write_vorbis_tags(audio_class):
+    def write(path, tags, cover):
+        audio = audio_class(path)
+        for key, values in tags.items():
+            audio[key] = values
+        if cover is not None:
+            data, width, height = cover
+            picture = Picture()
+            picture.type = 3
+            picture.mime = 'image/jpeg'
+            picture.width = width
+            picture.height = height
+            picture.depth = 24
+            picture.data = data
+            audio['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+        audio.save()
+    return write
+
+
+EXPORT_FORMATS = {
+    "mp3": ExportFormat("mp3", ".mp3", 192, 44100, "mp3", "raw", "libmp3lame", "mp3", _write_id3_tags),
+    "ogg": ExportFormat("ogg", ".ogg", 160, 44100, "vorb", "ogg", "libvorbis", "ogg",
+                        _write_vorbis_tags(OggVorbis)),
+    "opus": ExportFormat("opus", ".opus", 128, 48000, "opus", "ogg", "libopus", "ogg",
+                         _write_vorbis_tags(OggOpus)),
+}
+
+
+class VlcEncoder:
+    """Перекодирование через потоковый вывод libvlc (#transcode + std{access=file})."""
+    name = "vlc"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @staticmethod
+    def available():
+        if vlc is None:
+            return False
+        try:
+            return vlc.Instance("--quiet") is not None
+        except Exception:
+            return False
+
+    def _instance(self):
+        # Свой экземпляр libvlc в каждом рабочем потоке
+        instance = getattr(self._local, 'instance', None)
+        if instance is None:
+            instance = vlc.Instance("--quiet", "--no-video", "--no-sout-video")
+            self._local.instance = instance
+            self._local.archive_streams = archive.VlcArchiveStreams(vlc)
+        return instance
+
+    def encode(self, source, target, export_format, cancel_event=None):
+        """Возвращает False при отмене; ошибки кодирования - ExportError."""
+        destination = target.replace('\\', '\\\\').replace('"', '\\"')
+        instance = self._instance()
+        if archive.is_archive_member(source):
+            media = self._local.archive_streams.media(instance, source)
+        else:
+            media = instance.media_new(source)
+        media.add_option(
+            f":sout=#transcode{{vcodec=none,acodec={export_format.vlc_codec},ab={export_format.bitrate},"
+            f"channels=2,samplerate={export_format.sample_rate}}}"
+            f":std{{access=file,mux={export_format.vlc_mux},dst=\"{destination}\"}}")
+        player = media.player_new_from_media()
+        try:
+            player.play()
+            while True:
+                state = player.get_state()
+                if state == vlc.State.Ended:
+                    break
+                if state == vlc.State.Error:
+                    raise ExportError(f"libvlc не смог перекодировать {source}")
+                if cancel_event is None:
+                    time.sleep(0.05)
+                elif cancel_event.wait(0.05):
+                    return False
+        finally:
+            player.stop()
+            player.release()
+            media.release()
+        if not os.path.exists(target) or os.path.getsize(target) == 0:
+            raise ExportError(f"libvlc не записал данные для {source}")
+        return True
+
+
+class FfmpegEncoder:
+    """Перекодирование внешним ffmpeg (если установлен)."""
+    name = "ffmpeg"
+
+    def __init__(self, executable=None):
+        self.executable = executable or shutil.which("ffmpeg")
+
+    @staticmethod
+    def available():
+        return shutil.which("ffmpeg") is not None
+
+    def encode(self, source, target, export_format, cancel_event=None):
+        # Член архива передается ffmpeg через stdin из потока архива, без временного файла
+        member = archive.open_member(source) if archive.is_archive_member(source) else None
+        command = [self.executable, "-v", "error", "-y", "-i", "pipe:0" if member else source,
+                   "-vn", "-map_metadata", "-1",
+                   "-ac", "2", "-ar", str(export_format.sample_rate), "-c:a", export_format.ffmpeg_codec,
+                   "-b:a", f"{export_format.bitrate}k", "-f", export_format.ffmpeg_muxer, target]
+        if member is None:
+            command.insert(1, "-nostdin")
+        process = subprocess.Popen(command, stdin=subprocess.PIPE if member else subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        # communicate() здесь не подходит: без input он сразу закрывает stdin, который пишет поток подачи.
+        # stderr читается своим потоком, чтобы ffmpeg не встал на заполненном канале
+        stderr_chunks = []
+        stderr_thread = threading.Thread(target=self._drain, args=(process.stderr, stderr_chunks), daemon=True)
+        stderr_thread.start()
+        feeder = None
+        if member is not None:
+            feeder = threading.Thread(target=self._feed, args=(member, process.stdin), daemon=True)
+            feeder.start()
+        while True:
+            try:
+                process.wait(timeout=0.1)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_event is not None and cancel_event.is_set():
+                    process.kill()
+                    process.wait()
+                    break
+        if feeder is not None:
+            feeder.join()
+        stderr_thread.join()
+        if cancel_event is not None and cancel_event.is_set() and process.returncode != 0:
+            return False
+        if process.returncode != 0:
+            stderr = b"".join(stderr_chunks)
+            raise ExportError(f"ffmpeg: {stderr.decode('utf-8', 'replace').strip() or process.returncode}")
+        return True
+
+    @staticmethod
+    def _drain(stream, chunks):
+        with stream:
+            for chunk in iter(lambda: stream.read(4096), b""):
+                chunks.append(chunk)
+
+    @staticmethod
+    def _feed(member, stdin):
+        try:
+            with member:
+                shutil.copyfileobj(member, stdin, 256 * 1024)
+        except (OSError, ValueError):
+            # ffmpeg завершился (ошибка или отмена) и закрыл свой конец канала
+            pass
+        finally:
+            try:
+                stdin.close()
+            except (OSError, ValueError):
+                pass
+
+
+# Кодировщики по имени; сторонний кодировщик добавляется в этот словарь
+ENCODERS = {
+    VlcEncoder.name: VlcEncoder,
+    FfmpegEncoder.name: FfmpegEncoder,
+}
+
+
+def create_encoder(preferred=None):
+    """Возвращает доступный кодировщик (сначала preferred) или None."""
+    names = [preferred] if preferred in ENCODERS else []
+    names += [name for name in ENCODERS if name not in names]
+    for name in names:
+        if ENCODERS[name].available():
+            return ENCODERS[name]()
+    return None
+
+
+class ExportItem:
+    """Исходный файл и путь результата относительно папки экспорта (без расширения)."""
+    __slots__ = ('source', 'relative', 'artwork')
+
+    def __init__(self, source, relative, artwork=None):
+        self.source = source
+        self.relative = relative
+        # Изображение папки на случай, если в файле нет встроенной обложки
+        self.artwork = artwork
+
+
+def items_from_node(node):
+    """
+    Все треки папки библиотеки с вложенными папками; структура папок сохраняется начиная с имени node.
+    Для виртуального корня общего вида (несколько корней) экспортируется каждый корень.
+    """
+    if node.base_path == "":
+        return [item for child in node.folders for item in items_from_node(child)]
+    items = []
+    base = os.path.dirname(node.path())
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        folder_path = current.path()
+        relative_folder = os.path.relpath(folder_path, base)
+        artwork = current.find_artwork(current.name)
+        for file_name in current.files:
+            items.append(ExportItem(os.path.join(folder_path, file_name),
+                                    os.path.join(relative_folder, os.path.splitext(file_name)[0]), artwork))
+        stack.extend(current.folders)
+    return items
+
+
+def items_from_paths(paths, folder_name):
+    """Треки плейлиста в одну папку; номер в имени сохраняет порядок и разводит одинаковые имена."""
+    width = len(str(len(paths)))
+    items = []
+    for number, path in enumerate(paths, 1):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        items.append(ExportItem(path, os.path.join(folder_name, f"{number:0{width}d} {stem}")))
+    return items
+
+
+class ExportProgress:
+    __slots__ = ('files_done', 'files_total', 'bytes_done', 'bytes_total', 'encoded_bytes', 'elapsed')
+
+    def __init__(self, files_total, bytes_total):
+        self.files_done = 0
+        self.files_total = files_total
+        self.bytes_done = 0
+        self.bytes_total = bytes_total
+        self.encoded_bytes = 0
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """Скорость перекодирования в байтах исходных файлов в секунду."""
+        return self.encoded_bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Оценка оставшегося времени в секундах или None, пока скорость неизвестна."""
+        rate = self.throughput
+        return (self.bytes_total - self.bytes_done) / rate if rate > 0 else None
+
+
+class ExportResult:
+    __slots__ = ('total', 'exported', 'skipped', 'failed', 'cancelled', 'elapsed', 'encoded_bytes')
+
+    def __init__(self):
+        self.total = 0
+        self.exported = 0
+        self.skipped = 0
+        self.failed = 0
+        self.cancelled = False
+        self.elapsed = 0.0
+        self.encoded_bytes = 0
+
+
+class ExportJob:
+    """
+    Экспорт треков в папку назначения с перекодированием в пуле потоков
+    (кодирование идет в libvlc или во внешнем процессе, GIL не мешает).
+    Файл пишется во временный .part рядом с целевым и переименовывается только после
+    записи тегов, поэтому при отмене или ошибке неполных файлов не остается.
+    Манифест в папке назначения хранит состояние исходника (mtime, размер) и профиль формата:
+    уже экспортированные без изменений файлы пропускаются.
+    """
+
+    def __init__(self, items, destination, export_format, encoder, fs=None, max_workers=None):
+        self.items = items
+        self.destination = destination
+        self.format = export_format
+        self.encoder = encoder
+        self.fs = fs or LocalFileSystem()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._manifest_path = os.path.join(destination, MANIFEST_NAME)
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path, encoding='utf-8') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def _save_manifest(self, manifest):
+        temp_path = self._manifest_path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(manifest, file, ensure_ascii=False)
+            os.replace(temp_path, self._manifest_path)
+        except OSError as e:
+            logging.error(f"Экспорт: не удалось сохранить манифест {self._manifest_path}: {e}")
+
+    def _cover(self, item):
+        """Обложка для результата: встроенная или изображение папки, уменьшенная, в JPEG."""
+        data = None
+        try:
+            tags = read_tags(item.source)
+            data = tags[4] if tags is not None else None
+        except Exception as e:
+            logging.debug(f"Экспорт: не удалось прочитать обложку {item.source}: {e}")
+        source = io.BytesIO(data) if data else item.artwork
+        if source is None:
+            return None
+        try:
+            if isinstance(source, str) and archive.is_archive_member(source):
+                source = io.BytesIO(archive.read_file(source))
+            with Image.open(source) as image:
+                image.thumbnail((COVER_MAX_SIDE, COVER_MAX_SIDE))
+                image = image.convert('RGB')
+                buffer = io.BytesIO()
+                image.save(buffer, 'JPEG', quality=COVER_JPEG_QUALITY)
+                return buffer.getvalue(), image.width, image.height
+        except Exception as e:
+            logging.debug(f"Экспорт: не удалось подготовить обложку для {item.source}: {e}")
+            return None
+
+    def _source_tags(self, source):
+        try:
+            if archive.is_archive_member(source):
+                with archive.open_member(source) as member:
+                    audio = MutagenFile(member, easy=True)
+            else:
+                audio = MutagenFile(source, easy=True)
+        except Exception:
+            return {}
+        if audio is None or audio.tags is None:
+            return {}
+        return {key: list(audio.tags[key]) for key in COPIED_TAGS if key in audio.tags}
+
+    def _export_one(self, item, target, cancel_event):
+        """Перекодирует один файл. Возвращает False при отмене."""
+        if cancel_event is not None and cancel_event.is_set():
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        part_path = os.path.join(os.path.dirname(target), "." + os.path.basename(target) + ".part")
+        try:
+            if not self.encoder.encode(item.source, part_path, self.format, cancel_event):
+                return False
+            self.format.tag_writer(part_path, self._source_tags(item.source), self._cover(item))
+            os.replace(part_path, target)
+            return True
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    def run(self, progress=None, cancel_event=None):
+        """
+        Выполняет экспорт. progress(ExportProgress) вызывается из рабочих потоков
+        после каждого файла (под блокировкой, по одному вызову за раз).
+        """
+        start_time = time.perf_counter()
+        result = ExportResult()
+        manifest = self._load_manifest()
+        profile = self.format.profile
+        pending = []
+        result.total = len(self.items)
+        stats = self.fs.stat_many([item.source for item in self.items])
+        for item, stat_result in zip(self.items, stats):
+            if stat_result is None:
+                result.failed += 1
+                continue
+            relative = item.relative + self.format.extension
+            state = [item.source, stat_result.st_mtime_ns, stat_result.st_size, profile]
+            if manifest.get(relative) == state and os.path.exists(os.path.join(self.destination, relative)):
+                result.skipped += 1
+            else:
+                pending.append((item, relative, state, stat_result.st_size))
+
+        report = ExportProgress(len(pending), sum(size for *_, size in pending))
+        lock = threading.Lock()
+
+        def finished(size, encoded):
+            with lock:
+                report.files_done += 1
+                report.bytes_done += size
+                if encoded:
+                    report.encoded_bytes += size
+                report.elapsed = time.perf_counter() - start_time
+                if progress is not None:
+                    progress(report)
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="export")
+        try:
+            futures = {pool.submit(self._export_one, item, os.path.join(self.destination, relative), cancel_event):
+                       (item, relative, state, size) for item, relative, state, size in pending}
+            for future in as_completed(futures):
+                item, relative, state, size = futures[future]
+                try:
+                    exported = future.result()
+                except Exception as e:
+                    logging.error(f"Экспорт: ошибка {item.source}: {e}")
+                    result.failed += 1
+                    finished(size, False)
+                    continue
+                # После отмены оставшиеся задачи завершаются сразу, не начиная кодирование
+                if exported:
+                    result.exported += 1
+                    manifest[relative] = state
+                    finished(size, True)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            # Завершенные файлы попадают в манифест и при отмене
+            self._save_manifest(manifest)
+
+        result.cancelled = cancel_event is not None and cancel_event.is_set()
+        result.elapsed = time.perf_counter() - start_time
+        result.encoded_bytes = report.encoded_bytes
+        logging.info(f"Экспорт в {self.destination}: {result.exported} перекодировано, {result.skipped} без изменений, "
+                     f"ошибок {result.failed}, {result.elapsed:.1f} с, "
+                     f"{result.encoded_bytes / max(result.elapsed, 1e-9) / (1024 * 1024):.1f} МБ/с"
+                     f"{' (отменено)' if result.cancelled else ''}")
+        return result
@@ -0,0 +1,259 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import archive
+
+
+class FileSystem:
+    """
+    Абстракция файловой системы для всего ввода-вывода библиотеки.
+    Листинг папки возвращается кортежем пар (имя, является_папкой).
+    """
+
+    def listdir(self, path):
+        """Возвращает кортеж (имя, is_dir) или None, если папка недоступна."""
+        raise NotImplementedError
+
+    def stat(self, path):
+        """Возвращает os.stat_result или None, если путь недоступен."""
+        raise NotImplementedError
+
+    def listdir_many(self, paths):
+        return [self.listdir(path) for path in paths]
+
+    def stat_many(self, paths):
+        return [self.stat(path) for path in paths]
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        return self.listdir(path) is not None
+
+    def invalidate(self, path=None, recursive=False):
+        """
+        Сбрасывает кэш для пути (recursive - и для всего под ним) или весь кэш;
+        у некэширующих реализаций ничего не делает.
+        """
+
+    def walk(self, top, archive_extensions=()):
+        """
+        Обход дерева папок в ширину, аналог os.walk (символические ссылки на папки не обходятся).
+        Все папки одного уровня запрашиваются через listdir_many, что позволяет
+        медленным бэкендам выполнять запросы параллельно.
+        Файлы с расширениями archive_extensions обходятся как папки (их листинг дает бэкенд).
+        """
+        pending = [top]
+        while pending:
+            listings = self.listdir_many(pending)
+            next_pending = []
+            for path, entries in zip(pending, listings):
+                if entries is None:
+                    continue
+                dirs = [name for name, is_dir in entries
+                        if is_dir or (archive_extensions and name.lower().endswith(archive_extensions))]
+                files = [name for name, is_dir in entries
+                         if not is_dir and not (archive_extensions and name.lower().endswith(archive_extensions))]
+                yield path, dirs, files
+                next_pending.extend(os.path.join(path, name) for name in dirs)
+            pending = next_pending
+
+
+class LocalFileSystem(FileSystem):
+    """
+    Прямой доступ к локальной файловой системе.
+    Пути внутри архивов (archive.py) отвечаются из оглавления архива: обычный вызов
+    для них завершается ошибкой, поэтому обычные пути ничего не теряют.
+    """
+
+    def listdir(self, path):
+        try:
+            with os.scandir(path) as it:
+                return tuple((entry.name, entry.is_dir(follow_symlinks=False)) for entry in it)
+        except NotADirectoryError:
+            return archive.listdir(path)
+        except OSError:
+            return None
+
+    def stat(self, path):
+        try:
+            return os.stat(path)
+        except (NotADirectoryError, FileNotFoundError):
+            return archive.member_stat(path)
+        except OSError:
+            return None
+
+
+class CachingFileSystem(FileSystem):
+    """
+    Обертка с кэшированием листингов и stat по TTL и параллельным выполнением запросов.
+    Проверка существования файла отвечается из листинга родительской папки,
+    если он уже есть в кэше, поэтому после сканирования такие проверки не обращаются к диску.
+    Оба кэша - LRU не больше max_entries записей; при вставке устаревшие записи
+    из начала очереди удаляются, поэтому сканирование большой библиотеки не держит stat каждого файла.
+    """
+
+    def __init__(self, backend, ttl=30.0, max_workers=8, max_entries=65536):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._listings = OrderedDict()
+        self._stats = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fs")
+
+    def _cached(self, cache, path):
+        with self._lock:
+            entry = cache.get(path)
+            if entry is not None:
+                cache.move_to_end(path)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return True, entry[1]
+        return False, None
+
+    def _store(self, cache, path, value):
+        now = time.monotonic()
+        with self._lock:
+            cache[path] = (now, value)
+            cache.move_to_end(path)
+            # В начале очереди - давно не использованные записи: сначала уходят устаревшие, затем лишние
+            while cache:
+                oldest_path, (stored_at, _) = next(iter(cache.items()))
+                if len(cache) <= self.max_entries and now - stored_at < self.ttl:
+                    break
+                del cache[oldest_path]
+
+    def listdir(self, path):
+        hit, entries = self._cached(self._listings, path)
+        if hit:
+            return entries
+        entries = self.backend.listdir(path)
+        self._store(self._listings, path, entries)
+        return entries
+
+    def stat(self, path):
+        hit, result = self._cached(self._stats, path)
+        if hit:
+            return result
+        result = self.backend.stat(path)
+        self._store(self._stats, path, result)
+        return result
+
+    def listdir_many(self, paths):
+        return list(self._pool.map(self.listdir, paths))
+
+    def stat_many(self, paths):
+        return list(self._pool.map(self.stat, paths))
+
+    def _parent_entry(self, path):
+        """Ищет путь в кэшированном листинге родителя: (найден_листинг, is_dir или None)."""
+        parent, name = os.path.split(path)
+        hit, entries = self._cached(self._listings, parent)
+        if not hit:
+            return False, None
+        if entries is None:
+            return True, None
+        for entry_name, is_dir in entries:
+            if entry_name == name:
+                return True, is_dir
+        return True, None
+
+    def exists(self, path):
+        hit, is_dir = self._parent_entry(path)
+        if hit:
+            return is_dir is not None
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        hit, is_dir = self._parent_entry(path)
+        if hit:
+            return bool(is_dir)
+        return self.listdir(path) is not None
+
+    def prefetch(self, paths):
+        """Асинхронно заполняет кэш листингов для папок, которые скоро понадобятся."""
+        for path in paths:
+            self._pool.submit(self.listdir, path)
+
+    def invalidate(self, path=None, recursive=False):
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+                self._stats.clear()
+                return
+            self._listings.pop(path, None)
+            self._stats.pop(path, None)
+            if recursive:
+                # Один проход по кэшам: записи других корней библиотеки остаются
+                prefix = os.path.join(path, "")
+                for cache in (self._listings, self._stats):
+                    for cached_path in [cached_path for cached_path in cache if cached_path.startswith(prefix)]:
+                        del cache[cached_path]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+class LatencyFileSystem(FileSystem):
+    """
+    Тестовый бэкенд: локальная файловая система с искусственной задержкой каждого вызова.
+    Позволяет измерять поведение на медленных SMB/NFS-ресурсах на обычной машине.
+    """
+
+    def __init__(self, backend=None, latency=0.02, jitter=0.0):
+        self.backend = backend or LocalFileSystem()
+        self.latency = latency
+        self.jitter = jitter
+        self.call_count = 0
+        self._lock = threading.Lock()
+
+    def _delay(self):
+        with self._lock:
+            self.call_count += 1
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def listdir(self, path):
+        self._delay()
+        return self.backend.listdir(path)
+
+    def stat(self, path):
+        self._delay()
+        return self.backend.stat(path)
+
+
+def create_file_system(slow_storage=False, latency_ms=0):
+    """
+    Создает файловую систему для библиотеки.
+    slow_storage включает кэширование с длинным TTL и больше параллельных запросов,
+    latency_ms > 0 подставляет тестовый бэкенд с задержкой.
+    """
+    backend = LocalFileSystem()
+    if latency_ms > 0:
+        backend = LatencyFileSystem(backend, latency=latency_ms / 1000.0)
+        logging.info(f"Файловая система: тестовая задержка {latency_ms} мс на вызов")
+    if slow_storage:
+        return CachingFileSystem(backend, ttl=300.0, max_workers=32, max_entries=262144)
+    return CachingFileSystem(backend, ttl=30.0, max_workers=8)
+
+
+if __name__ == '__main__':
+    # Замер сканирования папки с искусственной задержкой: python fs_layer.py <папка> [мс]
+    import sys
+    from library_tree import scan_library
+
+    logging.basicConfig(level=logging.INFO)
+    folder = sys.argv[1]
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    for slow_storage in (False, True):
+        fs = create_file_system(slow_storage=slow_storage, latency_ms=latency_ms)
+        start = time.perf_counter()
+        tree = scan_library(folder, ('.mp3', '.flac', '.wav'), fs=fs)
+        elapsed = time.perf_counter() - start
+        print(f"slow_storage={slow_storage}: {tree.file_count} файлов за {elapsed:.2f} с, "
+              f"вызовов бэкенда: {getattr(fs.backend, 'call_count', 'не считаются')}")
+        fs.shutdown()
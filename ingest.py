@@ -0,0 +1,181 @@
+import os
+import time
+import hashlib
+import logging
+import multiprocessing
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from fs_layer import LocalFileSystem
+from metadata_service import read_tags
+from cover_colors import extract_colors
+
+
+def ingest_chunk(entries):
+    """
+    Выполняется в процессе пула: разбирает теги пачки файлов.
+    entries - список (путь, mtime_ns, размер); возвращает строки в порядке TRACK_COLUMNS
+    и цвета обложек (cover_hash, dominant, accent) - по одному разу на обложку в пачке.
+    """
+    rows = []
+    colors = {}
+    for path, mtime_ns, size in entries:
+        title = artist = album = genre = cover_hash = error = None
+        duration_ms = rating = 0
+        try:
+            tags = read_tags(path)
+            if tags is not None:
+                title, artist, album, duration_ms, cover_data, genre, rating = tags
+                if cover_data:
+                    cover_hash = hashlib.sha1(cover_data).hexdigest()
+                    if cover_hash not in colors:
+                        colors[cover_hash] = extract_colors(cover_data)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        rows.append((path, os.path.dirname(path), mtime_ns, size, title, artist, album, genre, rating,
+                     duration_ms, cover_hash, error))
+    return rows, [(cover_hash,) + pair for cover_hash, pair in colors.items() if pair is not None]
+
+
+class IngestResult:
+    __slots__ = ('total', 'skipped', 'parsed', 'errors', 'removed', 'cancelled', 'elapsed')
+
+    def __init__(self):
+        self.total = 0
+        self.skipped = 0
+        self.parsed = 0
+        self.errors = 0
+        self.removed = 0
+        self.cancelled = False
+        self.elapsed = 0.0
+
+    @property
+    def done(self):
+        return self.skipped + self.parsed
+
+
+class IngestPipeline:
+    """
+    Конвейер индексации библиотеки: пути читаются потоком, неизмененные файлы
+    отсеиваются по индексу, остальные пачками по chunk_size разбираются в пуле процессов.
+    В работе одновременно не больше max_pending_chunks пачек (обратное давление),
+    результаты пишутся в индекс транзакциями по batch_size строк.
+    """
+
+    def __init__(self, index, fs=None, max_workers=None, chunk_size=32, batch_size=512,
+                 max_pending_chunks=None, mp_context=None):
+        self.index = index
+        # spawn по умолчанию: fork многопоточного процесса с Qt и libvlc небезопасен
+        self.mp_context = mp_context or multiprocessing.get_context("spawn")
+        self.fs = fs or LocalFileSystem()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.max_pending_chunks = max_pending_chunks or self.max_workers * 2
+
+    def _changed_chunks(self, paths, known, result):
+        """Нарезает поток путей на пачки, пропуская файлы, уже проиндексированные с тем же mtime и размером."""
+        paths = iter(paths)
+        while True:
+            batch = list(islice(paths, self.chunk_size))
+            if not batch:
+                return
+            chunk = []
+            for path, stat_result in zip(batch, self.fs.stat_many(batch)):
+                result.total += 1
+                if stat_result is None:
+                    result.skipped += 1
+                    continue
+                state = (stat_result.st_mtime_ns, stat_result.st_size)
+                if known.pop(path, None) == state:
+                    result.skipped += 1
+                else:
+                    chunk.append((path, state[0], state[1]))
+            yield chunk
+
+    def run(self, paths, root_folder=None, total=None, progress=None, cancel_event=None):
+        """
+        Индексирует файлы из итерируемого paths. progress(готово, всего) вызывается
+        из этого потока после каждой пачки. При успешном завершении записи
+        файлов под root_folder, которых больше нет на диске, удаляются из индекса.
+        """
+        start_time = time.perf_counter()
+        result = IngestResult()
+        known = self.index.file_states(root_folder)
+        pending_rows = []
+        pending_colors = []
+        in_flight = set()
+
+        def cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        def collect(futures):
+            for future in futures:
+                rows, colors = future.result()
+                result.parsed += len(rows)
+                result.errors += sum(1 for row in rows if row[-1] is not None)
+                pending_rows.extend(rows)
+                pending_colors.extend(colors)
+            if len(pending_rows) >= self.batch_size:
+                # Цвета пишутся раньше треков: подписчики индекса сразу находят их по хэшу обложки
+                self.index.write_cover_colors(pending_colors)
+                self.index.write_batch(pending_rows)
+                pending_rows.clear()
+                pending_colors.clear()
+            if progress is not None:
+                progress(result.done, max(total or 0, result.total))
+
+        executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context)
+        try:
+            for chunk in self._changed_chunks(paths, known, result):
+                if cancelled():
+                    break
+                while len(in_flight) >= self.max_pending_chunks and not cancelled():
+                    done, in_flight = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if chunk:
+                    in_flight.add(executor.submit(ingest_chunk, chunk))
+                elif progress is not None:
+                    progress(result.done, max(total or 0, result.total))
+
+            while in_flight and not cancelled():
+                done, in_flight = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                collect(done)
+            result.cancelled = cancelled()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for future in in_flight:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    rows, colors = future.result()
+                    pending_rows.extend(rows)
+                    pending_colors.extend(colors)
+            # Уже разобранные строки сохраняются и при отмене - следующий запуск их пропустит
+            self.index.write_cover_colors(pending_colors)
+            self.index.write_batch(pending_rows)
+
+        if not result.cancelled and root_folder is not None and known:
+            result.removed = len(known)
+            self.index.remove_paths(known)
+
+        result.elapsed = time.perf_counter() - start_time
+        logging.info(f"Индексация: {result.total} файлов, разобрано {result.parsed}, "
+                     f"пропущено {result.skipped}, ошибок {result.errors}, удалено {result.removed}, "
+                     f"{result.elapsed:.1f} с{' (отменено)' if result.cancelled else ''}")
+        return result
+
+
+if __name__ == '__main__':
+    # Замер пропускной способности: python ingest.py <папка> [процессов]
+    import sys
+    import tempfile
+    from library_index import LibraryIndex
+    from library_tree import scan_library
+
+    tree = scan_library(sys.argv[1], ('.mp3', '.flac', '.wav', '.ogg'))
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    # Отдельная временная база, чтобы каждый замер разбирал все файлы заново
+    index = LibraryIndex(os.path.join(tempfile.mkdtemp(), "benchmark.sqlite3"))
+    pipeline = IngestPipeline(index, max_workers=workers)
+    outcome = pipeline.run(tree.iter_file_paths(), root_folder=tree.root_folder, total=tree.file_count)
+    if outcome.elapsed > 0:
+        print(f"{outcome.parsed / outcome.elapsed:.0f} файлов/с на {pipeline.max_workers} процессах")
@@ -0,0 +1,543 @@
+import os
+import mmap
+import time
+import shutil
+import struct
+import hashlib
+import logging
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from seek_index import parse_frame_header, _id3v2_size, _find_first_frame
+import archive
+
+try:
+    import numpy as np
+except ImportError:
+    # Без NumPy и утилиты flac CRC кадров FLAC не проверяется: побайтовый расчет слишком медленный
+    np = None
+try:
+    import soundfile
+except ImportError:
+    # Без soundfile подпись MD5 FLAC сверяется только утилитой flac, если она установлена
+    soundfile = None
+
+# Состояния проверки: damaged - ошибки в отдельных кадрах (играет со сбоями),
+# broken - контейнер не разбирается или в файле нет звука
+STATUS_OK = "ok"
+STATUS_DAMAGED = "damaged"
+STATUS_BROKEN = "broken"
+STATUS_UNSUPPORTED = "unsupported"
+PROBLEM_STATUSES = (STATUS_DAMAGED, STATUS_BROKEN)
+
+# В отчете о файле перечисляется не больше стольких смещений с ошибками
+MAX_REPORTED_ERRORS = 5
+
+FLAC_BLOCK_SIZES = {1: 192, 2: 576, 3: 1152, 4: 2304, 5: 4608,
+                    8: 256, 9: 512, 10: 1024, 11: 2048, 12: 4096, 13: 8192, 14: 16384, 15: 32768}
+# Поиск следующего кадра FLAC без max_framesize в STREAMINFO ограничен этим расстоянием
+FLAC_MAX_FRAME_SEARCH = 16 * 1024 * 1024
+# Объем кадров FLAC (байт), который обрабатывается одним векторным проходом CRC-16
+FLAC_CRC_BATCH_BYTES = 16 * 1024 * 1024
+
+
+def _crc_table(poly, width):
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & mask if crc & top else (crc << 1) & mask
+        table.append(crc)
+    return tuple(table)
+
+
+CRC8_TABLE = _crc_table(0x07, 8)
+CRC16_TABLE = _crc_table(0x8005, 16)
+
+
+def crc8(data, crc=0):
+    table = CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+
+def crc16(data, crc=0):
+    """CRC-16 с многочленом 0x8005 без отражения (кадры FLAC; для MPEG начальное значение 0xFFFF)."""
+    table = CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+_crc16_word_table = None
+
+
+def _crc16_words():
+    """Таблица CRC-16 на 16 бит за шаг: регистр шириной 16 бит сразу сдвигается на два байта."""
+    global _crc16_word_table
+    if _crc16_word_table is None:
+        table = np.array(CRC16_TABLE, dtype=np.uint16)
+        crc = np.arange(1 << 16, dtype=np.uint16)
+        for _ in range(2):
+            crc = (crc << 8) ^ table[crc >> 8]
+        _crc16_word_table = crc
+    return _crc16_word_table
+
+
+def crc16_many(data, spans):
+    """
+    CRC-16 (начальное значение 0) участков data[start:end] для списка spans. Требует NumPy.
+    Участки пачки выравниваются нулями слева (при нулевом начальном значении ведущие нули
+    CRC не меняют) и считаются одновременно по 16 бит: шаг NumPy на пару байт всех участков
+    вместо шага Python на каждый байт.
+    """
+    words_table = _crc16_words()
+    result = []
+    batch_start = 0
+    while batch_start < len(spans):
+        # Пачка ограничена объемом выровненного блока, а не числом участков
+        width = 0
+        batch_end = batch_start
+        while batch_end < len(spans):
+            span_width = spans[batch_end][1] - spans[batch_end][0]
+            new_width = max(width, span_width + (span_width & 1))
+            if batch_end > batch_start and new_width * (batch_end - batch_start + 1) > FLAC_CRC_BATCH_BYTES:
+                break
+            width = new_width
+            batch_end += 1
+        batch = spans[batch_start:batch_end]
+        # Строка блока - байты с одним смещением во всех участках, поэтому шаг идет по строкам
+        block = np.zeros((width, len(batch)), dtype=np.uint8)
+        for row, (start, end) in enumerate(batch):
+            block[width - (end - start):, row] = np.frombuffer(data[start:end], dtype=np.uint8)
+        words = (block[0::2].astype(np.uint16) << 8) | block[1::2]
+        crc = np.zeros(len(batch), dtype=np.uint16)
+        for word in words:
+            crc = words_table[crc ^ word]
+        result.extend(crc.tolist())
+        batch_start = batch_end
+    return result
+
+
+class _Report:
+    """Накопитель ошибок одного файла: счетчик и первые смещения для отчета."""
+    __slots__ = ('errors', 'messages')
+
+    def __init__(self):
+        self.errors = 0
+        self.messages = []
+
+    def add(self, offset, message):
+        self.errors += 1
+        if len(self.messages) < MAX_REPORTED_ERRORS:
+            self.messages.append(f"{message} @{offset}")
+
+    def result(self, summary):
+        if not self.errors:
+            return STATUS_OK, summary
+        more = f" и еще {self.errors - len(self.messages)}" if self.errors > len(self.messages) else ""
+        return STATUS_DAMAGED, f"{summary}; ошибок: {self.errors}: {', '.join(self.messages)}{more}"
+
+
+def _mpeg_audio_end(mm, size):
+    """Конец аудиоданных MP3 без завершающих тегов ID3v1 и APEv2."""
+    end = size
+    if end >= 128 and mm[end - 128:end - 125] == b'TAG':
+        end -= 128
+    if end >= 32 and mm[end - 32:end - 24] == b'APETAGEX':
+        tag_size = struct.unpack_from('<I', mm, end - 20)[0]
+        flags = struct.unpack_from('<I', mm, end - 12)[0]
+        end -= tag_size + (32 if flags & 0x80000000 else 0)
+    return max(0, end)
+
+
+def verify_mp3(mm, size):
+    """
+    Проходит по всем кадрам MPEG audio: потеря синхронизации (мусор между кадрами),
+    CRC-16 защищенных кадров Layer III (заголовок и side info) и обрезанный последний кадр.
+    """
+    start = _id3v2_size(mm)
+    end = _mpeg_audio_end(mm, size)
+    pos, info = _find_first_frame(mm, start, end)
+    if pos < 0:
+        return STATUS_BROKEN, "не найдено ни одного кадра MPEG audio"
+    report = _Report()
+    unpack = struct.Struct('>I').unpack_from
+    frames = checked = 0
+    while pos + 4 <= end:
+        header = unpack(mm, pos)[0]
+        info = parse_frame_header(header)
+        if info is None:
+            resync, info = _find_first_frame(mm, pos + 1, end)
+            if resync < 0:
+                report.add(pos, f"мусор в конце ({end - pos} байт)")
+                break
+            report.add(pos, f"потеря синхронизации ({resync - pos} байт)")
+            pos = resync
+            header = unpack(mm, pos)[0]
+        frame_length, _, _, version, channel_mode = info
+        if pos + frame_length > end:
+            report.add(pos, "обрезан последний кадр")
+            break
+        # Бит защиты 0 - за заголовком идет CRC-16; проверяется только Layer III,
+        # где CRC покрывает side info фиксированной длины
+        if not header & 0x10000 and (header >> 17) & 3 == 1:
+            if version == 1:
+                side_info = 17 if channel_mode == 3 else 32
+            else:
+                side_info = 9 if channel_mode == 3 else 17
+            crc = crc16(mm[pos + 6:pos + 6 + side_info], crc16(mm[pos + 2:pos + 4], 0xFFFF))
+            if crc != struct.unpack_from('>H', mm, pos + 4)[0]:
+                report.add(pos, "неверная CRC кадра")
+            checked += 1
+        frames += 1
+        pos += frame_length
+    return report.result(f"кадров: {frames}, с CRC: {checked}")
+
+
+def _read_utf8_number(mm, pos):
+    """Число в «UTF-8» кодировке заголовка кадра FLAC. Возвращает (число, длина) или (None, 0)."""
+    first = mm[pos]
+    if first < 0x80:
+        return first, 1
+    length = 0
+    mask = 0x80
+    while first & mask and length < 8:
+        length += 1
+        mask >>= 1
+    if length < 2 or length > 7:
+        return None, 0
+    value = first & (mask - 1)
+    for i in range(1, length):
+        byte = mm[pos + i]
+        if byte & 0xC0 != 0x80:
+            return None, 0
+        value = (value << 6) | (byte & 0x3F)
+    return value, length
+
+
+def _parse_flac_header(mm, pos, end):
+    """
+    Разбирает заголовок кадра FLAC и проверяет его CRC-8.
+    Возвращает (номер кадра или первого сэмпла, размер блока, длина заголовка) или None.
+    """
+    if pos + 6 > end:
+        return None
+    block_code = mm[pos + 2] >> 4
+    rate_code = mm[pos + 2] & 0x0F
+    if block_code == 0 or rate_code == 15 or mm[pos + 3] >> 4 > 10 or mm[pos + 3] & 1:
+        return None
+    number, length = _read_utf8_number(mm, pos + 4)
+    if number is None:
+        return None
+    cursor = pos + 4 + length
+    if block_code == 6:
+        block_size = mm[cursor] + 1
+        cursor += 1
+    elif block_code == 7:
+        block_size = struct.unpack_from('>H', mm, cursor)[0] + 1
+        cursor += 2
+    else:
+        block_size = FLAC_BLOCK_SIZES[block_code]
+    cursor += {12: 1, 13: 2, 14: 2}.get(rate_code, 0)
+    if cursor >= end or crc8(mm[pos:cursor]) != mm[cursor]:
+        return None
+    return number, block_size, cursor + 1 - pos
+
+
+def _flac_md5(path, bits_per_sample):
+    """MD5 декодированных сэмплов (как в STREAMINFO) через soundfile или None."""
+    if soundfile is None or path is None or bits_per_sample not in (8, 16, 24):
+        return None
+    digest = hashlib.md5()
+    dtype = 'int16' if bits_per_sample <= 16 else 'int32'
+    for block in soundfile.blocks(path, blocksize=65536, dtype=dtype, always_2d=True):
+        if bits_per_sample == 8:
+            block = (block >> 8).astype('<i1')
+        elif bits_per_sample == 24:
+            # libsndfile отдает 24-битные сэмплы сдвинутыми в старшие разряды int32
+            block = (block >> 8).astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3]
+        digest.update(np.ascontiguousarray(block).tobytes())
+    return digest.digest()
+
+
+def _verify_flac_tool(tool, path):
+    """Полная проверка утилитой flac: CRC всех кадров и MD5 декодированного звука."""
+    process = subprocess.run([tool, "--test", "--silent", path], capture_output=True, text=True,
+                             errors="replace")
+    if process.returncode == 0:
+        return STATUS_OK, "flac --test: ошибок нет"
+    lines = [line.strip() for line in process.stderr.splitlines() if line.strip()]
+    return STATUS_DAMAGED, "flac --test: " + (lines[-1] if lines else f"код {process.returncode}")
+
+
+def verify_flac(mm, size, path):
+    """
+    Разбирает блоки метаданных и проходит по кадрам: CRC-8 заголовков, CRC-16 кадров,
+    непрерывность нумерации и число сэмплов из STREAMINFO. Подпись MD5 сверяется утилитой flac
+    (она же проверяет кадры на C) или, без нее, декодированием через soundfile.
+    Без утилиты flac CRC-16 кадров считается пачками через NumPy, без NumPy - пропускается.
+    path=None (член архива) - только проверка кадров.
+    """
+    if mm[:4] != b'fLaC':
+        return STATUS_BROKEN, "нет сигнатуры fLaC"
+    pos = 4
+    streaminfo = None
+    while True:
+        if pos + 4 > size:
+            return STATUS_BROKEN, "обрезаны блоки метаданных"
+        block_header = mm[pos]
+        block_length = int.from_bytes(mm[pos + 1:pos + 4], 'big')
+        if block_header & 0x7F == 0 and block_length >= 34:
+            streaminfo = mm[pos + 4:pos + 4 + 34]
+        pos += 4 + block_length
+        if block_header & 0x80:
+            break
+    if streaminfo is None or len(streaminfo) < 34:
+        return STATUS_BROKEN, "нет блока STREAMINFO"
+    if pos >= size:
+        return STATUS_BROKEN, "нет аудиокадров"
+    max_frame_size = int.from_bytes(streaminfo[7:10], 'big')
+    packed = int.from_bytes(streaminfo[10:18], 'big')
+    bits_per_sample = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    md5 = bytes(streaminfo[18:34])
+
+    tool = shutil.which("flac") if path is not None else None
+    if tool is not None:
+        return _verify_flac_tool(tool, path)
+
+    end = size - 128 if size >= 128 and mm[size - 128:size - 125] == b'TAG' else size
+    sync = mm[pos:pos + 2]
+    current = _parse_flac_header(mm, pos, end) if sync in (b'\xff\xf8', b'\xff\xf9') else None
+    if current is None:
+        return STATUS_BROKEN, "не найден первый аудиокадр"
+    variable = sync == b'\xff\xf9'
+    report = _Report()
+    search_limit = (max_frame_size or FLAC_MAX_FRAME_SEARCH) + 16
+    frames = samples = 0
+    # Участки кадров (без поля CRC) для пакетной проверки CRC-16 после прохода
+    crc_spans = []
+    while pos < end:
+        number, block_size, header_length = current
+        expected = number + (block_size if variable else 1)
+        next_pos, following = -1, None
+        search = mm.find(sync, pos + header_length, min(end, pos + search_limit))
+        while search >= 0:
+            following = _parse_flac_header(mm, search, end)
+            if following is not None and following[0] >= expected:
+                next_pos = search
+                break
+            search = mm.find(sync, search + 1, min(end, pos + search_limit))
+        frame_end = next_pos if next_pos >= 0 else end
+        if next_pos >= 0 and following[0] != expected:
+            report.add(pos, "пропущены кадры")
+        elif next_pos < 0 and end - pos > search_limit:
+            report.add(pos, "потеря синхронизации до конца файла")
+            break
+        else:
+            crc_spans.append((pos, frame_end - 2))
+        frames += 1
+        samples += block_size
+        if next_pos < 0:
+            break
+        pos, current = next_pos, following
+
+    summary = f"кадров: {frames}"
+    if np is None:
+        summary += ", CRC кадров не проверена (нет flac и NumPy)"
+    else:
+        for (start, crc_pos), crc in zip(crc_spans, crc16_many(mm, crc_spans)):
+            if crc != struct.unpack_from('>H', mm, crc_pos)[0]:
+                report.add(start, "неверная CRC кадра")
+    if total_samples and samples != total_samples:
+        report.add(end, f"сэмплов {samples} вместо {total_samples}")
+    if report.errors or not any(md5):
+        return report.result(summary)
+    try:
+        decoded = _flac_md5(path, bits_per_sample)
+    except Exception as e:
+        report.add(0, f"ошибка декодирования: {e}")
+        return report.result(summary)
+    if decoded is None:
+        return report.result(summary + ", MD5 не проверена")
+    if decoded != md5:
+        report.add(0, "подпись MD5 не совпадает")
+    return report.result(summary + ", MD5 совпадает")
+
+
+def verify_wav(mm, size):
+    """Проверяет размеры чанков RIFF: заголовок, fmt и data не выходят за пределы файла."""
+    if size < 12 or mm[:4] != b'RIFF' or mm[8:12] != b'WAVE':
+        if mm[:4] in (b'RF64', b'BW64'):
+            return STATUS_UNSUPPORTED, "RF64 не проверяется"
+        return STATUS_BROKEN, "нет заголовка RIFF/WAVE"
+    report = _Report()
+    riff_end = 8 + struct.unpack_from('<I', mm, 4)[0]
+    if riff_end > size:
+        report.add(4, f"размер RIFF больше файла на {riff_end - size} байт")
+        riff_end = size
+    pos = 12
+    block_align = data_size = None
+    while pos + 8 <= riff_end:
+        chunk_id = bytes(mm[pos:pos + 4])
+        chunk_size = struct.unpack_from('<I', mm, pos + 4)[0]
+        body = pos + 8
+        if body + chunk_size > riff_end:
+            report.add(pos, f"чанк {chunk_id!r} выходит за конец файла на {body + chunk_size - riff_end} байт")
+            chunk_size = riff_end - body
+        if chunk_id == b'fmt ' and chunk_size >= 16:
+            block_align = struct.unpack_from('<H', mm, body + 12)[0]
+        elif chunk_id == b'data':
+            data_size = chunk_size
+        pos = body + chunk_size + (chunk_size & 1)
+    if block_align is None:
+        return STATUS_BROKEN, "нет чанка fmt"
+    if data_size is None:
+        return STATUS_BROKEN, "нет чанка data"
+    if block_align and data_size % block_align:
+        report.add(0, f"размер data не кратен блоку {block_align}")
+    return report.result(f"данных: {data_size} байт")
+
+
+def _verify_data(extension, data, size, path):
+    if extension == '.mp3':
+        return verify_mp3(data, size)
+    if extension == '.flac':
+        return verify_flac(data, size, path)
+    return verify_wav(data, size)
+
+
+def verify_file(path):
+    """
+    Проверяет структуру файла, читая его через mmap последовательно от начала до конца.
+    Член архива в память не отображается и читается из потока архива целиком.
+    Возвращает (состояние, подробности). OSError (файл недоступен) пробрасывается.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ('.mp3', '.flac', '.wav'):
+        return STATUS_UNSUPPORTED, None
+    if archive.is_archive_member(path):
+        data = archive.read_file(path)
+        if not data:
+            return STATUS_BROKEN, "пустой файл"
+        return _verify_data(extension, data, len(data), None)
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return STATUS_BROKEN, "пустой файл"
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            return _verify_data(extension, mm, size, path)
+
+
+def verify_chunk(entries):
+    """
+    Выполняется в процессе пула: проверяет пачку файлов.
+    entries - список (путь, mtime_ns, размер) из индекса; файлы, изменившиеся с индексации
+    или недоступные, пропускаются. Возвращает строки (path, mtime_ns, size, status, detail, checked_at).
+    """
+    rows = []
+    for path, mtime_ns, size in entries:
+        try:
+            stat_result = archive.stat_path(path)
+            if (stat_result.st_mtime_ns, stat_result.st_size) != (mtime_ns, size):
+                continue
+            status, detail = verify_file(path)
+        except OSError:
+            continue
+        except Exception as e:
+            status, detail = STATUS_BROKEN, f"ошибка разбора: {e or type(e).__name__}"
+        rows.append((path, mtime_ns, size, status, detail, int(time.time())))
+    return rows
+
+
+class IntegrityResult:
+    __slots__ = ('total', 'checked', 'problems', 'cancelled', 'elapsed')
+
+    def __init__(self):
+        self.total = 0
+        self.checked = 0
+        self.problems = 0
+        self.cancelled = False
+        self.elapsed = 0.0
+
+
+class IntegrityChecker:
+    """
+    Фоновая проверка целостности файлов библиотеки. Проверяются только треки индекса,
+    у которых нет результата для текущих mtime и размера, поэтому повторный запуск
+    после изменения нескольких файлов читает только их. Пачки по chunk_size файлов
+    проверяются в пуле процессов с тем же обратным давлением, что и IngestPipeline.
+    """
+
+    def __init__(self, index, max_workers=None, chunk_size=4, batch_size=64, mp_context=None):
+        self.index = index
+        self.mp_context = mp_context or multiprocessing.get_context("spawn")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.max_pending_chunks = self.max_workers * 2
+
+    def run(self, root_folder=None, progress=None, cancel_event=None):
+        start_time = time.perf_counter()
+        result = IntegrityResult()
+        pending = self.index.integrity_pending(root_folder)
+        result.total = len(pending)
+        if not pending:
+            return result
+        pending_rows = []
+        in_flight = set()
+
+        def cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        def collect(futures):
+            for future in futures:
+                rows = future.result()
+                result.checked += len(rows)
+                result.problems += sum(1 for row in rows if row[3] in PROBLEM_STATUSES)
+                pending_rows.extend(rows)
+            if len(pending_rows) >= self.batch_size:
+                self.index.write_integrity(pending_rows)
+                pending_rows.clear()
+            if progress is not None:
+                progress(result.checked, result.total)
+
+        executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context)
+        try:
+            for start in range(0, len(pending), self.chunk_size):
+                if cancelled():
+                    break
+                while len(in_flight) >= self.max_pending_chunks and not cancelled():
+                    done, in_flight = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight.add(executor.submit(verify_chunk, pending[start:start + self.chunk_size]))
+            while in_flight and not cancelled():
+                done, in_flight = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                collect(done)
+            result.cancelled = cancelled()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for future in in_flight:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    pending_rows.extend(future.result())
+            self.index.write_integrity(pending_rows)
+
+        result.elapsed = time.perf_counter() - start_time
+        logging.info(f"Проверка целостности: {result.checked} из {result.total} файлов, "
+                     f"с ошибками {result.problems}, {result.elapsed:.1f} с"
+                     f"{' (отменено)' if result.cancelled else ''}")
+        return result
+
+
+if __name__ == '__main__':
+    # Проверка отдельных файлов: python integrity.py <файл>...
+    import sys
+    for file_path in sys.argv[1:]:
+        print(file_path, *verify_file(file_path), sep="\t")
@@ -0,0 +1,102 @@
+import logging
+
+from PyQt5.QtCore import Qt, QObject
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import QAction
+
+SETTINGS_GROUP = "shortcuts"
+
+# Действие -> (название, сочетания по умолчанию через "; " в переносимой записи QKeySequence).
+# Мультимедийные клавиши работают, пока окно активно; в фоне их доставляет MPRIS (mpris.py)
+DEFAULT_BINDINGS = {
+    "toggle_play_pause": ("Воспроизведение / пауза", "Space; Toggle Media Play/Pause; Media Play; Media Pause"),
+    "play_next_track": ("Следующий трек", "Ctrl+Right; Media Next"),
+    "play_previous_track": ("Предыдущий трек", "Ctrl+Left; Media Previous"),
+    "stop_music": ("Стоп", "Media Stop"),
+    "seek_forward": ("Вперед на 5 секунд", "Right"),
+    "seek_backward": ("Назад на 5 секунд", "Left"),
+    "volume_up": ("Громче", "Ctrl+Up"),
+    "volume_down": ("Тише", "Ctrl+Down"),
+    "toggle_shuffle": ("Перемешивание", "Ctrl+S"),
+    "toggle_repeat": ("Повтор", "Ctrl+R"),
+    "navigate_back": ("Назад в библиотеке", "Backspace; Alt+Left"),
+    "open_library_folder": ("Добавить папку с музыкой", "Ctrl+O"),
+    "export_current_view": ("Экспорт папки или плейлиста", "Ctrl+E"),
+}
+
+# Действия, которые повторяются при удержании клавиши
+AUTO_REPEAT_ACTIONS = frozenset({"seek_forward", "seek_backward", "volume_up", "volume_down"})
+
+
+def parse_sequences(text):
+    """Разбирает строку вида "Space; Ctrl+P" в список QKeySequence; пустые и неизвестные пропускаются."""
+    return [sequence for sequence in QKeySequence.listFromString(text or "", QKeySequence.PortableText)
+            if not sequence.isEmpty()]
+
+
+def format_sequences(sequences):
+    return QKeySequence.listToString(sequences, QKeySequence.PortableText)
+
+
+class KeyBindings(QObject):
+    """
+    Горячие клавиши окна на основе QAction: сочетания обрабатывает сам Qt,
+    без фильтра событий на Python. Контекст WindowShortcut действует только
+    в активном окне, а поля ввода сами забирают печатные клавиши (пробел и т.п.)
+    через ShortcutOverride, поэтому набор текста не управляет воспроизведением.
+    Назначения хранятся в QSettings в группе shortcuts/<действие>; отсутствующий ключ -
+    значение по умолчанию, пустая строка - действие без сочетаний.
+    """
+
+    def __init__(self, widget, settings, handlers, defaults=DEFAULT_BINDINGS):
+        super().__init__(widget)
+        self.settings = settings
+        self.defaults = defaults
+        self.actions = {}
+        for name, (text, default) in defaults.items():
+            handler = handlers.get(name)
+            if handler is None:
+                continue
+            action = QAction(text, widget)
+            action.setShortcutContext(Qt.WindowShortcut)
+            action.setAutoRepeat(name in AUTO_REPEAT_ACTIONS)
+            action.triggered.connect(lambda checked=False, handler=handler: handler())
+            widget.addAction(action)
+            self.actions[name] = action
+            stored = settings.value(f"{SETTINGS_GROUP}/{name}", default, type=str)
+            action.setShortcuts(parse_sequences(stored))
+
+    def bindings(self):
+        """Текущие назначения: действие -> {"title": ..., "keys": "Space; Media Play"}."""
+        return {name: {"title": action.text(), "keys": format_sequences(action.shortcuts())}
+                for name, action in self.actions.items()}
+
+    def set_binding(self, name, keys):
+        """
+        Назначает действию сочетания (строка через "; ") и сохраняет их.
+        Сочетание, уже занятое другим действием, отклоняется с ValueError.
+        """
+        action = self.actions.get(name)
+        if action is None:
+            raise ValueError(f"Неизвестное действие: {name}")
+        sequences = parse_sequences(keys)
+        for other_name, other in self.actions.items():
+            if other_name == name:
+                continue
+            taken = set(sequences) & set(other.shortcuts())
+            if taken:
+                raise ValueError(f"Сочетание {format_sequences(list(taken))} уже назначено действию {other_name}")
+        action.setShortcuts(sequences)
+        self.settings.setValue(f"{SETTINGS_GROUP}/{name}", format_sequences(sequences))
+        logging.info(f"Горячие клавиши: {name} = {format_sequences(sequences) or '(нет)'}")
+        return format_sequences(sequences)
+
+    def reset(self, name=None):
+        """Возвращает значения по умолчанию для действия или для всех действий."""
+        names = [name] if name is not None else list(self.actions)
+        for action_name in names:
+            if action_name not in self.actions:
+                raise ValueError(f"Неизвестное действие: {action_name}")
+            self.settings.remove(f"{SETTINGS_GROUP}/{action_name}")
+            self.actions[action_name].setShortcuts(parse_sequences(self.defaults[action_name][1]))
+        return self.bindings()
@@ -0,0 +1,309 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from app_paths import cache_dir
+
+# Миграции схемы по порядку; номер версии - индекс + 1 (хранится в PRAGMA user_version)
+MIGRATIONS = (
+    """
+    CREATE TABLE IF NOT EXISTS tracks (
+        path TEXT PRIMARY KEY,
+        folder TEXT NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        title TEXT,
+        artist TEXT,
+        album TEXT,
+        duration_ms INTEGER NOT NULL DEFAULT 0,
+        cover_hash TEXT,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS tracks_folder ON tracks(folder);
+    CREATE INDEX IF NOT EXISTS tracks_artist ON tracks(artist COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS tracks_album ON tracks(album COLLATE NOCASE);
+    """,
+    # Жанр, оценка, дата добавления, история прослушиваний и умные плейлисты.
+    # Уже проиндексированные треки считаются добавленными в момент миграции;
+    # mtime_ns обнуляется, чтобы следующая индексация дочитала новые теги.
+    """
+    ALTER TABLE tracks ADD COLUMN genre TEXT;
+    ALTER TABLE tracks ADD COLUMN rating INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE tracks ADD COLUMN added_at INTEGER NOT NULL DEFAULT 0;
+    UPDATE tracks SET added_at = CAST(strftime('%s', 'now') AS INTEGER), mtime_ns = 0;
+    CREATE INDEX IF NOT EXISTS tracks_genre ON tracks(genre COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS tracks_rating ON tracks(rating);
+    CREATE INDEX IF NOT EXISTS tracks_added_at ON tracks(added_at);
+    CREATE TABLE IF NOT EXISTS play_stats (
+        path TEXT PRIMARY KEY,
+        play_count INTEGER NOT NULL DEFAULT 0,
+        last_played INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS play_stats_last_played ON play_stats(last_played);
+    CREATE TABLE IF NOT EXISTS play_history (
+        path TEXT NOT NULL,
+        played_at INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS play_history_played_at ON play_history(played_at);
+    CREATE TABLE IF NOT EXISTS smart_playlists (
+        name TEXT PRIMARY KEY,
+        query TEXT NOT NULL
+    );
+    """,
+    # Звуковые признаки для режима радио (темп и спектральный центроид, нормированные в 0..1)
+    """
+    CREATE TABLE IF NOT EXISTS audio_features (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        tempo REAL,
+        centroid REAL
+    );
+    """,
+    # Результаты проверки целостности файлов (integrity.py)
+    """
+    CREATE TABLE IF NOT EXISTS integrity (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        detail TEXT,
+        checked_at INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS integrity_status ON integrity(status);
+    """,
+    # Основной и акцентный цвета обложек (cover_colors.py), по хэшу обложки: одна строка на альбом
+    """
+    CREATE TABLE IF NOT EXISTS cover_colors (
+        cover_hash TEXT PRIMARY KEY,
+        dominant INTEGER NOT NULL,
+        accent INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS tracks_cover_hash ON tracks(cover_hash);
+    """,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Порядок колонок в строках, которые пишет конвейер индексации
+TRACK_COLUMNS = ('path', 'folder', 'mtime_ns', 'size', 'title', 'artist', 'album', 'genre', 'rating',
+                 'duration_ms', 'cover_hash', 'error')
+
+
+class LibraryIndex:
+    """
+    Индекс метаданных всей библиотеки в SQLite (режим WAL).
+    Запись идет пакетами в одной транзакции; строка файла считается актуальной,
+    пока совпадают mtime и размер, поэтому прерванная индексация продолжается с места остановки.
+    Подписчики (add_listener) получают список измененных путей после каждой записи.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(cache_dir("library"), "library.sqlite3")
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock, self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            for script in MIGRATIONS[version:]:
+                for statement in script.split(";"):
+                    if statement.strip():
+                        self._conn.execute(statement)
+            if version < SCHEMA_VERSION:
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                logging.info(f"LibraryIndex: схема обновлена до версии {SCHEMA_VERSION}")
+
+    def add_listener(self, callback):
+        """callback(paths) вызывается в потоке записи после фиксации изменений."""
+        self._listeners.append(callback)
+
+    def _notify(self, paths):
+        for callback in self._listeners:
+            try:
+                callback(paths)
+            except Exception as e:
+                logging.error(f"LibraryIndex: ошибка подписчика: {e}")
+
+    @staticmethod
+    def _prefix_range(root_folder):
+        """Границы путей под root_folder для условия path >= ? AND path < ? (по индексу PRIMARY KEY)."""
+        prefix = os.path.join(root_folder, "")
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def file_states(self, root_folder=None):
+        """Возвращает словарь путь -> (mtime_ns, size) для файлов в индексе (или под root_folder)."""
+        query = "SELECT path, mtime_ns, size FROM tracks"
+        params = ()
+        if root_folder is not None:
+            query += " WHERE path >= ? AND path < ?"
+            params = self._prefix_range(root_folder)
+        with self._lock:
+            return {row[0]: (row[1], row[2]) for row in self._conn.execute(query, params)}
+
+    def write_batch(self, rows):
+        """
+        Записывает пакет строк (в порядке TRACK_COLUMNS) одной транзакцией.
+        Для новых файлов дата добавления - время записи (время изменения файла говорит
+        о копировании или теггинге, а не о появлении в библиотеке), у существующих она сохраняется.
+        """
+        if not rows:
+            return
+        now = int(time.time())
+        columns = TRACK_COLUMNS + ('added_at',)
+        placeholders = ", ".join("?" * len(columns))
+        updates = ", ".join(f"{column} = excluded.{column}" for column in TRACK_COLUMNS[1:])
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO tracks ({', '.join(columns)}) VALUES ({placeholders}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                [tuple(row) + (now,) for row in rows])
+        self._notify([row[0] for row in rows])
+
+    def remove_paths(self, paths):
+        paths = list(paths)
+        if not paths:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM tracks WHERE path = ?", ((path,) for path in paths))
+            self._conn.executemany("DELETE FROM integrity WHERE path = ?", ((path,) for path in paths))
+        self._notify(paths)
+
+    def record_play(self, path, played_at=None):
+        """Добавляет прослушивание в историю и обновляет счетчики трека."""
+        played_at = int(played_at if played_at is not None else time.time())
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO play_history (path, played_at) VALUES (?, ?)", (path, played_at))
+            self._conn.execute(
+                "INSERT INTO play_stats (path, play_count, last_played) VALUES (?, 1, ?) "
+                "ON CONFLICT(path) DO UPDATE SET play_count = play_count + 1, last_played = excluded.last_played",
+                (path, played_at))
+        self._notify([path])
+
+    def write_audio_features(self, rows):
+        """Записывает пакет (path, mtime_ns, tempo, centroid) одной транзакцией."""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO audio_features (path, mtime_ns, tempo, centroid) VALUES (?, ?, ?, ?)", rows)
+
+    def write_cover_colors(self, rows):
+        """Записывает пакет (cover_hash, dominant, accent) одной транзакцией; известные обложки не перезаписываются."""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO cover_colors (cover_hash, dominant, accent) VALUES (?, ?, ?)", rows)
+
+    def cover_colors_for(self, path):
+        """
+        Для трека: (cover_hash, (dominant, accent)) или (cover_hash, None), если цвета еще не вычислены;
+        None, если трека нет в индексе или у него нет обложки.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT t.cover_hash, c.dominant, c.accent FROM tracks t "
+                "LEFT JOIN cover_colors c ON c.cover_hash = t.cover_hash "
+                "WHERE t.path = ? AND t.cover_hash IS NOT NULL", (path,)).fetchone()
+        if row is None:
+            return None
+        return row[0], ((row[1], row[2]) if row[1] is not None else None)
+
+    def file_stats(self, root_folder):
+        """Строки (path, folder, duration_ms, size) треков под root_folder, сгруппированные по папкам."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, folder, duration_ms, size FROM tracks WHERE path >= ? AND path < ? ORDER BY folder",
+                self._prefix_range(root_folder)).fetchall()
+
+    def track_stats(self, paths):
+        """Словарь путь -> (duration_ms, size) для перечисленных путей, которые есть в индексе."""
+        stats = {}
+        paths = list(paths)
+        with self._lock:
+            # Не больше 500 параметров на запрос (ограничение SQLite на число переменных)
+            for start in range(0, len(paths), 500):
+                batch = paths[start:start + 500]
+                for row in self._conn.execute(
+                        f"SELECT path, duration_ms, size FROM tracks WHERE path IN ({', '.join('?' * len(batch))})",
+                        batch):
+                    stats[row[0]] = (row[1], row[2])
+        return stats
+
+    def integrity_pending(self, root_folder=None):
+        """
+        Треки без результата проверки целостности для текущих mtime и размера:
+        список (path, mtime_ns, size) в порядке путей (файлы одной папки читаются подряд).
+        """
+        query = ("SELECT t.path, t.mtime_ns, t.size FROM tracks t LEFT JOIN integrity i "
+                 "ON i.path = t.path AND i.mtime_ns = t.mtime_ns AND i.size = t.size "
+                 "WHERE i.path IS NULL AND t.mtime_ns > 0")
+        params = ()
+        if root_folder is not None:
+            query += " AND t.path >= ? AND t.path < ?"
+            params = self._prefix_range(root_folder)
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(query + " ORDER BY t.path", params)]
+
+    def write_integrity(self, rows):
+        """Записывает пакет (path, mtime_ns, size, status, detail, checked_at) одной транзакцией."""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO integrity (path, mtime_ns, size, status, detail, checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def integrity_problems(self, statuses, root_folder=None):
+        """Словарь путь -> (состояние, подробности) для актуальных результатов с указанными состояниями."""
+        query = ("SELECT i.path, i.status, i.detail FROM integrity i JOIN tracks t "
+                 "ON t.path = i.path AND t.mtime_ns = i.mtime_ns AND t.size = i.size "
+                 f"WHERE i.status IN ({', '.join('?' * len(statuses))})")
+        params = tuple(statuses)
+        if root_folder is not None:
+            query += " AND i.path >= ? AND i.path < ?"
+            params += self._prefix_range(root_folder)
+        with self._lock:
+            return {row[0]: (row[1], row[2]) for row in self._conn.execute(query, params)}
+
+    def query(self, sql, params=()):
+        """Выполняет запрос чтения и возвращает список строк."""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def analyze(self):
+        """Обновляет статистику индексов для планировщика SQLite (после крупной индексации)."""
+        with self._lock:
+            self._conn.execute("ANALYZE")
+
+    def get(self, path):
+        """Возвращает строку трека (sqlite3.Row) или None."""
+        with self._lock:
+            return self._conn.execute("SELECT * FROM tracks WHERE path = ?", (path,)).fetchone()
+
+    def track_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def smart_playlists(self):
+        """Возвращает список (имя, запрос) сохраненных умных плейлистов."""
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute("SELECT name, query FROM smart_playlists ORDER BY name")]
+
+    def save_smart_playlist(self, name, query):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO smart_playlists (name, query) VALUES (?, ?)", (name, query))
+
+    def delete_smart_playlist(self, name):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM smart_playlists WHERE name = ?", (name,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,202 @@
+import os
+import marshal
+import hashlib
+import logging
+
+from app_paths import cache_dir
+from library_tree import MergedLibraryTree, detach_tree, tree_to_record, tree_from_record, scan_library
+
+SNAPSHOT_MAGIC = b'LTRS'
+SNAPSHOT_VERSION = 1
+# Папки проверяются пачками, чтобы при первом же изменении не опрашивать остальные
+VALIDATE_BATCH = 256
+
+
+class RootSnapshot:
+    """Дерево корня и времена изменения его папок (в порядке iter_nodes) на момент сканирования."""
+    __slots__ = ('tree', 'folder_mtimes')
+
+    def __init__(self, tree, folder_mtimes):
+        self.tree = tree
+        self.folder_mtimes = folder_mtimes
+
+
+class LibraryRoot:
+    """Корень библиотеки: путь, отображаемое имя, доступность и последний снимок дерева."""
+    __slots__ = ('path', 'name', 'online', 'snapshot', 'indexed_snapshot')
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        # None - доступность еще не проверялась
+        self.online = None
+        self.snapshot = None
+        # Снимок, для которого уже запускалась индексация метаданных
+        self.indexed_snapshot = None
+
+    @property
+    def tree(self):
+        return self.snapshot.tree if self.snapshot is not None else None
+
+    @property
+    def resource(self):
+        """Ресурс исполнителя задач: ввод-вывод одного корня ограничивается отдельно от других."""
+        return f"library_root:{self.path}"
+
+
+class LibraryRoots:
+    """
+    Несколько корней библиотеки (локальный диск, сетевые папки, съемные носители).
+    Каждый корень сканируется отдельно и хранит снимок дерева в кэше, поэтому после
+    перезапуска или повторного подключения носителя дерево восстанавливается без сканирования:
+    достаточно сверить время изменения папок. merged_tree() объединяет деревья в один вид.
+    load_snapshot, probe, is_unchanged и scan обращаются к диску и вызываются в фоновых задачах,
+    остальные методы - в UI-потоке.
+    """
+
+    def __init__(self, fs, supported_extensions, snapshot_dir=None):
+        self.fs = fs
+        self.supported_extensions = supported_extensions
+        self.snapshot_dir = snapshot_dir or cache_dir("library_roots")
+        self.roots = []
+
+    def __iter__(self):
+        return iter(self.roots)
+
+    def __len__(self):
+        return len(self.roots)
+
+    def paths(self):
+        return [root.path for root in self.roots]
+
+    def get(self, path):
+        path = os.path.normpath(path)
+        for root in self.roots:
+            if root.path == path:
+                return root
+        return None
+
+    def add(self, path):
+        """Добавляет корень (или возвращает уже добавленный)."""
+        existing = self.get(path)
+        if existing is not None:
+            return existing
+        path = os.path.normpath(path)
+        root = LibraryRoot(path, self._unique_name(os.path.basename(path) or path))
+        self.roots.append(root)
+        return root
+
+    def remove(self, path):
+        root = self.get(path)
+        if root is None:
+            return None
+        self.roots.remove(root)
+        try:
+            os.remove(self._snapshot_path(root.path))
+        except OSError:
+            pass
+        return root
+
+    def _unique_name(self, name):
+        names = {root.name for root in self.roots}
+        candidate, number = name, 2
+        while candidate in names:
+            candidate = f"{name} ({number})"
+            number += 1
+        return candidate
+
+    def root_for_path(self, path):
+        """Корень, которому принадлежит путь (самый длинный совпадающий префикс), или None."""
+        best = None
+        for root in self.roots:
+            if path == root.path or path.startswith(os.path.join(root.path, "")):
+                if best is None or len(root.path) > len(best.path):
+                    best = root
+        return best
+
+    def is_path_online(self, path):
+        """False только для файлов корня, который сейчас недоступен."""
+        root = self.root_for_path(path)
+        return root is None or root.online is not False
+
+    def merged_tree(self):
+        """
+        Дерево для просмотра: один корень показывается как раньше, несколько -
+        под общим виртуальным корнем. Корни без снимка (еще не сканировались) пропускаются.
+        """
+        named_trees = [(root.name, root.tree) for root in self.roots if root.tree is not None]
+        if not named_trees:
+            return None
+        if len(self.roots) == 1:
+            root = self.roots[0]
+            return detach_tree(root.tree, os.path.basename(root.path) or root.path)
+        return MergedLibraryTree(named_trees)
+
+    # --- Ввод-вывод (фоновые задачи) ---
+
+    def _snapshot_path(self, root_path):
+        return os.path.join(self.snapshot_dir, hashlib.sha1(root_path.encode('utf-8')).hexdigest() + '.tree')
+
+    def load_snapshot(self, root_path):
+        """Читает снимок дерева корня из кэша. Возвращает RootSnapshot или None."""
+        try:
+            with open(self._snapshot_path(root_path), 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        if data[:4] != SNAPSHOT_MAGIC:
+            return None
+        try:
+            version, stored_path, record, folder_mtimes = marshal.loads(data[4:])
+        except (ValueError, EOFError, TypeError) as e:
+            logging.debug(f"LibraryRoots: поврежденный снимок {root_path}: {e}")
+            return None
+        if version != SNAPSHOT_VERSION or stored_path != root_path:
+            return None
+        return RootSnapshot(tree_from_record(root_path, record), folder_mtimes)
+
+    def save_snapshot(self, root_path, snapshot):
+        data = SNAPSHOT_MAGIC + marshal.dumps(
+            (SNAPSHOT_VERSION, root_path, tree_to_record(snapshot.tree), snapshot.folder_mtimes))
+        snapshot_path = self._snapshot_path(root_path)
+        temp_path = snapshot_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, snapshot_path)
+        except OSError as e:
+            logging.error(f"LibraryRoots: не удалось сохранить снимок {root_path}: {e}")
+
+    def probe(self, root_path):
+        """Проверяет доступность корня в обход кэша листингов."""
+        self.fs.invalidate(root_path)
+        self.fs.invalidate(os.path.dirname(root_path))
+        return self.fs.isdir(root_path)
+
+    def _folder_mtimes(self, paths):
+        return tuple(stat.st_mtime_ns if stat is not None else -1 for stat in self.fs.stat_many(paths))
+
+    def is_unchanged(self, snapshot, cancel_event=None):
+        """
+        True, если ни одна папка снимка не менялась: добавление, удаление и переименование
+        файлов меняют время изменения папки, поэтому достаточно одного stat на папку вместо листинга.
+        """
+        folder_paths = [node.path() for node in snapshot.tree.iter_nodes()]
+        if len(folder_paths) != len(snapshot.folder_mtimes):
+            return False
+        for start in range(0, len(folder_paths), VALIDATE_BATCH):
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+            batch = folder_paths[start:start + VALIDATE_BATCH]
+            for path in batch:
+                self.fs.invalidate(path)
+            if self._folder_mtimes(batch) != tuple(snapshot.folder_mtimes[start:start + VALIDATE_BATCH]):
+                return False
+        return True
+
+    def scan(self, root_path):
+        """Сканирует корень и возвращает новый RootSnapshot."""
+        self.fs.invalidate(root_path, recursive=True)
+        tree = scan_library(root_path, self.supported_extensions, fs=self.fs)
+        folder_mtimes = self._folder_mtimes([node.path() for node in tree.iter_nodes()])
+        return RootSnapshot(tree, folder_mtimes)
@@ -0,0 +1,465 @@
+import os
+import sys
+import bisect
+import logging
+from array import array
+
+from fs_layer import LocalFileSystem
+from archive import ARCHIVE_EXTENSIONS
+
+# Ориентировочный бюджет памяти дерева библиотеки (байт).
+# Для файла основная часть - сама строка имени, для папки - узел и массивы детей.
+# Итоги папок (длительность и размер каждого файла) добавляют около 12 байт на файл.
+MEMORY_BUDGET_BYTES_PER_FILE = 176
+MEMORY_BUDGET_BYTES_PER_FOLDER = 448
+
+# Изображения, которые сканер запоминает в каждой папке, в порядке предпочтения расширений
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+# Общие имена обложек папки (без расширения, без учета регистра)
+ARTWORK_STEMS = ('folder', 'cover', 'front', 'artist', 'album')
+
+
+def _bisect_names(items, name, key):
+    """Бинарный поиск по отсортированному кортежу. Возвращает индекс или -1."""
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        mid_name = key(items[mid])
+        if mid_name < name:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < len(items) and key(items[lo]) == name:
+        return lo
+    return -1
+
+
+def _node_name(node):
+    return node.name
+
+
+def _same(name):
+    return name
+
+
+def _image_priority(image_name):
+    return IMAGE_EXTENSIONS.index(os.path.splitext(image_name)[1].lower())
+
+
+# Сортировка папок уровня по итогам узлов: имя по возрастанию, числа - по убыванию
+FOLDER_SORT_KEYS = {
+    "name": (_node_name, False),
+    "tracks": (lambda node: node.total_tracks, True),
+    "duration": (lambda node: node.total_duration_ms, True),
+    "size": (lambda node: node.total_size, True),
+}
+
+
+def sorted_folders(node, sort_key="name"):
+    """Дочерние папки узла в порядке FOLDER_SORT_KEYS; по имени - без пересортировки."""
+    if sort_key == "name" or sort_key not in FOLDER_SORT_KEYS:
+        return node.folders
+    key, reverse = FOLDER_SORT_KEYS[sort_key]
+    return sorted(node.folders, key=key, reverse=reverse)
+
+
+class LibraryNode:
+    """
+    Узел дерева библиотеки (папка).
+    Хранит только собственное имя и ссылку на родителя; полный путь
+    восстанавливается по цепочке родителей. Дети хранятся в отсортированных кортежах.
+    total_* - итоги поддерева (треки, длительность, размер): число треков известно из
+    сканирования, длительность и размер приходят из индекса (LibraryTree.attach_file_stats).
+    Изменения индекса переносятся update_file и remove_file за O(глубины) без обхода поддерева;
+    present отмечает файлы, учтенные в итогах (удаленный из индекса файл остается в files до пересканирования).
+    """
+    __slots__ = ('name', 'parent', 'folders', 'files', 'images', 'base_path',
+                 'durations', 'sizes', 'present', 'total_tracks', 'total_duration_ms', 'total_size')
+
+    def __init__(self, name, parent=None, base_path=None):
+        self.name = sys.intern(name)
+        self.parent = parent
+        # Во время сканирования folders - словарь, files - список; freeze() превращает их в кортежи
+        self.folders = {}
+        self.files = []
+        # Имена файлов изображений в папке, найденные при сканировании
+        self.images = []
+        # Абсолютный путь задан только у корневого узла
+        self.base_path = base_path
+        # Длительность (мс), размер и признак учета в итогах для каждого файла параллельно files;
+        # None, пока нет данных индекса (тогда учтены все файлы)
+        self.durations = None
+        self.sizes = None
+        self.present = None
+        self.total_tracks = 0
+        self.total_duration_ms = 0
+        self.total_size = 0
+
+    def path(self):
+        """Восстанавливает полный путь к папке."""
+        parts = []
+        node = self
+        while node.base_path is None:
+            parts.append(node.name)
+            node = node.parent
+        parts.append(node.base_path)
+        parts.reverse()
+        return os.path.join(*parts)
+
+    def file_path(self, file_name):
+        """Полный путь к файлу этой папки."""
+        return os.path.join(self.path(), file_name)
+
+    def child(self, name):
+        """Возвращает дочернюю папку по имени или None."""
+        if isinstance(self.folders, dict):
+            return self.folders.get(name)
+        index = _bisect_names(self.folders, name, _node_name)
+        return self.folders[index] if index >= 0 else None
+
+    def has_file(self, file_name):
+        if isinstance(self.files, list):
+            return file_name in self.files
+        return _bisect_names(self.files, file_name, _same) >= 0
+
+    def _ensure_file_stats(self):
+        if self.durations is None:
+            self.durations = array('I', bytes(4 * len(self.files)))
+            self.sizes = array('Q', bytes(8 * len(self.files)))
+            self.present = bytearray(b'\x01') * len(self.files)
+
+    def _add_to_totals(self, tracks_delta, duration_delta, size_delta):
+        node = self
+        while node is not None:
+            node.total_tracks += tracks_delta
+            node.total_duration_ms += duration_delta
+            node.total_size += size_delta
+            node = node.parent
+
+    def update_file(self, file_name, duration_ms, size):
+        """
+        Записывает длительность и размер файла папки, который есть в индексе, и переносит разницу
+        в итоги всех предков. Файл, появившийся в индексе после сканирования, добавляется в папку.
+        Возвращает True, если итоги изменились.
+        """
+        if isinstance(self.files, list):
+            return False
+        self._ensure_file_stats()
+        index = _bisect_names(self.files, file_name, _same)
+        if index < 0:
+            index = bisect.bisect_left(self.files, file_name)
+            self.files = self.files[:index] + (sys.intern(file_name),) + self.files[index:]
+            self.durations.insert(index, 0)
+            self.sizes.insert(index, 0)
+            self.present.insert(index, 0)
+        duration_ms = min(max(0, duration_ms or 0), 0xFFFFFFFF)
+        tracks_delta = 0 if self.present[index] else 1
+        duration_delta = duration_ms - self.durations[index]
+        size_delta = size - self.sizes[index]
+        if not tracks_delta and not duration_delta and not size_delta:
+            return False
+        self.present[index] = 1
+        self.durations[index] = duration_ms
+        self.sizes[index] = size
+        self._add_to_totals(tracks_delta, duration_delta, size_delta)
+        return True
+
+    def remove_file(self, file_name):
+        """Исключает удаленный из индекса файл из итогов папки и предков. Возвращает True, если итоги изменились."""
+        index = _bisect_names(self.files, file_name, _same)
+        if index < 0:
+            return False
+        self._ensure_file_stats()
+        if not self.present[index]:
+            return False
+        self._add_to_totals(-1, -self.durations[index], -self.sizes[index])
+        self.present[index] = 0
+        self.durations[index] = 0
+        self.sizes[index] = 0
+        return True
+
+    def find_artwork(self, *preferred_names):
+        """
+        Подбирает изображение папки без обращения к диску и без учета регистра:
+        сначала по preferred_names (например, имя папки исполнителя), затем folder/cover/front.
+        Возвращает полный путь или None.
+        """
+        if not self.images:
+            return None
+        by_stem = {}
+        for image_name in sorted(self.images, key=_image_priority):
+            by_stem.setdefault(os.path.splitext(image_name)[0].lower(), image_name)
+        for stem in [name.lower() for name in preferred_names] + list(ARTWORK_STEMS):
+            image_name = by_stem.get(stem)
+            if image_name is not None:
+                return self.file_path(image_name)
+        return None
+
+    def relative_parts(self):
+        """Список имен от корня дерева до этого узла (без корня)."""
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        parts.reverse()
+        return parts
+
+    def _add_child(self, name):
+        node = self.folders.get(name)
+        if node is None:
+            node = LibraryNode(name, parent=self)
+            self.folders[node.name] = node
+        return node
+
+    def _add_file(self, file_name):
+        self.files.append(sys.intern(file_name))
+
+    def _add_image(self, file_name):
+        self.images.append(sys.intern(file_name))
+
+    def _freeze(self):
+        self.folders = tuple(sorted(self.folders.values(), key=_node_name))
+        self.files = tuple(sorted(self.files))
+        self.images = tuple(sorted(self.images))
+
+
+class LibraryTree:
+    """Компактное дерево библиотеки с отсортированными массивами детей."""
+
+    def __init__(self, root_folder):
+        self.root = LibraryNode(os.path.basename(root_folder) or root_folder, base_path=root_folder)
+        self.folder_count = 1
+        self.file_count = 0
+
+    @property
+    def root_folder(self):
+        return self.root.base_path
+
+    def find(self, parts):
+        """Возвращает узел по списку имен папок от корня или None."""
+        node = self.root
+        for part in parts:
+            node = node.child(part)
+            if node is None:
+                return None
+        return node
+
+    def node_for_path(self, folder_path):
+        """Возвращает узел по абсолютному пути папки или None, если папка вне библиотеки."""
+        try:
+            relative = os.path.relpath(folder_path, self.root.base_path)
+        except ValueError:
+            # Другой диск в Windows
+            return None
+        if relative == os.curdir:
+            return self.root
+        if relative.startswith(os.pardir):
+            return None
+        return self.find(relative.split(os.sep))
+
+    def iter_nodes(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.folders.values() if isinstance(node.folders, dict) else node.folders)
+
+    def compute_totals(self):
+        """
+        Пересчитывает итоги всех узлов снизу вверх: обратный порядок обхода iter_nodes
+        гарантирует, что дети обработаны раньше родителя.
+        """
+        for node in reversed(list(self.iter_nodes())):
+            node.total_tracks = sum(node.present) if node.present is not None else len(node.files)
+            node.total_duration_ms = sum(node.durations) if node.durations is not None else 0
+            node.total_size = sum(node.sizes) if node.sizes is not None else 0
+            for child in node.folders:
+                node.total_tracks += child.total_tracks
+                node.total_duration_ms += child.total_duration_ms
+                node.total_size += child.total_size
+
+    def attach_file_stats(self, rows):
+        """
+        Заполняет длительность и размер файлов из строк индекса (путь, папка, длительность, размер)
+        и пересчитывает итоги. Вызывается для еще не показанного дерева, поэтому
+        пишет в массивы напрямую, без поштучного update_file. Возвращает число найденных файлов.
+        """
+        attached = 0
+        current_folder = node = None
+        for path, folder, duration_ms, size in rows:
+            if folder != current_folder:
+                current_folder = folder
+                node = self.node_for_path(folder)
+                if node is not None:
+                    node._ensure_file_stats()
+            if node is None:
+                continue
+            index = _bisect_names(node.files, os.path.basename(path), _same)
+            if index >= 0:
+                node.durations[index] = min(max(0, duration_ms or 0), 0xFFFFFFFF)
+                node.sizes[index] = size
+                attached += 1
+        self.compute_totals()
+        return attached
+
+    def iter_file_paths(self):
+        """Полные пути всех аудиофайлов библиотеки (путь папки восстанавливается один раз на папку)."""
+        for node in self.iter_nodes():
+            if node.files:
+                folder_path = node.path()
+                for file_name in node.files:
+                    yield os.path.join(folder_path, file_name)
+
+    def freeze(self):
+        """Сортирует детей всех узлов один раз после сканирования."""
+        for node in list(self.iter_nodes()):
+            node._freeze()
+        self.compute_totals()
+
+    def memory_budget(self):
+        """Допустимый объем памяти для дерева с текущим числом файлов и папок (байт)."""
+        return (self.file_count * MEMORY_BUDGET_BYTES_PER_FILE
+                + self.folder_count * MEMORY_BUDGET_BYTES_PER_FOLDER)
+
+    def memory_usage(self):
+        """Измеряет приблизительный объем памяти, занимаемый деревом (байт)."""
+        total = 0
+        seen_names = set()
+        for node in self.iter_nodes():
+            total += (sys.getsizeof(node) + sys.getsizeof(node.folders) + sys.getsizeof(node.files)
+                      + sys.getsizeof(node.images))
+            if node.durations is not None:
+                total += sys.getsizeof(node.durations) + sys.getsizeof(node.sizes) + sys.getsizeof(node.present)
+            for name in (node.name, *node.files, *node.images):
+                if id(name) not in seen_names:
+                    seen_names.add(id(name))
+                    total += sys.getsizeof(name)
+        return total
+
+
+class MergedLibraryTree(LibraryTree):
+    """
+    Общий вид нескольких корней библиотеки: виртуальный корень без пути,
+    папки первого уровня - корневые узлы деревьев под отображаемыми именами.
+    Деревья не копируются, относительные пути узлов начинаются с имени корня.
+    """
+
+    def __init__(self, named_trees):
+        self.root = LibraryNode("", base_path="")
+        self.trees = []
+        for name, tree in named_trees:
+            tree.root.name = sys.intern(name)
+            tree.root.parent = self.root
+            self.trees.append(tree)
+        self.root.folders = tuple(sorted((tree.root for tree in self.trees), key=_node_name))
+        self.folder_count = 1 + sum(tree.folder_count for tree in self.trees)
+        self.file_count = sum(tree.file_count for tree in self.trees)
+        # Итоги деревьев уже посчитаны, виртуальному корню достаточно их суммы
+        for tree in self.trees:
+            self.root.total_tracks += tree.root.total_tracks
+            self.root.total_duration_ms += tree.root.total_duration_ms
+            self.root.total_size += tree.root.total_size
+
+    @property
+    def root_folder(self):
+        return None
+
+    def node_for_path(self, folder_path):
+        for tree in self.trees:
+            node = tree.node_for_path(folder_path)
+            if node is not None:
+                return node
+        return None
+
+
+def detach_tree(tree, name):
+    """Делает дерево снова самостоятельным после использования в MergedLibraryTree."""
+    tree.root.name = sys.intern(name)
+    tree.root.parent = None
+    return tree
+
+
+def tree_to_record(tree):
+    """
+    Представляет дерево вложенными кортежами (имя, файлы, изображения, дочерние записи)
+    для компактной сериализации через marshal. Порядок детей сохраняется,
+    поэтому iter_nodes() восстановленного дерева обходит узлы в том же порядке.
+    """
+    def record(node):
+        return node.name, node.files, node.images, tuple(record(child) for child in node.folders)
+    return record(tree.root)
+
+
+def tree_from_record(root_folder, record):
+    """Восстанавливает замороженное дерево из записи tree_to_record без обращения к диску."""
+    tree = LibraryTree(root_folder)
+    stack = [(tree.root, record)]
+    while stack:
+        node, (_, files, images, children) = stack.pop()
+        node.files = tuple(sys.intern(name) for name in files)
+        node.images = tuple(sys.intern(name) for name in images)
+        child_nodes = []
+        for child_record in children:
+            child = LibraryNode(child_record[0], parent=node)
+            child_nodes.append(child)
+            stack.append((child, child_record))
+        node.folders = tuple(child_nodes)
+        tree.folder_count += len(child_nodes)
+        tree.file_count += len(node.files)
+    tree.compute_totals()
+    return tree
+
+
+def scan_library(root_folder, supported_extensions, fs=None, image_extensions=IMAGE_EXTENSIONS,
+                 archive_extensions=ARCHIVE_EXTENSIONS):
+    """
+    Сканирует папку и строит LibraryTree.
+    Сегменты пути интернируются, полный путь файла не хранится.
+    Изображения в папках запоминаются, чтобы обложки находились без дополнительных обращений к диску.
+    Архивы становятся виртуальными папками: их оглавление читается как листинг папки.
+    Весь ввод-вывод идет через fs (по умолчанию - локальная файловая система).
+    """
+    if fs is None:
+        fs = LocalFileSystem()
+    tree = LibraryTree(root_folder)
+    nodes_by_root = {root_folder: tree.root}
+    archive_nodes = []
+
+    for root, dirs, files in fs.walk(root_folder, archive_extensions):
+        node = nodes_by_root.pop(root, None)
+        if node is None:
+            continue
+        for dir_name in dirs:
+            child = node._add_child(dir_name)
+            nodes_by_root[os.path.join(root, dir_name)] = child
+            if archive_extensions and dir_name.lower().endswith(archive_extensions):
+                archive_nodes.append(child)
+        for file in files:
+            lower_name = file.lower()
+            if lower_name.endswith(supported_extensions):
+                node._add_file(file)
+                tree.file_count += 1
+            elif lower_name.endswith(image_extensions):
+                node._add_image(file)
+        tree.folder_count += len(dirs)
+
+    # Архивы без аудио (документы, дистрибутивы) в библиотеке не показываются.
+    # Вложенные архивы проверяются раньше внешних, чтобы папки не вычитались дважды
+    for node in reversed(archive_nodes):
+        subtree = [node]
+        for member in subtree:
+            subtree.extend(member.folders.values())
+        if not any(member.files for member in subtree):
+            node.parent.folders.pop(node.name, None)
+            tree.folder_count -= len(subtree)
+
+    tree.freeze()
+
+    usage = tree.memory_usage()
+    budget = tree.memory_budget()
+    logging.info(f"Библиотека: {tree.file_count} файлов, {tree.folder_count} папок, "
+                 f"память дерева {usage / (1024 * 1024):.1f} МБ (бюджет {budget / (1024 * 1024):.1f} МБ)")
+    if usage > budget:
+        logging.warning(f"Дерево библиотеки превышает бюджет памяти: {usage} > {budget} байт")
+    return tree
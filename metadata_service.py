@@ -0,0 +1,228 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from mutagen.mp3 import MP3
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3NoHeaderError
+
+from fs_layer import LocalFileSystem
+import archive
+
+
+class TrackMetadata:
+    """Компактная запись метаданных одного трека."""
+    __slots__ = ('path', 'title', 'artist', 'album', 'duration_ms', 'cover_ref')
+
+    def __init__(self, path, title=None, artist=None, album=None, duration_ms=0, cover_ref=None):
+        self.path = path
+        self.title = title
+        self.artist = artist
+        self.album = album
+        self.duration_ms = duration_ms
+        # Ссылка на встроенную обложку: ключ кэша (путь, mtime) или None, если обложки нет
+        self.cover_ref = cover_ref
+
+    @property
+    def has_cover(self):
+        return self.cover_ref is not None
+
+
+def _first_tag(audio, *keys):
+    """Возвращает первое значение первого найденного тега или None."""
+    for key in keys:
+        value = audio.get(key)
+        if value:
+            return str(value[0])
+    return None
+
+
+def _extract_front_cover(file_path, audio):
+    """Возвращает байты передней обложки (тип 3) из тегов MP3/FLAC или None."""
+    lower_path = file_path.lower()
+    if lower_path.endswith('.mp3'):
+        if audio.tags is not None:
+            for tag in audio.tags.getall('APIC'):
+                if tag.type == 3:
+                    return tag.data
+    elif lower_path.endswith('.flac') and audio.pictures:
+        for pic in audio.pictures:
+            if pic.type == 3:
+                return pic.data
+    return None
+
+
+def _rating_stars(audio, file_path):
+    """Оценка трека в звездах 0-5: POPM в MP3, RATING (0-5 или 0-100) во FLAC."""
+    if file_path.lower().endswith('.mp3'):
+        if audio.tags is None:
+            return 0
+        for frame in audio.tags.getall('POPM'):
+            # Шкала 0-255 в соглашении Windows Media Player: 1, 64, 128, 196, 255
+            value = frame.rating
+            return 0 if value == 0 else 1 + (value >= 64) + (value >= 128) + (value >= 196) + (value >= 255)
+        return 0
+    value = _first_tag(audio, 'rating')
+    try:
+        value = int(float(value)) if value else 0
+    except ValueError:
+        return 0
+    return max(0, min(5, round(value / 20) if value > 5 else value))
+
+
+def read_tags(file_path):
+    """
+    Разбирает теги MP3/FLAC без кэширования.
+    Возвращает (title, artist, album, duration_ms, байты обложки, genre, rating)
+    или None для других форматов.
+    Функция не зависит от состояния сервиса и используется также в процессах индексации.
+    Файлы внутри архивов читаются из потока члена архива с произвольным доступом:
+    mutagen читает только заголовки и теги, без распаковки всего файла.
+    """
+    lower_path = file_path.lower()
+    if lower_path.endswith('.mp3'):
+        audio_type = MP3
+    elif lower_path.endswith('.flac'):
+        audio_type = FLAC
+    else:
+        return None
+    if archive.is_archive_member(file_path):
+        with archive.open_member(file_path) as member:
+            audio = audio_type(member)
+    else:
+        audio = audio_type(file_path)
+
+    duration_ms = int(audio.info.length * 1000) if audio.info else 0
+    return (_first_tag(audio, 'TIT2', 'title'),
+            _first_tag(audio, 'TPE1', 'artist'),
+            _first_tag(audio, 'TALB', 'album'),
+            duration_ms,
+            _extract_front_cover(file_path, audio),
+            _first_tag(audio, 'TCON', 'genre'),
+            _rating_stars(audio, file_path))
+
+
+class MetadataService:
+    """
+    Единая точка чтения метаданных аудиофайлов.
+    Результаты хранятся в ограниченном LRU-кэше с ключом (путь, mtime),
+    поэтому повторная навигация и переключение треков не разбирают файл заново.
+    Обложки кэшируются отдельно с ограничением по суммарному размеру в байтах.
+    """
+
+    def __init__(self, max_entries=4096, max_cover_bytes=64 * 1024 * 1024, max_workers=4, fs=None):
+        self.fs = fs or LocalFileSystem()
+        self.max_entries = max_entries
+        self.max_cover_bytes = max_cover_bytes
+        self._records = OrderedDict()
+        self._covers = OrderedDict()
+        self._cover_bytes = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metadata")
+
+    def _cache_key(self, file_path):
+        stat_result = self.fs.stat(file_path)
+        if stat_result is None:
+            return None
+        return file_path, stat_result.st_mtime_ns
+
+    def get(self, file_path):
+        """Возвращает TrackMetadata для файла, при необходимости разбирая теги."""
+        key = self._cache_key(file_path)
+        if key is None:
+            logging.debug(f"MetadataService: файл недоступен: {file_path}")
+            return TrackMetadata(file_path)
+
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                self._records.move_to_end(key)
+                return record
+
+        record, cover_data = self._parse(file_path, key)
+
+        with self._lock:
+            self._records[key] = record
+            self._records.move_to_end(key)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+            if cover_data is not None:
+                self._store_cover(key, cover_data)
+        return record
+
+    def get_many(self, file_paths):
+        """
+        Пакетное чтение метаданных: файлы разбираются параллельно в пуле потоков.
+        Возвращает список записей в порядке входных путей.
+        """
+        return list(self._pool.map(self.get, file_paths))
+
+    def get_cover_data(self, record):
+        """Возвращает байты встроенной обложки для записи или None."""
+        if record is None or record.cover_ref is None:
+            return None
+        with self._lock:
+            data = self._covers.get(record.cover_ref)
+            if data is not None:
+                self._covers.move_to_end(record.cover_ref)
+                return data
+
+        # Обложка была вытеснена из кэша - читаем файл повторно
+        _, data = self._parse(record.path, record.cover_ref)
+        if data is not None:
+            with self._lock:
+                self._store_cover(record.cover_ref, data)
+        return data
+
+    def invalidate(self, file_path=None):
+        """Сбрасывает кэш для одного файла или полностью."""
+        with self._lock:
+            if file_path is None:
+                self._records.clear()
+                self._covers.clear()
+                self._cover_bytes = 0
+                return
+            for key in [k for k in self._records if k[0] == file_path]:
+                del self._records[key]
+            for key in [k for k in self._covers if k[0] == file_path]:
+                self._cover_bytes -= len(self._covers.pop(key))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+    def _store_cover(self, key, data):
+        old = self._covers.pop(key, None)
+        if old is not None:
+            self._cover_bytes -= len(old)
+        if len(data) > self.max_cover_bytes:
+            return
+        self._covers[key] = data
+        self._cover_bytes += len(data)
+        while self._cover_bytes > self.max_cover_bytes:
+            _, evicted = self._covers.popitem(last=False)
+            self._cover_bytes -= len(evicted)
+
+    def _parse(self, file_path, key):
+        """Разбирает файл и возвращает пару (TrackMetadata, байты обложки)."""
+        try:
+            tags = read_tags(file_path)
+            if tags is None:
+                return TrackMetadata(file_path), None
+
+            title, artist, album, duration_ms, cover_data = tags[:5]
+            record = TrackMetadata(
+                file_path,
+                title=title,
+                artist=artist,
+                album=album,
+                duration_ms=duration_ms,
+                cover_ref=key if cover_data is not None else None,
+            )
+            return record, cover_data
+        except ID3NoHeaderError:
+            logging.debug(f"MetadataService: нет ID3 тегов для {file_path}.")
+        except Exception as e:
+            logging.debug(f"MetadataService: ошибка чтения метаданных для {file_path}: {e}")
+        return TrackMetadata(file_path), None
+
@@ -0,0 +1,302 @@
+# Управление плеером через MPRIS 2 (D-Bus): мультимедийные клавиши, апплеты и плагины
+# рабочих столов Linux. Без QtDBus (Windows, macOS, сборки PyQt5 без D-Bus) модуль
+# остается импортируемым, а is_available() возвращает False.
+import sys
+import zlib
+import logging
+from urllib.parse import quote, unquote, urlparse
+
+from PyQt5.QtCore import QObject, QMetaType, Q_CLASSINFO, pyqtSlot, pyqtProperty
+
+try:
+    from PyQt5.QtDBus import (QDBusConnection, QDBusAbstractAdaptor, QDBusMessage, QDBusObjectPath,
+                              QDBusArgument)
+except ImportError:
+    QDBusConnection = None
+    QDBusAbstractAdaptor = QObject
+    QDBusObjectPath = str
+
+OBJECT_PATH = "/org/mpris/MediaPlayer2"
+ROOT_INTERFACE = "org.mpris.MediaPlayer2"
+PLAYER_INTERFACE = "org.mpris.MediaPlayer2.Player"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+SERVICE_NAME = "org.mpris.MediaPlayer2.dostup_k_muzyke"
+
+# Состояния libvlc (как их возвращает status()) -> PlaybackStatus MPRIS
+_PLAYBACK_STATUS = {"Playing": "Playing", "Paused": "Paused"}
+_NO_TRACK_ID = "/org/mpris/MediaPlayer2/TrackList/NoTrack"
+
+
+def is_available():
+    return QDBusConnection is not None and sys.platform.startswith("linux")
+
+
+def _track_id(path):
+    """Объектный путь D-Bus для трека (допустимы только [A-Za-z0-9_])."""
+    if not path:
+        return _NO_TRACK_ID
+    return f"/org/mpris/MediaPlayer2/track/{zlib.crc32(path.encode('utf-8')):08x}"
+
+
+def _typed(value, meta_type):
+    """
+    Значение с явным типом D-Bus для словаря a{sv}: без него PyQt передает
+    целые как int32 (нужен int64), а списки строк как av (нужен as).
+    """
+    argument = QDBusArgument()
+    argument.add(value, meta_type)
+    return argument
+
+
+class _RootAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", ROOT_INTERFACE)
+
+    def __init__(self, service):
+        super().__init__(service)
+        self.service = service
+
+    @pyqtSlot()
+    def Raise(self):
+        self.service.player.activate()
+
+    @pyqtSlot()
+    def Quit(self):
+        self.service.player.close()
+
+    @pyqtProperty(bool)
+    def CanQuit(self):
+        return True
+
+    @pyqtProperty(bool)
+    def CanRaise(self):
+        return True
+
+    @pyqtProperty(bool)
+    def HasTrackList(self):
+        return False
+
+    @pyqtProperty(str)
+    def Identity(self):
+        return "ДОСТУП К МУЗЫКЕ"
+
+    @pyqtProperty("QStringList")
+    def SupportedUriSchemes(self):
+        return ["file"]
+
+    @pyqtProperty("QStringList")
+    def SupportedMimeTypes(self):
+        return ["audio/mpeg", "audio/flac", "audio/x-wav"]
+
+
+class _PlayerAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", PLAYER_INTERFACE)
+
+    def __init__(self, service):
+        super().__init__(service)
+        self.service = service
+
+    @property
+    def player(self):
+        return self.service.player
+
+    @pyqtSlot()
+    def PlayPause(self):
+        self.player.toggle_play_pause()
+
+    @pyqtSlot()
+    def Play(self):
+        self.player.play_music()
+
+    @pyqtSlot()
+    def Pause(self):
+        self.player.pause_music()
+
+    @pyqtSlot()
+    def Stop(self):
+        self.player.stop_music()
+
+    @pyqtSlot()
+    def Next(self):
+        self.player.play_next_track()
+
+    @pyqtSlot()
+    def Previous(self):
+        self.player.play_previous_track()
+
+    @pyqtSlot("qlonglong")
+    def Seek(self, offset_us):
+        self.player.seek_by(offset_us // 1000)
+
+    @pyqtSlot(QDBusObjectPath, "qlonglong")
+    def SetPosition(self, track_id, position_us):
+        # По спецификации команда для устаревшего трека игнорируется
+        if track_id.path() == _track_id(self.player.current_file):
+            self.player.seek_to_time(position_us // 1000)
+
+    @pyqtSlot(str)
+    def OpenUri(self, uri):
+        if uri.startswith("file://"):
+            self.player.open_paths([unquote(urlparse(uri).path)])
+
+    @pyqtProperty(str)
+    def PlaybackStatus(self):
+        return self.service.snapshot()["PlaybackStatus"]
+
+    @pyqtProperty(str)
+    def LoopStatus(self):
+        return self.service.snapshot()["LoopStatus"]
+
+    @LoopStatus.setter
+    def LoopStatus(self, value):
+        if (value != "None") != self.player.is_repeating:
+            self.player.toggle_repeat()
+
+    @pyqtProperty(bool)
+    def Shuffle(self):
+        return self.player.is_shuffling
+
+    @Shuffle.setter
+    def Shuffle(self, value):
+        if bool(value) != self.player.is_shuffling:
+            self.player.toggle_shuffle()
+
+    @pyqtProperty("QVariantMap")
+    def Metadata(self):
+        return self.service.metadata()
+
+    @pyqtProperty(float)
+    def Volume(self):
+        return self.service.snapshot()["Volume"]
+
+    @Volume.setter
+    def Volume(self, value):
+        self.player.change_volume(round(max(0.0, min(1.0, value)) * 100) - self.player.volume_slider.value())
+
+    @pyqtProperty("qlonglong")
+    def Position(self):
+        return max(0, self.player.current_time_ms()) * 1000
+
+    @pyqtProperty(float)
+    def Rate(self):
+        return 1.0
+
+    @pyqtProperty(float)
+    def MinimumRate(self):
+        return 1.0
+
+    @pyqtProperty(float)
+    def MaximumRate(self):
+        return 1.0
+
+    @pyqtProperty(bool)
+    def CanGoNext(self):
+        return True
+
+    @pyqtProperty(bool)
+    def CanGoPrevious(self):
+        return True
+
+    @pyqtProperty(bool)
+    def CanPlay(self):
+        return self.player.current_file is not None
+
+    @pyqtProperty(bool)
+    def CanPause(self):
+        return self.player.current_file is not None
+
+    @pyqtProperty(bool)
+    def CanSeek(self):
+        return self.player.total_length_ms > 0
+
+    @pyqtProperty(bool)
+    def CanControl(self):
+        return True
+
+
+class MprisService(QObject):
+    """
+    Объект /org/mpris/MediaPlayer2 с интерфейсами MediaPlayer2 и MediaPlayer2.Player.
+    Команды приходят в цикл событий Qt и вызывают методы плеера в UI-потоке.
+    Плеер вызывает refresh() при смене трека или состояния: изменившиеся свойства
+    рассылаются сигналом PropertiesChanged, чтобы апплеты не опрашивали шину.
+    bus можно передать явно (например, соединение с отдельной тестовой шиной).
+    """
+
+    def __init__(self, player, bus=None, service_name=SERVICE_NAME, parent=None):
+        super().__init__(parent)
+        self.player = player
+        self.bus = bus if bus is not None else QDBusConnection.sessionBus()
+        self.service_name = service_name
+        self._last_snapshot = {}
+        self._root_adaptor = _RootAdaptor(self)
+        self._player_adaptor = _PlayerAdaptor(self)
+        self.registered = False
+
+    def register(self):
+        if not self.bus.isConnected():
+            logging.info("MPRIS: сессионная шина D-Bus недоступна")
+            return False
+        if not self.bus.registerObject(OBJECT_PATH, self, QDBusConnection.ExportAdaptors):
+            logging.error(f"MPRIS: не удалось зарегистрировать объект: {self.bus.lastError().message()}")
+            return False
+        if not self.bus.registerService(self.service_name):
+            logging.error(f"MPRIS: имя {self.service_name} занято: {self.bus.lastError().message()}")
+            self.bus.unregisterObject(OBJECT_PATH)
+            return False
+        self.registered = True
+        self._last_snapshot = self.snapshot()
+        logging.info(f"MPRIS: зарегистрирован как {self.service_name}")
+        return True
+
+    def unregister(self):
+        if self.registered:
+            self.bus.unregisterService(self.service_name)
+            self.bus.unregisterObject(OBJECT_PATH)
+            self.registered = False
+
+    def metadata(self):
+        player = self.player
+        path = player.current_file
+        metadata = {"mpris:trackid": QDBusObjectPath(_track_id(path))}
+        if path:
+            status = player.status()
+            metadata["xesam:url"] = "file://" + quote(path)
+            metadata["xesam:title"] = status["title"]
+            metadata["xesam:artist"] = _typed([status["artist"]], QMetaType.QStringList)
+            if status["length_ms"] > 0:
+                metadata["mpris:length"] = _typed(status["length_ms"] * 1000, QMetaType.LongLong)
+        return metadata
+
+    def snapshot(self):
+        """Свойства, об изменении которых сообщается сигналом PropertiesChanged."""
+        status = self.player.status()
+        return {
+            "PlaybackStatus": _PLAYBACK_STATUS.get(status["state"], "Stopped"),
+            "LoopStatus": "Playlist" if status["repeat"] else "None",
+            "Shuffle": status["shuffle"],
+            "Volume": status["volume"] / 100.0,
+            # Метаданные сравниваются по ключевым полям, сам словарь строится только при изменении
+            "Metadata": (status["file"], status["title"], status["artist"], status["length_ms"]),
+        }
+
+    def refresh(self):
+        if not self.registered:
+            return
+        snapshot = self.snapshot()
+        changed = {name: value for name, value in snapshot.items() if self._last_snapshot.get(name) != value}
+        self._last_snapshot = snapshot
+        if not changed:
+            return
+        if "Metadata" in changed:
+            changed["Metadata"] = self.metadata()
+        message = QDBusMessage.createSignal(OBJECT_PATH, PROPERTIES_INTERFACE, "PropertiesChanged")
+        message.setArguments([PLAYER_INTERFACE, changed, _typed([], QMetaType.QStringList)])
+        self.bus.send(message)
+
+    def seeked(self, position_ms):
+        """Сообщает о перемотке (сигнал Seeked), чтобы апплеты пересчитали позицию."""
+        if not self.registered:
+            return
+        message = QDBusMessage.createSignal(OBJECT_PATH, PLAYER_INTERFACE, "Seeked")
+        message.setArguments([_typed(int(position_ms) * 1000, QMetaType.LongLong)])
+        self.bus.send(message)
@@ -1,23 +1,63 @@
 import sys
+
+if __name__ == '__main__':
+    # Повторный запуск передает аргументы уже работающему экземпляру и завершается
+    # до импорта Qt и libvlc, чтобы не тратить время на их инициализацию
+    from remote_control import forward_to_running_instance
+
+    if forward_to_running_instance(sys.argv[1:]):
+        sys.exit(0)
+
 from PyQt5.QtWidgets import (QApplication, QWidget, QPushButton, QVBoxLayout,
                              QHBoxLayout, QFileDialog, QLabel, QSlider, QSizePolicy, QListWidget, QListWidgetItem,
-                             QScrollArea)
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QEvent, QSize, QSettings
+                             QScrollArea, QInputDialog, QMessageBox)
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QEvent, QSize, QSettings, QBuffer, QIODevice
 from PyQt5.QtGui import QPixmap, QImage, QFont, QIcon, QPainter, QBrush, QPainterPath
 import vlc
-from mutagen.mp3 import MP3
-from mutagen.flac import FLAC
-from mutagen.wavpack import WavPack
-from mutagen.id3 import ID3NoHeaderError
 import io
-import threading
+import hashlib
+from collections import deque
 import os
 import logging
 
 from PIL import Image, ImageDraw
 
-from styles import app_stylesheet
+from styles import app_stylesheet, ACCENT_BUCKETS
+from metadata_service import MetadataService, TrackMetadata
+from cover_cache import CoverCache
+from fs_layer import create_file_system
+from stream_server import LibraryHttpServer
+from remote_server import RemoteControlServer
+from view_cache import LevelViewCache
+from seek_index import SeekIndexStore
+from library_index import LibraryIndex
+from ingest import IngestPipeline
+from integrity import IntegrityChecker, PROBLEM_STATUSES, STATUS_BROKEN
+from smart_playlists import SmartPlaylistManager, QueryError
+import similarity
+from tracing import tracer, traced, TRACE_ENV_VAR
+from task_executor import TaskExecutor, PRIORITY_INTERACTIVE, PRIORITY_VISIBLE, PRIORITY_BACKGROUND
+from library_tree import IMAGE_EXTENSIONS, FOLDER_SORT_KEYS, sorted_folders
+from library_roots import LibraryRoots
+import export
 from logger_config import setup_logging
+from key_bindings import KeyBindings
+import mpris
+import archive
+from cover_colors import extract_colors, hue_bucket
+from session_state import SessionState, SessionStore
+
+
+# Максимальный размер, до которого декодируются изображения исполнителей
+ARTIST_IMAGE_MAX_SIDE = 256
+# Шаг перемотки и громкости для горячих клавиш и колесика мыши
+SEEK_STEP_MS = 5000
+VOLUME_STEP = 5
+# Период проверки доступности корней библиотеки (сетевые папки, съемные носители)
+ROOT_PROBE_INTERVAL_MS = 15000
+# Период сохранения снимка сеанса и размер обложки в нем
+SESSION_SAVE_INTERVAL_MS = 10000
+SESSION_COVER_SIDE = 128
 
 
 class SquareLabel(QLabel):
@@ -41,7 +81,88 @@ class SquareLabel(QLabel):
         return QSize(side, side)
 
 
+def render_round_avatar(image_data, width, height, label=""):
+    """
+    Готовит круглый аватар из байтов изображения, пути к файлу или QPixmap.
+    Возвращает QImage или None. Не использует QPixmap для результата,
+    поэтому может вызываться из фоновых потоков.
+    """
+    pil_image = None
+
+    logging.debug(f"render_round_avatar: Attempting to load image for '{label}'")
+
+    if isinstance(image_data, QPixmap) and not image_data.isNull():
+        logging.debug(f"render_round_avatar: Image data is QPixmap.")
+        qimage = image_data.toImage()
+        buffer = io.BytesIO()
+        qimage.save(buffer, "PNG")
+        buffer.seek(0)
+        try:
+            pil_image = Image.open(buffer)
+            logging.debug(
+                f"render_round_avatar: Converted QPixmap to PIL Image for '{label}' (Size: {pil_image.size[0]}x{pil_image.size[1]})")
+        except Exception as e:
+            logging.error(f"render_round_avatar: Failed to convert QPixmap to PIL Image for '{label}': {e}")
+            pil_image = None
+    elif isinstance(image_data, bytes):
+        logging.debug(f"render_round_avatar: Image data is bytes.")
+        try:
+            pil_image = Image.open(io.BytesIO(image_data))
+            # Для JPEG декодируем сразу в уменьшенном разрешении
+            pil_image.draft(None, (width, height))
+            logging.debug(
+                f"render_round_avatar: Successfully loaded PIL Image from raw data for '{label}' (Size: {pil_image.size[0]}x{pil_image.size[1]})")
+        except Exception as e:
+            logging.debug(f"render_round_avatar: Failed to load PIL Image from raw data for '{label}': {e}")
+            pil_image = None
+    elif isinstance(image_data, str):
+        logging.debug(f"render_round_avatar: Image data is path: '{image_data}'.")
+        try:
+            # Обложки папок внутри архивов читаются из члена архива
+            source = io.BytesIO(archive.read_file(image_data)) if archive.is_archive_member(image_data) else image_data
+            pil_image = Image.open(source)
+            pil_image.draft(None, (width, height))
+            logging.debug(
+                f"render_round_avatar: Successfully loaded PIL Image from path '{image_data}' for '{label}' (Size: {pil_image.size[0]}x{pil_image.size[1]})")
+        except Exception as e:
+            logging.debug(f"render_round_avatar: Failed to load PIL Image from path '{image_data}' for '{label}': {e}")
+            pil_image = None
+    else:
+        logging.debug(f"render_round_avatar: No valid image data provided for '{label}'.")
+
+    if not pil_image:
+        return None
+
+    try:
+        # Ensure image has an alpha channel
+        if pil_image.mode != 'RGBA':
+            pil_image = pil_image.convert('RGBA')
+
+        # Resize the image to the exact target size
+        pil_image = pil_image.resize((width, height), Image.LANCZOS)
+
+        # Create a circular mask
+        mask = Image.new('L', (width, height), 0)
+        draw = ImageDraw.Draw(mask)
+        draw.ellipse((0, 0, width, height), fill=255)
+
+        # Apply the mask
+        final_pil_image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        final_pil_image.paste(pil_image, (0, 0), mask)
+
+        # Convert PIL Image to QImage manually; copy() detaches it from the Python buffer
+        img_bytes = final_pil_image.tobytes("raw", "RGBA")
+        qimage_from_pil = QImage(img_bytes, width, height, 4 * width, QImage.Format_RGBA8888).copy()
+        logging.debug(f"render_round_avatar: Rendered avatar for '{label}' ({width}x{height}).")
+        return qimage_from_pil
+    except Exception as e:
+        logging.error(f"render_round_avatar: Exception during PIL image processing for '{label}': {e}")
+        return None
+
+
 class ListItemWidget(QWidget):
+    AVATAR_SIZE = 50
+
     def __init__(self, text, image_data=None, font=None, parent=None, item_type="unknown"):
         super().__init__(parent)
         # Возвращена фиксированная высота элемента списка для стабильности
@@ -52,7 +173,7 @@ class ListItemWidget(QWidget):
         layout.setSpacing(10)
 
         self.image_label = QLabel()
-        self.image_label.setFixedSize(50, 50)
+        self.image_label.setFixedSize(self.AVATAR_SIZE, self.AVATAR_SIZE)
         self.image_label.setStyleSheet("border-radius: 25px; background-color: #333333;")
         self.image_label.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.image_label)
@@ -70,103 +191,16 @@ class ListItemWidget(QWidget):
         self._load_image(image_data, item_type)
 
     def _load_image(self, image_data, item_type):
-        pil_image = None
-
-        logging.debug(
-            f"ListItemWidget: Attempting to load image for '{self.text_label.text()}' (item_type: {item_type})")
-
-        if isinstance(image_data, QPixmap) and not image_data.isNull():
-            logging.debug(f"ListItemWidget: Image data is QPixmap.")
-            qimage = image_data.toImage()
-            buffer = io.BytesIO()
-            qimage.save(buffer, "PNG")
-            buffer.seek(0)
-            try:
-                pil_image = Image.open(buffer)
-                logging.debug(
-                    f"ListItemWidget: Converted QPixmap to PIL Image for '{self.text_label.text()}' (Size: {pil_image.size[0]}x{pil_image.size[1]})")
-            except Exception as e:
-                logging.error(
-                    f"ListItemWidget: Failed to convert QPixmap to PIL Image for '{self.text_label.text()}': {e}")
-                pil_image = None
-        elif isinstance(image_data, bytes):
-            logging.debug(f"ListItemWidget: Image data is bytes.")
-            try:
-                pil_image = Image.open(io.BytesIO(image_data))
-                logging.debug(
-                    f"ListItemWidget: Successfully loaded PIL Image from raw data for '{self.text_label.text()}' (Size: {pil_image.size[0]}x{pil_image.size[1]})")
-            except Exception as e:
-                logging.debug(
-                    f"ListItemWidget: Failed to load PIL Image from raw data for '{self.text_label.text()}': {e}")
-                pil_image = None
-        elif isinstance(image_data, str) and os.path.exists(image_data):
-            logging.debug(f"ListItemWidget: Image data is path: '{image_data}'.")
-            try:
-                pil_image = Image.open(image_data)
-                logging.debug(
-                    f"ListItemWidget: Successfully loaded PIL Image from path '{image_data}' for '{self.text_label.text()}' (Size: {pil_image.size[0]}x{pil_image.size[1]})")
-            except Exception as e:
-                logging.debug(
-                    f"ListItemWidget: Failed to load PIL Image from path '{image_data}' for '{self.text_label.text()}': {e}")
-                pil_image = None
+        # QImage означает уже готовый аватар (например, из кэша уровней библиотеки)
+        if isinstance(image_data, QImage):
+            avatar = image_data
         else:
-            logging.debug(f"ListItemWidget: No valid image data provided for '{self.text_label.text()}'.")
-
-        if pil_image:
-            try:
-                # Ensure image has an alpha channel
-                if pil_image.mode != 'RGBA':
-                    pil_image = pil_image.convert('RGBA')
-                    logging.debug(f"ListItemWidget: Converted PIL Image to RGBA for '{self.text_label.text()}'.")
-
-                target_width = self.image_label.size().width()
-                target_height = self.image_label.size().height()
-                logging.debug(
-                    f"ListItemWidget: Target size for '{self.text_label.text()}': {target_width}x{target_height}.")
-
-                # Resize the image to the exact target size
-                pil_image = pil_image.resize((target_width, target_height), Image.LANCZOS)
-                logging.debug(
-                    f"ListItemWidget: Resized PIL Image to exact target size for '{self.text_label.text()}' (New size: {pil_image.width}x{pil_image.height}).")
-
-                # Create a circular mask
-                mask = Image.new('L', (target_width, target_height), 0)
-                draw = ImageDraw.Draw(mask)
-                draw.ellipse((0, 0, target_width, target_height), fill=255)
-                logging.debug(f"ListItemWidget: Created circular mask for '{self.text_label.text()}'.")
-
-                # Apply the mask
-                final_pil_image = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
-                final_pil_image.paste(pil_image, (0, 0), mask)
-                logging.debug(
-                    f"ListItemWidget: Pasted resized PIL Image with mask onto transparent canvas for '{self.text_label.text()}'.")
-
-                # Convert PIL Image to QImage manually
-                img_bytes = final_pil_image.tobytes("raw", "RGBA")
-                img_width = final_pil_image.width
-                img_height = final_pil_image.height
-                bytes_per_line = 4 * img_width
-
-                qimage_from_pil = QImage(img_bytes, img_width, img_height, bytes_per_line, QImage.Format_RGBA8888)
-
-                final_qpixmap = QPixmap.fromImage(qimage_from_pil)
-
-                if final_qpixmap.isNull():
-                    logging.error(
-                        f"ListItemWidget: Failed to convert final PIL Image to QPixmap via manual QImage for '{self.text_label.text()}'.")
-                    self.image_label.setText("Convert Error")
-                    self.image_label.setPixmap(QPixmap())
-                    return
+            avatar = render_round_avatar(image_data, self.image_label.width(), self.image_label.height(),
+                                         self.text_label.text())
 
-                self.image_label.setPixmap(final_qpixmap)
-                self.image_label.setText("")
-                logging.debug(
-                    f"ListItemWidget: Successfully set pixmap for '{self.text_label.text()}' using PIL and manual QImage conversion.")
-            except Exception as e:
-                logging.error(
-                    f"ListItemWidget: Exception during PIL image processing or setting pixmap for '{self.text_label.text()}': {e}")
-                self.image_label.setText("Render Error")
-                self.image_label.setPixmap(QPixmap())
+        if avatar is not None and not avatar.isNull():
+            self.image_label.setPixmap(QPixmap.fromImage(avatar))
+            self.image_label.setText("")
         else:
             if item_type == "folder":
                 self.image_label.setText("Folder")
@@ -183,8 +217,21 @@ class ListItemWidget(QWidget):
 
 
 class MusicPlayer(QWidget):
-    media_parsed_signal = pyqtSignal(int)
-    library_scan_finished_signal = pyqtSignal(dict)
+    # Сигналы фоновых задач передают TaskToken, чтобы устаревшие результаты отбрасывались
+    media_parsed_signal = pyqtSignal(object, int)
+    root_synced_signal = pyqtSignal(object, object, object, object)
+    seek_table_ready_signal = pyqtSignal(object, object)
+    ingest_progress_signal = pyqtSignal(object, int, int)
+    ingest_finished_signal = pyqtSignal(object, object)
+    smart_playlists_changed_signal = pyqtSignal(object)
+    smart_playlist_ready_signal = pyqtSignal(object, object, object, int)
+    similarity_ready_signal = pyqtSignal(object, object)
+    export_progress_signal = pyqtSignal(object, object)
+    export_finished_signal = pyqtSignal(object, object)
+    integrity_progress_signal = pyqtSignal(object, int, int)
+    integrity_ready_signal = pyqtSignal(object, object, object)
+    track_stats_signal = pyqtSignal(object, object)
+    cover_colors_signal = pyqtSignal(object, object)
 
     def __init__(self):
         super().__init__()
@@ -203,21 +250,72 @@ class MusicPlayer(QWidget):
         except Exception as e:
             logging.error(f"Ошибка загрузки иконки: {e}. Убедитесь, что '{icon_path}' существует и доступен.")
 
+        # Весь ввод-вывод библиотеки идет через файловый слой с кэшем листингов.
+        # MUSIC_PLAYER_FS_LATENCY_MS включает тестовую задержку для замеров медленных ресурсов.
+        self.fs = create_file_system(
+            slow_storage=self.settings.value("slow_storage_mode", False, type=bool),
+            latency_ms=int(os.environ.get("MUSIC_PLAYER_FS_LATENCY_MS", "0")))
+
+        # Все фоновые задачи идут через общий пул с приоритетами и отменой по каналам.
+        # library_io: не больше трех задач библиотеки сразу, чтобы для воспроизведения оставались потоки;
+        # у каждого корня библиотеки свой предел (LibraryRoot.resource), медленный корень не держит остальные;
+        # media: не больше двух одновременных разборов треков при быстром переключении
+        self.executor = TaskExecutor(max_workers=6, resource_limits={"library_io": 3, "media": 2})
+
         self.media_player = vlc.MediaPlayer()
+        self.archive_streams = archive.VlcArchiveStreams(vlc)
+        # Начало воспроизведения завершает замер задержки "клик - звук", ошибка - отменяет
+        self.media_player.event_manager().event_attach(vlc.EventType.MediaPlayerPlaying, self._on_vlc_playing)
+        self.media_player.event_manager().event_attach(vlc.EventType.MediaPlayerEncounteredError,
+                                                       self._on_vlc_error)
+        self.metadata_service = MetadataService(fs=self.fs)
+        self.cover_cache = CoverCache()
+        # Индекс метаданных всей библиотеки заполняется фоновой индексацией после сканирования
+        self.library_index = LibraryIndex()
+        # Умные плейлисты обновляются инкрементально при каждой записи в индекс
+        self.smart_playlists = SmartPlaylistManager(self.library_index)
+        self.smart_playlists.add_listener(self.smart_playlists_changed_signal.emit)
+        # Треки с ошибками структуры (путь -> (состояние, подробности)) по результатам прошлых проверок.
+        # Словарь заменяется целиком, поэтому его можно читать из фоновой подготовки уровней
+        self.track_problems = self.library_index.integrity_problems(PROBLEM_STATUSES)
+        # Итоги папок (треки, длительность, размер) следуют за каждой записью в индекс
+        self.library_index.add_listener(self._on_index_changed_in_thread)
+        self._displayed_playlist = None
+        # Токен последнего запущенного экспорта: итог замененного задания не должен затирать статус нового
+        self._export_token = None
         self.current_file = None
         self.total_length_ms = 0
-        self.original_cover_pixmap = None
+        # Таблицы перемотки MP3 (время -> смещение кадра) хранятся в кэше между запусками
+        self.seek_index = SeekIndexStore()
+        self.seek_table = None
+        self._pending_seek_ms = None
+        self.current_cover_record = None
+        # Корзины оттенка цветов обложки (styles.ACCENT_BUCKETS), -1 - базовая палитра
+        self.cover_tint = -1
+        self.cover_accent = -1
+        self.current_cover_colors = None
         self.artist_pixmap = None
 
-        self.library_data = {}
+        # Дерево для просмотра: объединение деревьев всех корней библиотеки
+        self.library_tree = None
         self.current_library_path = []
-        self.root_library_folder = None
 
         self.is_shuffling = False
         self.is_repeating = False
 
-        self.current_album_tracks = []
+        self.current_album_tracks = ()
+        self.current_album_node = None
         self.current_track_index = -1
+        # Треки, добавленные в очередь извне (канал управления, повторный запуск с файлами)
+        self.play_queue = deque()
+        # Режим радио: когда очередь и альбом закончились, играют похожие треки
+        self.radio_mode = self.settings.value("radio_mode", True, type=bool)
+        self.similarity_index = None
+        self._radio_history = deque(maxlen=50)
+        # Откуда радио уводило воспроизведение: (путь, треки альбома, узел, индекс) для кнопки "Предыдущий"
+        self._radio_back_stack = deque(maxlen=50)
+        # Управление из окружения рабочего стола (MPRIS) появляется после init_ui
+        self.mpris = None
 
         self.icon_dir = os.path.join(os.path.dirname(__file__), 'media', 'control_panel_track')
         self.play_icon_path = os.path.join(self.icon_dir, 'play.ico')
@@ -226,33 +324,129 @@ class MusicPlayer(QWidget):
         self.next_icon_path = os.path.join(self.icon_dir, 'next.ico')
         self.shuffle_icon_path = os.path.join(self.icon_dir, 'shuffle.ico')
         self.repeat_icon_path = os.path.join(self.icon_dir, 'repeat.ico')
+        # Иконки загружаются с диска один раз
+        self.icons = {
+            'play': QIcon(self.play_icon_path),
+            'pause': QIcon(self.pause_icon_path),
+            'prev': QIcon(self.prev_icon_path),
+            'next': QIcon(self.next_icon_path),
+            'shuffle': QIcon(self.shuffle_icon_path),
+            'repeat': QIcon(self.repeat_icon_path),
+        }
+
+        # Пересчет шрифтов и размеров при изменении окна откладывается и объединяется
+        self._size_class = None
+        self._scaled_cover_cache = {}
+        self.layout_update_timer = QTimer(self)
+        self.layout_update_timer.setSingleShot(True)
+        self.layout_update_timer.setInterval(50)
+        self.layout_update_timer.timeout.connect(self._apply_layout_update)
+
+        # Кэш готовых уровней библиотеки для мгновенной навигации назад
+        self.level_view_cache = LevelViewCache()
+        self._displayed_level_key = None
+        self._hovered_level_key = None
+        self.prebuild_timer = QTimer(self)
+        self.prebuild_timer.setSingleShot(True)
+        self.prebuild_timer.setInterval(150)
+        self.prebuild_timer.timeout.connect(self._prebuild_hovered_level)
+        # Итоги папок меняются каждой пачкой индексации, подписи обновляются не чаще раза в секунду
+        self.library_sort = self.settings.value("library_sort", "name", type=str)
+        self.folder_totals_timer = QTimer(self)
+        self.folder_totals_timer.setSingleShot(True)
+        self.folder_totals_timer.setInterval(1000)
+        self.folder_totals_timer.timeout.connect(self._refresh_folder_summaries)
+
+        # Снимок сеанса: трек с позицией, очередь, режимы и место в библиотеке между запусками.
+        # Альбом и папка библиотеки из снимка применяются, когда их узлы появятся в дереве корней
+        self.session_store = SessionStore()
+        self._session_cover = (None, b'')
+        self._pending_session_album = None
+        self._pending_session_view = None
+        self._restored_scroll = None
 
         self.supported_extensions = ('.mp3', '.flac', '.wav')
-        self.image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+        self.image_extensions = IMAGE_EXTENSIONS
+        self.library_roots = LibraryRoots(self.fs, self.supported_extensions)
 
         self.init_ui()
         self.setup_timer()
-
-        self.media_player.audio_set_volume(50)
-        self.volume_slider.setValue(50)
+        self._restore_session()
+
+        # Необязательный HTTP-сервер библиотеки (для других устройств сети - с настройкой http_server_lan)
+        self.http_server = None
+        http_server_port = self.settings.value("http_server_port", 0, type=int)
+        if http_server_port > 0:
+            # Доступ из локальной сети - только по явной настройке: у сервера нет авторизации
+            http_server_host = "0.0.0.0" if self.settings.value("http_server_lan", False, type=bool) else "127.0.0.1"
+            self.http_server = LibraryHttpServer(metadata_service=self.metadata_service, host=http_server_host,
+                                                 port=http_server_port)
+            try:
+                self.http_server.start_in_thread()
+            except OSError as e:
+                logging.error(f"Не удалось запустить HTTP-сервер на порту {http_server_port}: {e}")
+                self.http_server = None
+
+        # Горячие клавиши обрабатываются самим Qt через QAction, без глобального фильтра событий
+        self.key_bindings = KeyBindings(self, self.settings, {
+            "toggle_play_pause": self.toggle_play_pause,
+            "play_next_track": self.play_next_track,
+            "play_previous_track": self.play_previous_track,
+            "stop_music": self.stop_music,
+            "seek_forward": lambda: self.seek_by(SEEK_STEP_MS),
+            "seek_backward": lambda: self.seek_by(-SEEK_STEP_MS),
+            "volume_up": lambda: self.change_volume(VOLUME_STEP),
+            "volume_down": lambda: self.change_volume(-VOLUME_STEP),
+            "toggle_shuffle": self.toggle_shuffle,
+            "toggle_repeat": self.toggle_repeat,
+            "navigate_back": self._navigate_back,
+            "open_library_folder": self.open_library_folder,
+            "export_current_view": self.export_current_view,
+        })
+        # Мультимедийные клавиши и апплеты рабочего стола Linux, в том числе при свернутом окне
+        if mpris.is_available():
+            self.mpris = mpris.MprisService(self, parent=self)
+            if not self.mpris.register():
+                self.mpris = None
+
+        # Канал управления для внешних команд и передачи аргументов повторного запуска
+        self.remote_control = RemoteControlServer(self)
+        self.remote_control.listen()
 
         self.media_parsed_signal.connect(self._on_media_parsed)
-        self.library_scan_finished_signal.connect(self._on_library_scan_finished)
-
-        QApplication.instance().installEventFilter(self)
-
-        last_folder = self.settings.value("last_music_folder", "", type=str)
-        if last_folder and os.path.isdir(last_folder):
-            logging.info(f"Загрузка последней папки: {last_folder}")
-            self.root_library_folder = last_folder
-            self.library_list_widget.clear()
-            self.library_data.clear()
-            self.current_library_path = []
-            self.back_button.setEnabled(False)
-            threading.Thread(target=self._scan_music_folder_in_thread,
-                             args=(last_folder, self.supported_extensions)).start()
-        else:
-            logging.info("Последняя папка не найдена или недействительна.")
+        self.root_synced_signal.connect(self._on_root_synced)
+        self.seek_table_ready_signal.connect(self._on_seek_table_ready)
+        self.ingest_progress_signal.connect(self._on_ingest_progress)
+        self.ingest_finished_signal.connect(self._on_ingest_finished)
+        self.smart_playlists_changed_signal.connect(self._on_smart_playlists_changed)
+        self.smart_playlist_ready_signal.connect(self._on_smart_playlist_ready)
+        self.similarity_ready_signal.connect(self._on_similarity_ready)
+        self.export_progress_signal.connect(self._on_export_progress)
+        self.export_finished_signal.connect(self._on_export_finished)
+        self.integrity_progress_signal.connect(self._on_integrity_progress)
+        self.integrity_ready_signal.connect(self._on_integrity_ready)
+        self.track_stats_signal.connect(self._on_track_stats)
+        self.cover_colors_signal.connect(self._on_cover_colors)
+        self.session_save_timer = QTimer(self)
+        self.session_save_timer.setInterval(SESSION_SAVE_INTERVAL_MS)
+        self.session_save_timer.timeout.connect(self._save_session)
+        self.session_save_timer.start()
+        if similarity.is_available():
+            self.executor.submit(self._load_similarity_in_thread, priority=PRIORITY_BACKGROUND, channel="similarity")
+
+        # Корни библиотеки показываются из снимков сразу, доступность проверяется в фоне
+        root_paths = self.settings.value("library_roots", [], type=list)
+        if not root_paths:
+            last_folder = self.settings.value("last_music_folder", "", type=str)
+            root_paths = [last_folder] if last_folder else []
+        for root_path in root_paths:
+            self.add_library_root(root_path, save=False)
+        if not root_paths:
+            logging.info("Корни библиотеки не заданы.")
+        self.root_probe_timer = QTimer(self)
+        self.root_probe_timer.setInterval(ROOT_PROBE_INTERVAL_MS)
+        self.root_probe_timer.timeout.connect(self._probe_library_roots)
+        self.root_probe_timer.start()
 
         self.showMaximized()
 
@@ -288,6 +482,7 @@ class MusicPlayer(QWidget):
         library_controls_layout = QHBoxLayout()
         self.search_library_button = QPushButton("Поиск")
         self.recent_button = QPushButton("Недавние")
+        self.recent_button.clicked.connect(lambda: self._show_smart_playlist("Недавние"))
         self.artists_button = QPushButton("Исполнители")
         self.albums_button = QPushButton("Альбомы")
         library_controls_layout.addWidget(self.search_library_button)
@@ -313,12 +508,17 @@ class MusicPlayer(QWidget):
         self.library_list_widget = QListWidget()
         self.library_list_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.library_list_widget.itemClicked.connect(self.load_track_from_library)
+        # Отслеживание наведения нужно для фоновой подготовки следующего уровня
+        self.library_list_widget.setMouseTracking(True)
+        self.library_list_widget.itemEntered.connect(self._on_library_item_entered)
         self.library_scroll_area.setWidget(self.library_list_widget)
         left_panel_layout.addWidget(self.library_scroll_area)
 
         # Нижние элементы управления библиотекой (Скрыть прямо)
         library_bottom_controls_layout = QHBoxLayout()
         self.hide_direct_button = QPushButton("Скрыть прямо")
+        self.library_status_label = QLabel("")
+        library_bottom_controls_layout.addWidget(self.library_status_label)
         library_bottom_controls_layout.addStretch(1)
         library_bottom_controls_layout.addWidget(self.hide_direct_button)
         left_panel_layout.addLayout(library_bottom_controls_layout)
@@ -362,6 +562,12 @@ class MusicPlayer(QWidget):
         self.repeat_button.clicked.connect(self.toggle_repeat)
         self.repeat_button.setFocusPolicy(Qt.NoFocus)
 
+        self.radio_button = QPushButton("Радио")
+        self.radio_button.setObjectName("radioButton")
+        self.radio_button.setToolTip("Когда альбом закончился, продолжать похожими треками")
+        self.radio_button.clicked.connect(self.toggle_radio)
+        self.radio_button.setFocusPolicy(Qt.NoFocus)
+
         # Инициализация меток времени и ползунка позиции здесь
         self.current_time_label = QLabel("00:00")
         self.total_time_label = QLabel("00:00")
@@ -417,6 +623,7 @@ class MusicPlayer(QWidget):
         # --- Правая секция нижней панели: громкость ---
         right_volume_layout = QHBoxLayout()  # Используем QHBoxLayout для горизонтального расположения
         right_volume_layout.addStretch(1)  # Прижимаем к правому краю
+        right_volume_layout.addWidget(self.radio_button)
         self.volume_label = QLabel("Громкость: 50%")
         right_volume_layout.addWidget(self.volume_label)
         self.volume_slider = QSlider(Qt.Horizontal)
@@ -432,16 +639,22 @@ class MusicPlayer(QWidget):
 
         self.setLayout(root_layout)  # Устанавливаем корневой макет для всего окна
         self._update_font_sizes()
-        self.shuffle_button.setIcon(QIcon(self.shuffle_icon_path))
-        self.prev_track_button.setIcon(QIcon(self.prev_icon_path))
-        self.next_track_button.setIcon(QIcon(self.next_icon_path))
-        self.repeat_button.setIcon(QIcon(self.repeat_icon_path))
+        self.shuffle_button.setIcon(self.icons['shuffle'])
+        self.prev_track_button.setIcon(self.icons['prev'])
+        self.next_track_button.setIcon(self.icons['next'])
+        self.repeat_button.setIcon(self.icons['repeat'])
+
+        # Стили кнопок управления задаются в app_stylesheet через динамические свойства
+        for button in [self.shuffle_button, self.prev_track_button, self.next_track_button, self.repeat_button]:
+            button.setProperty("playerControl", True)
+        self.play_pause_button.setObjectName("playPauseButton")
 
         self._update_button_style(self.shuffle_button, self.is_shuffling)
         self._update_button_style(self.prev_track_button, False)
         self._update_play_pause_button_style()
         self._update_button_style(self.next_track_button, False)
         self._update_button_style(self.repeat_button, self.is_repeating)
+        self._update_button_style(self.radio_button, self.radio_mode)
 
     def setup_timer(self):
         self.timer = QTimer(self)
@@ -453,8 +666,12 @@ class MusicPlayer(QWidget):
         if not self.position_slider.isSliderDown():
             current_state = self.media_player.get_state()
 
+            if current_state == vlc.State.Playing and self._pending_seek_ms is not None:
+                self._seek_to(self._pending_seek_ms)
+                self._pending_seek_ms = None
+
             if current_state == vlc.State.Playing or current_state == vlc.State.Paused:
-                current_time = self.media_player.get_time()
+                current_time = self.current_time_ms()
                 if self.total_length_ms > 0:
                     position = int((current_time / self.total_length_ms) * 1000)
                     self.position_slider.setValue(position)
@@ -471,6 +688,7 @@ class MusicPlayer(QWidget):
         seconds %= 60
         return f"{minutes:02}:{seconds:02}"
 
+    @traced()
     def open_file(self, file_path):
         if not file_path:
             logging.error("Ошибка: Не указан путь к файлу для открытия.")
@@ -480,12 +698,23 @@ class MusicPlayer(QWidget):
         if self.media_player.is_playing() or self.media_player.get_state() == vlc.State.Paused:
             self.media_player.stop()
 
+        problem = self.track_problems.get(file_path)
+        if problem is not None:
+            logging.warning(f"Трек {file_path} поврежден ({problem[0]}): {problem[1]}")
         self.current_file = file_path
+        self._radio_history.append(file_path)
+        self.seek_table = None
+        self._pending_seek_ms = None
 
-        media = vlc.Media(self.current_file)
+        if archive.is_archive_member(file_path):
+            # Член архива libvlc читает через обратные вызовы, без распаковки во временный файл
+            media = self.archive_streams.media(self.media_player.get_instance(), file_path)
+        else:
+            media = vlc.Media(self.current_file)
         self.media_player.set_media(media)
 
         self.read_metadata(file_path)
+        self.executor.submit(self._record_play_in_thread, file_path, priority=PRIORITY_BACKGROUND)
 
         self.position_slider.setEnabled(True)
         self.play_pause_button.setEnabled(True)
@@ -494,118 +723,201 @@ class MusicPlayer(QWidget):
         self.shuffle_button.setEnabled(True)
         self.repeat_button.setEnabled(True)
 
-        threading.Thread(target=self._parse_media_in_thread, args=(self.current_file,)).start()
+        self.executor.submit(self._parse_media_in_thread, self.current_file,
+                             priority=PRIORITY_INTERACTIVE, channel="media_parse", resource="media")
+        # Таблица перемотки строится через mmap файла, для членов архивов перемотку выполняет libvlc
+        if file_path.lower().endswith('.mp3') and not archive.is_archive_member(file_path):
+            self.executor.submit(self._build_seek_table_in_thread, self.current_file,
+                                 priority=PRIORITY_INTERACTIVE, channel="seek_table", resource="media")
+        else:
+            self.executor.cancel("seek_table")
 
         self.play_music()
 
-    def _parse_media_in_thread(self, file_path):
+    @traced(category="background")
+    def _parse_media_in_thread(self, token, file_path):
         try:
+            if archive.is_archive_member(file_path):
+                # Длительность члена архива известна из тегов, разобранных metadata_service
+                self.media_parsed_signal.emit(token, self.metadata_service.get(file_path).duration_ms)
+                return
             temp_media = vlc.Media(file_path)
             temp_media.parse()
 
             total_duration = temp_media.get_duration()
-            self.media_parsed_signal.emit(total_duration)
+            self.media_parsed_signal.emit(token, total_duration)
         except Exception as e:
             logging.error(f"Ошибка парсинга медиа в потоке: {e}")
-            self.media_parsed_signal.emit(0)
+            self.media_parsed_signal.emit(token, 0)
+
+    def _record_play_in_thread(self, token, file_path):
+        self.library_index.record_play(file_path)
 
-    def _on_media_parsed(self, total_length_ms):
-        self.total_length_ms = total_length_ms
-        self.total_time_label.setText(self.format_time(total_length_ms))
+    def _on_media_parsed(self, token, total_length_ms):
+        if not self.executor.is_current(token):
+            return
+        # Длительность из таблицы перемотки точнее оценки libvlc для VBR-файлов
+        if self.seek_table is None or self.seek_table.duration_ms <= 0:
+            self.total_length_ms = total_length_ms
+            self.total_time_label.setText(self.format_time(total_length_ms))
         self.position_slider.setValue(0)
+        self._notify_state_changed()
+
+    def _build_seek_table_in_thread(self, token, file_path):
+        table = self.seek_index.get_or_build(file_path)
+        self.seek_table_ready_signal.emit(token, table)
 
+    def _on_seek_table_ready(self, token, table):
+        if not self.executor.is_current(token) or table is None:
+            return
+        self.seek_table = table
+        if table.duration_ms > 0:
+            self.total_length_ms = table.duration_ms
+            self.total_time_label.setText(self.format_time(table.duration_ms))
+            self._notify_state_changed()
+
+    @traced()
     def read_metadata(self, file_path):
+        if file_path.lower().endswith('.wav'):
+            logging.info(
+                f"Примечание: Метаданные для WAV-файлов (кроме WavPack) могут быть недоступны: {file_path}")
+            self._set_cover_colors(None)
+            return
+        if not file_path.lower().endswith(('.mp3', '.flac')):
+            self._set_cover_colors(None)
+            return
+
         try:
-            audio = None
-            if file_path.lower().endswith('.mp3'):
-                audio = MP3(file_path)
-            elif file_path.lower().endswith('.flac'):
-                audio = FLAC(file_path)
-            elif file_path.lower().endswith('.wav'):
-                logging.info(
-                    f"Примечание: Метаданные для WAV-файлов (кроме WavPack) могут быть недоступны: {file_path}")
-                return
-            else:
-                return
+            record = self.metadata_service.get(file_path)
 
-            if audio:
-                title = audio.get('TIT2', audio.get('title', ['-']))[0] if audio.get('TIT2') or audio.get(
-                    'title') else '-'
-                artist = audio.get('TPE1', audio.get('artist', ['-']))[0] if audio.get('TPE1') or audio.get(
-                    'artist') else '-'
-                album = audio.get('TALB', audio.get('album', ['-']))[0] if audio.get('TALB') or audio.get(
-                    'album') else '-'
-
-                # Обновление информации в нижней панели
-                self.current_track_title.setText(title)
-                self.current_track_artist.setText(artist)
-
-                pixmap = QPixmap()
-                if file_path.lower().endswith('.mp3'):
-                    for tag in audio.getall('APIC'):
-                        if tag.type == 3:
-                            pixmap.loadFromData(tag.data)
-                            self.original_cover_pixmap = pixmap
-                            break
-                elif file_path.lower().endswith('.flac') and audio.pictures:
-                    for pic in audio.pictures:
-                        if pic.type == 3:
-                            image = QImage.fromData(pic.data)
-                            if not image.isNull():
-                                pixmap = QPixmap.fromImage(image)
-                                self.original_cover_pixmap = pixmap
-                                break
-
-                self._update_current_track_cover_display()  # Обновление обложки в нижней панели
-
-                dir_name = os.path.dirname(file_path)
-                artist_folder_name = os.path.basename(dir_name)
-
-                found_artist_image = False
-                for ext in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']:
-                    artist_image_filename = artist_folder_name.lower() + ext
-                    artist_image_path = os.path.join(dir_name, artist_image_filename)
-                    logging.debug(f"Checking for artist image at: {artist_image_path}")
-                    if os.path.exists(artist_image_path):
-                        artist_pixmap_temp = QPixmap()
-                        if artist_pixmap_temp.load(artist_image_path):
-                            self.artist_pixmap = artist_pixmap_temp
-                            logging.debug(f"Successfully loaded artist image: {artist_image_path}")
-                            found_artist_image = True
-                            break
-                        else:
-                            logging.debug(f"Failed to load QPixmap from: {artist_image_path}")
-
-                if not found_artist_image:
-                    self.artist_pixmap = None
-                    logging.debug(f"No artist image found for folder: {artist_folder_name} in {dir_name}")
-
-
-        except ID3NoHeaderError:
-            logging.info(f"Нет ID3 тегов для {file_path}. Возможно, это не MP3 или теги отсутствуют.")
-            self.current_track_title.setText("Название трека")
-            self.current_track_artist.setText("Исполнитель")
-            self.original_cover_pixmap = None
+            # Обновление информации в нижней панели
+            self.current_track_title.setText(record.title or '-')
+            self.current_track_artist.setText(record.artist or '-')
+
+            self._set_current_cover(record if record.has_cover else None)
+
+            self._update_current_track_cover_display()  # Обновление обложки в нижней панели
+            self._update_cover_colors(file_path, record)
+
+            dir_name = os.path.dirname(file_path)
+            artist_folder_name = os.path.basename(dir_name)
+
+            # Изображение исполнителя ищется среди картинок, найденных при сканировании
             self.artist_pixmap = None
-            self._update_current_track_cover_display()
+            folder_node = self.library_tree.node_for_path(dir_name) if self.library_tree else None
+            artist_image_path = folder_node.find_artwork(artist_folder_name) if folder_node else None
+            if artist_image_path is not None:
+                artist_image = self.cover_cache.get(artist_image_path, lambda: artist_image_path,
+                                                    ARTIST_IMAGE_MAX_SIDE)
+                if artist_image is not None:
+                    self.artist_pixmap = QPixmap.fromImage(artist_image)
+                    logging.debug(f"Successfully loaded artist image: {artist_image_path}")
+                else:
+                    logging.debug(f"Failed to load artist image from: {artist_image_path}")
+            else:
+                logging.debug(f"No artist image found for folder: {artist_folder_name} in {dir_name}")
+
         except Exception as e:
             logging.error(f"Ошибка чтения метаданных для {file_path}: {e}")
             self.current_track_title.setText("Название трека")
             self.current_track_artist.setText("Исполнитель")
-            self.original_cover_pixmap = None
+            self._set_current_cover(None)
             self.artist_pixmap = None
             self._update_current_track_cover_display()
+            self._set_cover_colors(None)
+
+    def _update_cover_colors(self, file_path, record):
+        """
+        Цвета обложки берутся из индекса (их вычисляет индексация); если трека нет в индексе
+        или он проиндексирован до появления цветов, они вычисляются в фоне и сохраняются по хэшу обложки.
+        """
+        if not record.has_cover:
+            self.executor.cancel("cover_colors")
+            self._set_cover_colors(None)
+            return
+        found = self.library_index.cover_colors_for(file_path)
+        if found is not None and found[1] is not None:
+            self.executor.cancel("cover_colors")
+            self._set_cover_colors(found[1])
+            return
+        self._set_cover_colors(None)
+        self.executor.submit(self._cover_colors_in_thread, record, priority=PRIORITY_VISIBLE,
+                             channel="cover_colors", resource="media")
+
+    def _cover_colors_in_thread(self, token, record):
+        data = self.metadata_service.get_cover_data(record)
+        colors = extract_colors(data)
+        if colors is not None:
+            self.library_index.write_cover_colors([(hashlib.sha1(data).hexdigest(),) + colors])
+        self.cover_colors_signal.emit(token, colors)
+
+    def _on_cover_colors(self, token, colors):
+        if self.executor.is_current(token):
+            self._set_cover_colors(colors)
+
+    def _set_cover_colors(self, colors):
+        """
+        Окрашивает нижнюю панель в оттенок основного цвета обложки, а активные кнопки - в акцентный.
+        Меняются только динамические свойства tint и accent, правила для них заранее есть в app_stylesheet.
+        """
+        self.current_cover_colors = colors
+        tint = accent = -1
+        if colors is not None:
+            dominant, accent_color = colors
+            # Для фона панели достаточно слабого оттенка, акцент должен быть насыщенным
+            tint = hue_bucket(dominant, ACCENT_BUCKETS, min_saturation=0.15)
+            accent = hue_bucket(accent_color, ACCENT_BUCKETS)
+            tint = -1 if tint is None else tint
+            accent = -1 if accent is None else accent
+        if tint != self.cover_tint:
+            self.cover_tint = tint
+            self.bottom_player_panel.setProperty("tint", tint)
+            self.bottom_player_panel.style().unpolish(self.bottom_player_panel)
+            self.bottom_player_panel.style().polish(self.bottom_player_panel)
+        if accent != self.cover_accent:
+            self.cover_accent = accent
+            for button in [self.shuffle_button, self.prev_track_button, self.next_track_button,
+                           self.repeat_button, self.radio_button]:
+                button.setProperty("accent", accent)
+                button.style().unpolish(button)
+                button.style().polish(button)
 
     def _update_cover_display(self):
         # Этот метод теперь не нужен, так как cover_label удален из правой панели
         pass
 
+    def _set_current_cover(self, record):
+        """Меняет обложку текущего трека и сбрасывает кэш масштабированных копий."""
+        self.current_cover_record = record
+        self._scaled_cover_cache.clear()
+
+    def _current_cover_pixmap(self, target_size):
+        """
+        Возвращает обложку текущего трека под размер target_size.
+        Декодирование идет через cover_cache, поэтому полноразмерная обложка в памяти не хранится.
+        """
+        cache_key = (target_size.width(), target_size.height())
+        scaled_pixmap = self._scaled_cover_cache.get(cache_key)
+        if scaled_pixmap is None:
+            record = self.current_cover_record
+            max_side = int(max(cache_key) * self.devicePixelRatioF())
+            image = self.cover_cache.get(record.cover_ref,
+                                         lambda: self.metadata_service.get_cover_data(record), max_side)
+            if image is None:
+                return None
+            scaled_pixmap = QPixmap.fromImage(image).scaled(target_size,
+                                                            Qt.KeepAspectRatio,
+                                                            Qt.SmoothTransformation)
+            self._scaled_cover_cache[cache_key] = scaled_pixmap
+        return scaled_pixmap
+
+    @traced()
     def _update_current_track_cover_display(self):
         """Обновляет отображение обложки текущего трека в нижней панели."""
-        if self.original_cover_pixmap:
-            scaled_pixmap = self.original_cover_pixmap.scaled(self.current_track_cover.size(),
-                                                              Qt.KeepAspectRatio,
-                                                              Qt.SmoothTransformation)
+        scaled_pixmap = None
+        if self.current_cover_record is not None:
+            scaled_pixmap = self._current_cover_pixmap(self.current_track_cover.size())
+        if scaled_pixmap is not None:
             self.current_track_cover.setPixmap(scaled_pixmap)
             self.current_track_cover.setText("")
         else:
@@ -616,15 +928,28 @@ class MusicPlayer(QWidget):
         # Этот метод теперь не нужен, так как artist_image_label удален из правой панели
         pass
 
-    def _update_font_sizes(self):
+    def _compute_size_class(self):
+        """Вычисляет набор размеров шрифтов и кнопок для текущего размера окна."""
         window_side = min(self.width(), self.height())
-        base_font_size = max(8, int(window_side * 0.01))
+        return (
+            max(8, int(window_side * 0.01)),  # базовый шрифт нижней панели
+            max(8, int(window_side * 0.007)),  # шрифт кнопок
+            max(32, int(window_side * 0.025)),  # размер иконок
+            max(60, int(window_side * 0.05)),  # размер кнопок управления
+            max(8, int(window_side * 0.007)),  # шрифт меток времени и громкости
+        )
+
+    def _update_font_sizes(self):
+        size_class = self._compute_size_class()
+        if size_class == self._size_class:
+            return
+        self._size_class = size_class
+        base_font_size, button_font_size, icon_size, button_fixed_size, time_label_font_size = size_class
 
         # Шрифты для нижней панели
         self.current_track_title.setFont(QFont("Arial", base_font_size, QFont.Bold))
         self.current_track_artist.setFont(QFont("Arial", base_font_size - 2))
 
-        button_font_size = max(8, int(window_side * 0.007))
         font = QFont("Arial", button_font_size)
         self.back_button.setFont(font)
         self.my_media_button.setFont(font)
@@ -634,62 +959,228 @@ class MusicPlayer(QWidget):
         self.artists_button.setFont(font)
         self.albums_button.setFont(font)
         self.hide_direct_button.setFont(font)
+        self.library_status_label.setFont(font)
 
         # Динамический размер иконок и кнопок
-        icon_size = max(32, int(window_side * 0.025))
-        button_fixed_size = max(60, int(window_side * 0.05))
-
         for button in [self.play_pause_button, self.prev_track_button, self.next_track_button,
                        self.shuffle_button, self.repeat_button]:
             button.setIconSize(QSize(icon_size, icon_size))
             button.setFixedSize(button_fixed_size, button_fixed_size)
 
-        time_label_font_size = max(8, int(window_side * 0.007))
         time_font = QFont("Arial", time_label_font_size)
         self.current_time_label.setFont(time_font)
         self.total_time_label.setFont(time_font)
 
         self.volume_label.setFont(time_font)
 
-        self._update_button_style(self.shuffle_button, self.is_shuffling)
-        self._update_button_style(self.prev_track_button, False)
-        self._update_play_pause_button_style()
-        self._update_button_style(self.next_track_button, False)
-        self._update_button_style(self.repeat_button, self.is_repeating)
+    def _apply_layout_update(self):
+        """Применяет накопленные изменения размера окна одним проходом."""
+        self._update_font_sizes()
+        self._update_current_track_cover_display()
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        QTimer.singleShot(0, self._update_current_track_cover_display)  # Обновление обложки в нижней панели
-        QTimer.singleShot(0, self._update_font_sizes)
+        self.layout_update_timer.start()
 
     def changeEvent(self, event):
         if event.type() == QEvent.WindowStateChange:
-            QTimer.singleShot(0, self._update_current_track_cover_display)  # Обновление обложки в нижней панели
-            QTimer.singleShot(0, self._update_font_sizes)
+            self.layout_update_timer.start()
         super().changeEvent(event)
 
-    def eventFilter(self, obj, event):
+    def _on_vlc_playing(self, event):
+        # Вызывается в потоке libvlc; current_file задается в open_file до set_media
+        latency_ms = tracer.end_track_start(self.current_file)
+        if latency_ms is not None:
+            logging.debug(f"Задержка от клика до звука: {latency_ms:.0f} мс")
+
+    def _on_vlc_error(self, event):
+        # Вызывается в потоке libvlc
+        tracer.cancel_track_start()
+
+    def closeEvent(self, event):
+        summary = tracer.latency_summary()
+        if summary["count"]:
+            logging.info(f"Задержка от клика до звука: p50 {summary['p50']} мс, p95 {summary['p95']} мс, "
+                         f"p99 {summary['p99']} мс ({summary['count']} запусков)")
+        trace_path = os.environ.get(TRACE_ENV_VAR)
+        if trace_path:
+            try:
+                tracer.export_chrome_trace(trace_path)
+            except OSError as e:
+                logging.error(f"Не удалось сохранить трассировку {trace_path}: {e}")
+        # Индексация сохраняет уже разобранные пачки и продолжится при следующем запуске
+        self.session_save_timer.stop()
+        session = self._session_state()
+        self.executor.shutdown()
+        # Фоновые записи снимка уже завершены, последний пишется здесь же
+        self._save_session_in_thread(None, session, self.current_cover_record)
+        self.metadata_service.shutdown()
+        self.remote_control.close()
+        if self.mpris is not None:
+            self.mpris.unregister()
+        super().closeEvent(event)
+
+    def _restore_session(self):
         """
-        Фильтр событий для обработки прокрутки колесика мыши на ползунке громкости
-        и для глобальной обработки нажатия клавиши пробел.
+        Восстанавливает прошлый сеанс до первой отрисовки окна: громкость, режимы, очередь,
+        название, обложку, цвета и позицию трека берутся из снимка, сам файл трека не читается.
+        Воспроизведение начинается по кнопке с сохраненной позиции.
         """
-        if obj == self.volume_slider and event.type() == QEvent.Wheel:
-            delta = event.angleDelta().y()
-            current_volume = self.volume_slider.value()
+        state = self.session_store.load()
+        volume = state.volume if state is not None else 50
+        self.volume_slider.setValue(volume)
+        self.set_volume(volume)
+        if state is None:
+            return
+        if state.shuffle != self.is_shuffling:
+            self.is_shuffling = state.shuffle
+            self._update_button_style(self.shuffle_button, self.is_shuffling)
+        if state.repeat != self.is_repeating:
+            self.is_repeating = state.repeat
+            self._update_button_style(self.repeat_button, self.is_repeating)
+        self.play_queue.extend(state.queue)
+        self._pending_session_view = (state.library_path, state.scroll)
+        if state.current_file:
+            self._restore_session_track(state)
+        logging.info(f"Сеанс восстановлен: {state.current_file or 'без трека'}, "
+                     f"позиция {self.format_time(state.position_ms)}, в очереди {len(state.queue)}")
+
+    def _restore_session_track(self, state):
+        path = state.current_file
+        self.current_file = path
+        self._radio_history.append(path)
+        if archive.is_archive_member(path):
+            media = self.archive_streams.media(self.media_player.get_instance(), path)
+        else:
+            media = vlc.Media(path)
+        self.media_player.set_media(media)
 
-            if delta > 0:
-                new_volume = min(100, current_volume + 5)
+        self.total_length_ms = state.length_ms
+        self.total_time_label.setText(self.format_time(state.length_ms))
+        self.current_time_label.setText(self.format_time(state.position_ms))
+        if state.length_ms > 0:
+            self.position_slider.setValue(int(state.position_ms * 1000 / state.length_ms))
+        # Позиция применяется в update_ui, когда libvlc начнет воспроизведение
+        self._pending_seek_ms = state.position_ms or None
+
+        self.current_track_title.setText(state.title or '-')
+        self.current_track_artist.setText(state.artist or '-')
+        record = None
+        image = QImage.fromData(state.cover_png) if state.cover_png else QImage()
+        if not image.isNull():
+            # Обложка из снимка подменяет встроенную; больший размер при необходимости дочитается из файла
+            cover_ref = ("session", path)
+            self.cover_cache.put(cover_ref, image)
+            record = TrackMetadata(path, state.title, state.artist, duration_ms=state.length_ms,
+                                   cover_ref=cover_ref)
+        self._set_current_cover(record)
+        self._update_current_track_cover_display()
+        self._set_cover_colors(state.cover_colors)
+        if state.album_folder:
+            self._pending_session_album = (state.album_folder, os.path.basename(path))
+
+        for control in (self.position_slider, self.play_pause_button, self.prev_track_button,
+                        self.next_track_button, self.shuffle_button, self.repeat_button):
+            control.setEnabled(True)
+        if path.lower().endswith('.mp3') and not archive.is_archive_member(path):
+            self.executor.submit(self._build_seek_table_in_thread, path,
+                                 priority=PRIORITY_BACKGROUND, channel="seek_table", resource="media")
+
+    def _apply_pending_session(self):
+        """Возвращает альбом текущего трека и место в библиотеке из снимка, как только их папки есть в дереве."""
+        tree = self.library_tree
+        if tree is None:
+            return
+        if self._pending_session_album is not None:
+            folder, file_name = self._pending_session_album
+            node = tree.node_for_path(folder)
+            if node is not None and node.has_file(file_name):
+                self._pending_session_album = None
+                # Пользователь мог уже выбрать другой трек
+                if self.current_album_node is None and self.current_file == node.file_path(file_name):
+                    self.current_album_node = node
+                    self.current_album_tracks = node.files
+                    self.current_track_index = self.current_album_tracks.index(file_name)
+        if self._pending_session_view is not None:
+            library_path, scroll = self._pending_session_view
+            if tree.find(library_path) is not None:
+                self._pending_session_view = None
+                self.current_library_path = list(library_path)
+                self._restored_scroll = (tuple(library_path), scroll)
+        # Когда все корни загружены или недоступны, папок из снимка уже не появится
+        if all(root.snapshot is not None or root.online is False for root in self.library_roots):
+            self._pending_session_album = None
+            self._pending_session_view = None
+
+    def _session_state(self):
+        """Снимок сеанса из состояния UI; обложка кодируется при записи в фоне."""
+        if self.media_player.get_state() in (vlc.State.Playing, vlc.State.Paused):
+            position_ms = max(0, self.current_time_ms())
+        else:
+            position_ms = self._pending_seek_ms or 0
+        if self._pending_session_album is not None:
+            album_folder = self._pending_session_album[0]
+        elif self.current_album_node is not None and self.current_file:
+            album_folder = os.path.dirname(self.current_file)
+        else:
+            album_folder = ''
+        if self._pending_session_view is not None:
+            library_path, scroll = self._pending_session_view
+        else:
+            library_path = self.current_library_path
+            if self._displayed_level_key is not None:
+                scroll = self.library_list_widget.verticalScrollBar().value()
             else:
-                new_volume = max(0, current_volume - 5)
-
-            self.volume_slider.setValue(new_volume)
-            self.set_volume(new_volume)
-            return True
+                scroll = self.level_view_cache.scroll_position(tuple(library_path))
+        has_track = self.current_file is not None
+        return SessionState(
+            current_file=self.current_file, position_ms=position_ms,
+            length_ms=self.total_length_ms if has_track else 0, volume=self.volume_slider.value(),
+            shuffle=self.is_shuffling, repeat=self.is_repeating,
+            title=self.current_track_title.text() if has_track else '',
+            artist=self.current_track_artist.text() if has_track else '',
+            cover_colors=self.current_cover_colors if has_track else None, album_folder=album_folder,
+            queue=self.play_queue, library_path=library_path, scroll=scroll)
+
+    def _save_session(self):
+        self.executor.submit(self._save_session_in_thread, self._session_state(), self.current_cover_record,
+                             priority=PRIORITY_BACKGROUND, channel="session")
+
+    def _save_session_in_thread(self, token, state, record):
+        if state.current_file is not None:
+            state.cover_png = self._session_cover_png(record)
+        self.session_store.save(state)
+
+    def _session_cover_png(self, record):
+        """Уменьшенная обложка в PNG; кодируется один раз на обложку."""
+        if record is None:
+            return b''
+        cover_ref, data = self._session_cover
+        if cover_ref == record.cover_ref:
+            return data
+        data = b''
+        image = self.cover_cache.get(record.cover_ref, lambda: self.metadata_service.get_cover_data(record),
+                                     SESSION_COVER_SIDE)
+        if image is not None:
+            if max(image.width(), image.height()) > SESSION_COVER_SIDE:
+                image = image.scaled(SESSION_COVER_SIDE, SESSION_COVER_SIDE, Qt.KeepAspectRatio,
+                                     Qt.SmoothTransformation)
+            buffer = QBuffer()
+            buffer.open(QIODevice.WriteOnly)
+            image.save(buffer, "PNG")
+            data = bytes(buffer.data())
+            buffer.close()
+        self._session_cover = (record.cover_ref, data)
+        return data
 
-        if event.type() == QEvent.KeyPress and event.key() == Qt.Key_Space:
-            self.toggle_play_pause()
+    def eventFilter(self, obj, event):
+        """
+        Фильтр установлен только на ползунок громкости: колесико мыши меняет громкость на VOLUME_STEP.
+        Горячие клавиши обрабатывает KeyBindings.
+        """
+        if obj == self.volume_slider and event.type() == QEvent.Wheel:
+            self.change_volume(VOLUME_STEP if event.angleDelta().y() > 0 else -VOLUME_STEP)
             return True
-
         return super().eventFilter(obj, event)
 
     def toggle_play_pause(self):
@@ -704,6 +1195,7 @@ class MusicPlayer(QWidget):
         else:
             self.play_music()
 
+    @traced()
     def play_music(self):
         if self.current_file:
             self.media_player.play()
@@ -721,6 +1213,7 @@ class MusicPlayer(QWidget):
     def stop_music(self):
         """Останавливает воспроизведение и сбрасывает состояние плеера."""
         self.media_player.stop()
+        tracer.cancel_track_start()
         self.position_slider.setValue(0)
         self.current_time_label.setText("00:00")
         self.total_time_label.setText("00:00")
@@ -732,244 +1225,580 @@ class MusicPlayer(QWidget):
         self.next_track_button.setEnabled(False)
         self.shuffle_button.setEnabled(False)
         self.repeat_button.setEnabled(False)
-        self.current_album_tracks = []
+        self.current_album_tracks = ()
+        self.current_album_node = None
         self.current_track_index = -1
+        self._radio_back_stack.clear()
+        self._pending_seek_ms = None
 
     def set_position(self, position):
-        if self.media_player.is_playing() and self.total_length_ms > 0:
-            new_time_ms = int(self.total_length_ms * (position / 1000.0))
-            self.media_player.set_time(new_time_ms)
+        """
+        Перематывает на долю position/1000 трека. Работает и на паузе;
+        если воспроизведение еще не началось, перемотка выполняется после старта.
+        """
+        if self.current_file is None or self.total_length_ms <= 0:
+            return
+        new_time_ms = int(self.total_length_ms * (position / 1000.0))
+        if self.media_player.get_state() in (vlc.State.Playing, vlc.State.Paused):
+            self._seek_to(new_time_ms)
+        else:
+            self._pending_seek_ms = new_time_ms
+        self.current_time_label.setText(self.format_time(new_time_ms))
+
+    def current_time_ms(self):
+        """Позиция воспроизведения в мс; для MP3 с таблицей перемотки - по таблице (точнее оценки libvlc для VBR)."""
+        if self.seek_table is not None:
+            return self.seek_table.time_for_position(self.media_player.get_position())
+        return self.media_player.get_time()
+
+    def seek_to_time(self, time_ms):
+        """Перематывает на абсолютное время в мс (MPRIS SetPosition)."""
+        if self.current_file is None or self.total_length_ms <= 0:
+            return
+        self.set_position(int(max(0, min(self.total_length_ms, time_ms)) * 1000 / self.total_length_ms))
+
+    def seek_by(self, delta_ms):
+        """Перематывает на delta_ms относительно текущей позиции (горячие клавиши, MPRIS Seek)."""
+        if self.current_file is None or self.total_length_ms <= 0:
+            return
+        self.seek_to_time(max(0, self.current_time_ms()) + delta_ms)
+
+    def _seek_to(self, time_ms):
+        # Для MPEG audio libvlc трактует позицию как долю байтов потока,
+        # поэтому точный кадр задается через смещение из таблицы перемотки
+        if self.seek_table is not None:
+            self.media_player.set_position(self.seek_table.position_for_time(time_ms))
+        else:
+            self.media_player.set_time(time_ms)
+        if self.mpris is not None:
+            self.mpris.seeked(time_ms)
 
     def set_volume(self, volume):
         """Устанавливает громкость медиаплеера и обновляет метку."""
         self.media_player.audio_set_volume(volume)
         self.volume_label.setText(f"Громкость: {volume}%")
+        self._notify_state_changed()
+
+    def change_volume(self, delta):
+        """Меняет громкость на delta процентов и двигает ползунок."""
+        volume = max(0, min(100, self.volume_slider.value() + delta))
+        self.volume_slider.setValue(volume)
+        self.set_volume(volume)
+
+    def _notify_state_changed(self):
+        """Сообщает внешним клиентам (MPRIS) об изменении трека или состояния воспроизведения."""
+        if self.mpris is not None:
+            self.mpris.refresh()
 
     def toggle_shuffle(self):
         """Переключает режим перемешивания."""
         self.is_shuffling = not self.is_shuffling
         self._update_button_style(self.shuffle_button, self.is_shuffling)
+        self._notify_state_changed()
         logging.info(f"Режим перемешивания: {'Включен' if self.is_shuffling else 'Выключен'}")
 
     def toggle_repeat(self):
         """Переключает режим повтора."""
         self.is_repeating = not self.is_repeating
         self._update_button_style(self.repeat_button, self.is_repeating)
+        self._notify_state_changed()
         logging.info(f"Режим повтора: {'Включен' if self.is_repeating else 'Выключен'}")
 
+    def toggle_radio(self):
+        """Переключает режим радио."""
+        self.set_radio_mode(not self.radio_mode)
+
     def _update_button_style(self, button, is_active):
         """Применяет стиль к кнопке в зависимости от ее состояния активности."""
-        if is_active:
-            button.setStyleSheet(f"background-color: #007bff; color: transparent;")
-        else:
-            button.setStyleSheet(f"background-color: #333333; color: transparent;")
+        if button.property("active") == is_active:
+            return
+        button.setProperty("active", is_active)
+        # Повторная полировка применяет селекторы по свойству без разбора таблицы стилей
+        button.style().unpolish(button)
+        button.style().polish(button)
 
     def _update_play_pause_button_style(self):
         """Обновляет стиль и текст кнопки воспроизведения/паузы."""
         current_state = self.media_player.get_state()
 
-        if current_state == vlc.State.Playing:
-            self.play_pause_button.setIcon(QIcon(self.pause_icon_path))
-        else:
-            self.play_pause_button.setIcon(QIcon(self.play_icon_path))
-
-        self.play_pause_button.setStyleSheet(f"background-color: white; color: transparent;")
+        icon_name = 'pause' if current_state == vlc.State.Playing else 'play'
+        if self.play_pause_button.property("iconName") != icon_name:
+            self.play_pause_button.setProperty("iconName", icon_name)
+            self.play_pause_button.setIcon(self.icons[icon_name])
+        self._notify_state_changed()
 
     def open_library_folder(self):
-        """Открывает диалог выбора папки и сканирует ее на наличие музыкальных файлов."""
-        folder_path = QFileDialog.getExistingDirectory(self, "Выбрать корневую папку с музыкой")
+        """Открывает диалог выбора папки и добавляет ее в библиотеку как новый корень."""
+        folder_path = QFileDialog.getExistingDirectory(self, "Добавить папку с музыкой в библиотеку")
         if folder_path:
-            self.root_library_folder = folder_path
-            self.settings.setValue("last_music_folder", folder_path)
-            self.library_list_widget.clear()
-            self.library_data.clear()
-            self.current_library_path = []
-            self.back_button.setEnabled(False)
-
-            threading.Thread(target=self._scan_music_folder_in_thread,
-                             args=(folder_path, self.supported_extensions)).start()
-
-    def _scan_music_folder_in_thread(self, current_folder, supported_extensions):
+            self.add_library_root(folder_path)
+
+    def add_library_root(self, path, save=True):
+        """Добавляет корень библиотеки и запускает его синхронизацию. Возвращает список корней."""
+        root = self.library_roots.add(path)
+        # Сканирование, проверка и индексация одного корня идут по очереди, разные корни - параллельно
+        self.executor.set_resource_limit(root.resource, 1)
+        if save:
+            self.settings.setValue("library_roots", self.library_roots.paths())
+        if root.snapshot is None:
+            self._sync_library_root(root, PRIORITY_VISIBLE)
+        return self.library_roots_status()
+
+    def remove_library_root(self, path):
+        """Убирает корень из библиотеки (файлы и записи индекса не удаляются). Возвращает список корней."""
+        root = self.library_roots.remove(path)
+        if root is not None:
+            for channel in ("library_scan", "library_probe", "ingest"):
+                self.executor.cancel(f"{channel}:{root.path}")
+            self.executor.set_resource_limit(root.resource, None)
+            self.settings.setValue("library_roots", self.library_roots.paths())
+            self._refresh_library_view()
+        return self.library_roots_status()
+
+    def library_roots_status(self):
+        """Корни библиотеки и их состояние для канала управления."""
+        return [{"path": root.path, "name": root.name, "online": root.online,
+                 "folders": root.tree.folder_count if root.tree is not None else 0,
+                 "files": root.tree.file_count if root.tree is not None else 0}
+                for root in self.library_roots]
+
+    def _sync_library_root(self, root, priority):
+        # Новая синхронизация корня отменяет предыдущую: ее результат будет отброшен
+        self.executor.submit(self._sync_root_in_thread, root.path, root.snapshot, priority=priority,
+                             channel=f"library_scan:{root.path}", resource=("library_io", root.resource))
+
+    @traced(category="background")
+    def _sync_root_in_thread(self, token, root_path, snapshot):
         """
-        Сканирует указанную папку на наличие музыкальных файлов и строит древовидную структуру.
+        Приводит дерево корня в актуальное состояние с минимумом обращений к диску:
+        снимок из кэша показывается сразу; если корень доступен и ни одна папка не менялась,
+        снимок остается в силе, иначе корень сканируется заново.
         """
-        library_structure = {}
+        roots = self.library_roots
+        if snapshot is None:
+            snapshot = roots.load_snapshot(root_path)
+            if snapshot is not None and token.is_current():
+                # Итоги папок считаются до показа дерева: длительность и размер берутся из индекса
+                snapshot.tree.attach_file_stats(self.library_index.file_stats(root_path))
+                self.root_synced_signal.emit(token, root_path, snapshot, None)
+        if not roots.probe(root_path):
+            self.root_synced_signal.emit(token, root_path, None, False)
+            return
+        if snapshot is not None and roots.is_unchanged(snapshot, token.cancel_event):
+            logging.info(f"Корень библиотеки {root_path} не изменился, сканирование не требуется")
+        elif token.is_current():
+            snapshot = roots.scan(root_path)
+            roots.save_snapshot(root_path, snapshot)
+            snapshot.tree.attach_file_stats(self.library_index.file_stats(root_path))
+        if token.is_current():
+            self.root_synced_signal.emit(token, root_path, snapshot, True)
+
+    def _probe_root_in_thread(self, token, root_path):
+        if not self.library_roots.probe(root_path):
+            self.root_synced_signal.emit(token, root_path, None, False)
+
+    def _probe_library_roots(self):
+        """
+        Периодическая проверка корней: пропавший корень помечается недоступным,
+        вернувшийся синхронизируется (без сканирования, если папки не менялись).
+        """
+        for root in self.library_roots:
+            if root.online is False:
+                self._sync_library_root(root, PRIORITY_BACKGROUND)
+            elif root.online:
+                self.executor.submit(self._probe_root_in_thread, root.path, priority=PRIORITY_BACKGROUND,
+                                     channel=f"library_probe:{root.path}", resource=root.resource)
+
+    def _on_root_synced(self, token, root_path, snapshot, online):
+        if not self.executor.is_current(token):
+            return
+        root = self.library_roots.get(root_path)
+        if root is None:
+            return
+        changed = False
+        if snapshot is not None and snapshot is not root.snapshot:
+            root.snapshot = snapshot
+            changed = True
+        if online is not None and online != root.online:
+            root.online = online
+            changed = True
+            logging.info(f"Корень библиотеки {root_path}: {'доступен' if online else 'недоступен'}")
+        if changed:
+            self._refresh_library_view()
+        if online and root.snapshot is not None and root.indexed_snapshot is not root.snapshot:
+            root.indexed_snapshot = root.snapshot
+            self._start_ingest(root)
+
+    def _refresh_library_view(self):
+        """Пересобирает общее дерево корней и перерисовывает текущий уровень."""
+        self.library_tree = self.library_roots.merged_tree()
+        self.level_view_cache.clear()
+        self._displayed_level_key = None
+        if self.http_server is not None:
+            self.http_server.set_library(self.library_tree)
+        self._apply_pending_session()
+        if self._displayed_playlist is None:
+            self._display_current_library_level()
 
-        for root, dirs, files in os.walk(current_folder):
-            relative_root = os.path.relpath(root, current_folder)
-            if relative_root == ".":
-                current_node = library_structure
+    def _start_ingest(self, root):
+        """Запускает фоновую индексацию метаданных корня (прерванная ранее продолжается)."""
+        self.executor.submit(self._ingest_in_thread, root.path, root.tree, priority=PRIORITY_BACKGROUND,
+                             channel=f"ingest:{root.path}", resource=("library_io", root.resource))
+
+    def _ingest_in_thread(self, token, root_path, library_tree):
+        pipeline = IngestPipeline(self.library_index, fs=self.fs)
+        try:
+            result = pipeline.run(library_tree.iter_file_paths(), root_folder=root_path,
+                                  total=library_tree.file_count,
+                                  progress=lambda done, total: self.ingest_progress_signal.emit(token, done, total),
+                                  cancel_event=token.cancel_event)
+        except Exception as e:
+            logging.error(f"Ошибка индексации библиотеки: {e}")
+            result = None
+        # После крупной индексации статистика индексов нужна планировщику запросов умных плейлистов
+        if result is not None and result.parsed >= 1000:
+            self.library_index.analyze()
+        self.ingest_finished_signal.emit(token, result)
+
+    def _on_ingest_progress(self, token, done, total):
+        if self.executor.is_current(token) and total > 0:
+            root_name = os.path.basename(token.channel.partition(":")[2])
+            self.library_status_label.setText(f"Индексация {root_name}: {done * 100 // total}%")
+
+    def _on_ingest_finished(self, token, result):
+        if not self.executor.is_current(token) or result is None or result.cancelled:
+            return
+        self.library_status_label.setText(f"Треков в индексе: {self.library_index.track_count()}")
+        root_path = token.channel.partition(":")[2]
+        root = self.library_roots.get(root_path)
+        if root is not None:
+            self.executor.submit(self._check_integrity_in_thread, root_path, priority=PRIORITY_BACKGROUND,
+                                 channel=f"integrity:{root_path}", resource=("library_io", root.resource))
+        if similarity.is_available():
+            self.executor.submit(self._build_similarity_in_thread, priority=PRIORITY_BACKGROUND,
+                                 channel="similarity", resource="library_io")
+
+    def _on_index_changed_in_thread(self, paths):
+        """Подписчик индекса (поток записи): передает новые длительность и размер измененных треков."""
+        self.track_stats_signal.emit(paths, self.library_index.track_stats(paths))
+
+    def _on_track_stats(self, paths, stats):
+        """Обновляет итоги папок за O(глубины) на трек; удаленные из индекса треки исключаются из итогов."""
+        changed = False
+        for path in paths:
+            root = self.library_roots.root_for_path(path)
+            if root is None or root.tree is None:
+                continue
+            folder_path, file_name = os.path.split(path)
+            node = root.tree.node_for_path(folder_path)
+            if node is None:
+                continue
+            if path in stats:
+                duration_ms, size = stats[path]
+                changed = node.update_file(file_name, duration_ms, size) or changed
             else:
-                path_parts = relative_root.split(os.sep)
-                current_node = library_structure
-                for part in path_parts:
-                    if part not in current_node:
-                        current_node[part] = {}
-                    current_node = current_node[part]
+                changed = node.remove_file(file_name) or changed
+        if changed and not self.folder_totals_timer.isActive():
+            self.folder_totals_timer.start()
+
+    def _folder_summary(self, node):
+        """Подпись итогов папки: число треков, длительность и размер."""
+        if node is None or not node.total_tracks:
+            return ""
+        parts = [f"{node.total_tracks} тр."]
+        minutes = node.total_duration_ms // 60000
+        if minutes >= 60:
+            parts.append(f"{minutes // 60} ч {minutes % 60} мин")
+        elif minutes:
+            parts.append(f"{minutes} мин")
+        if node.total_size >= 1024 ** 3:
+            parts.append(f"{node.total_size / 1024 ** 3:.1f} ГБ")
+        elif node.total_size:
+            parts.append(f"{node.total_size / 1024 ** 2:.0f} МБ")
+        return " · ".join(parts)
+
+    def _refresh_folder_summaries(self):
+        """Обновляет подписи итогов у показанных папок без пересборки строк уровня."""
+        if self._displayed_level_key is None or self.library_tree is None:
+            return
+        node = self.library_tree.find(self._displayed_level_key)
+        if node is None:
+            return
+        for row in range(self.library_list_widget.count()):
+            item = self.library_list_widget.item(row)
+            if item.data(Qt.UserRole) != "folder":
+                continue
+            item_widget = self.library_list_widget.itemWidget(item)
+            if item_widget is not None:
+                summary = self._folder_summary(node.child(item.data(Qt.UserRole + 1)))
+                text = item.data(Qt.UserRole + 2)
+                item_widget.text_label.setText(f"{text}\n{summary}" if summary else text)
+
+    def set_library_sort(self, sort_key):
+        """Порядок папок в библиотеке: name, tracks, duration или size (по итогам узлов, без чтения диска)."""
+        if sort_key not in FOLDER_SORT_KEYS:
+            raise ValueError(f"Неизвестный порядок сортировки: {sort_key}")
+        self.library_sort = sort_key
+        self.settings.setValue("library_sort", sort_key)
+        if self._displayed_playlist is None and self.library_tree is not None:
+            self._displayed_level_key = None
+            self._display_current_library_level()
+        return sort_key
 
-            for file in files:
-                if file.lower().endswith(supported_extensions):
-                    full_path = os.path.join(root, file)
-                    current_node[file] = full_path
+    def _check_integrity_in_thread(self, token, root_path):
+        """Проверяет структуру новых и измененных файлов корня и передает актуальный список проблем."""
+        checker = IntegrityChecker(self.library_index)
+        try:
+            result = checker.run(root_folder=root_path,
+                                 progress=lambda done, total: self.integrity_progress_signal.emit(token, done, total),
+                                 cancel_event=token.cancel_event)
+        except Exception as e:
+            logging.error(f"Ошибка проверки целостности {root_path}: {e}")
+            return
+        if result.total and not result.cancelled:
+            self.integrity_ready_signal.emit(
+                token, root_path, self.library_index.integrity_problems(PROBLEM_STATUSES, root_path))
 
-        self.library_scan_finished_signal.emit(library_structure)
+    def _on_integrity_progress(self, token, done, total):
+        if self.executor.is_current(token) and total > 0:
+            root_name = os.path.basename(token.channel.partition(":")[2])
+            self.library_status_label.setText(f"Проверка файлов {root_name}: {done * 100 // total}%")
 
-    def _on_library_scan_finished(self, library_structure):
-        self.library_data = library_structure
-        self._display_current_library_level()
+    def _on_integrity_ready(self, token, root_path, problems):
+        if not self.executor.is_current(token):
+            return
+        prefix = os.path.join(root_path, "")
+        track_problems = {path: problem for path, problem in self.track_problems.items()
+                          if not path.startswith(prefix)}
+        track_problems.update(problems)
+        self.library_status_label.setText(
+            f"Треков в индексе: {self.library_index.track_count()}, с ошибками: {len(track_problems)}")
+        if track_problems == self.track_problems:
+            return
+        self.track_problems = track_problems
+        # Пометки поврежденных треков попадают в строки уровней, поэтому кэш уровней сбрасывается
+        self.level_view_cache.clear()
+        self._displayed_level_key = None
+        if self._displayed_playlist is None:
+            self._display_current_library_level()
+
+    def integrity_report(self):
+        """Поврежденные треки для канала управления."""
+        return [{"path": path, "status": status, "detail": detail}
+                for path, (status, detail) in sorted(self.track_problems.items())]
+
+    def _load_similarity_in_thread(self, token):
+        index = similarity.SimilarityIndex.load()
+        if index is not None:
+            self.similarity_ready_signal.emit(token, index)
+
+    def _build_similarity_in_thread(self, token):
+        """Досчитывает звуковые признаки и перестраивает матрицу похожих треков."""
+        similarity.analyze_audio(self.library_index, cancel_event=token.cancel_event)
+        if not token.is_current():
+            return
+        index = similarity.build_from_index(self.library_index)
+        try:
+            index.save()
+        except OSError as e:
+            logging.error(f"Не удалось сохранить индекс похожих треков: {e}")
+        self.similarity_ready_signal.emit(token, index)
+
+    def _on_similarity_ready(self, token, index):
+        if self.executor.is_current(token):
+            self.similarity_index = index
+
+    def _pick_radio_track(self):
+        """Выбирает похожий на текущий трек, не звучавший недавно. Возвращает путь или None."""
+        if not self.radio_mode or self.similarity_index is None or self.current_file is None:
+            return None
+        for _ in range(3):
+            path = self.similarity_index.pick_next(self.current_file, exclude=set(self._radio_history))
+            if path is None:
+                return None
+            if self.fs.exists(path) and self.track_problems.get(path, (None,))[0] != STATUS_BROKEN:
+                return path
+            self._radio_history.append(path)
+        return None
+
+    def set_radio_mode(self, enabled):
+        self.radio_mode = bool(enabled)
+        self.settings.setValue("radio_mode", self.radio_mode)
+        self._update_button_style(self.radio_button, self.radio_mode)
+        logging.info(f"Режим радио: {'Включен' if self.radio_mode else 'Выключен'}")
+        return self.radio_mode
+
+    @traced()
+    def _build_level_rows(self, node):
+        """
+        Готовит строки уровня библиотеки: разбор тегов и отрисовка аватаров.
+        Не создает виджетов, поэтому может выполняться в фоновом потоке.
+        Возвращает список кортежей (текст, тип, имя файла, аватар QImage или None).
+        """
+        rows = []
+        level_full_path = node.path()
+        avatar_size = ListItemWidget.AVATAR_SIZE
+
+        for folder_node in node.folders:
+            folder_name = folder_node.name
+            folder_full_path = folder_node.path()
+            label = folder_name
+            # Корневые узлы деревьев в общем виде; недоступный корень показывается из снимка
+            online = folder_node.base_path is None or self.library_roots.is_path_online(folder_full_path)
+            if not online:
+                label = f"{folder_name} (недоступно)"
+
+            logging.debug(f"Processing folder: {folder_full_path}")
 
+            # Изображения папки известны из сканирования, диск не опрашивается
+            item_image_data = folder_node.find_artwork(folder_name)
+            if item_image_data is not None or not online:
+                logging.debug(f"Found artist image file for '{folder_name}' at: {item_image_data}")
+            else:
+                logging.debug(
+                    f"No dedicated artist image file found for '{folder_name}'. Attempting to extract from audio files.")
+                # Список аудиофайлов папки уже известен из дерева библиотеки
+                for file_inner in folder_node.files:
+                    audio_file_path = os.path.join(folder_full_path, file_inner)
+                    logging.debug(f"Checking file for cover: {audio_file_path}")
+                    record = self.metadata_service.get(audio_file_path)
+                    if record.has_cover:
+                        item_image_data = self.metadata_service.get_cover_data(record)
+                        logging.debug(f"Found cover data for {folder_name} from {audio_file_path}")
+                        break
+
+            avatar = render_round_avatar(item_image_data, avatar_size, avatar_size, folder_name)
+            rows.append((label, "folder", folder_name, avatar))
+
+        files = node.files
+        # Метаданные всех треков уровня читаются одним пакетом в пуле потоков
+        track_records = self.metadata_service.get_many(
+            [os.path.join(level_full_path, file_name) for file_name in files])
+        for file_name, record in zip(files, track_records):
+            display_name = os.path.splitext(file_name)[0]
+            # Поврежденные треки помечаются заранее, до попытки воспроизведения
+            if os.path.join(level_full_path, file_name) in self.track_problems:
+                display_name = f"⚠ {display_name}"
+            track_cover_data = self.metadata_service.get_cover_data(record)
+            if track_cover_data:
+                logging.debug(f"Found cover data for track {file_name}")
+            avatar = render_round_avatar(track_cover_data, avatar_size, avatar_size, display_name)
+            rows.append((display_name, "file", file_name, avatar))
+
+        return rows
+
+    def _leave_displayed_level(self):
+        """Запоминает позицию прокрутки показанного уровня перед сменой содержимого списка."""
+        if self._displayed_level_key is not None:
+            self.level_view_cache.set_scroll_position(
+                self._displayed_level_key, self.library_list_widget.verticalScrollBar().value())
+        self._displayed_level_key = None
+
+    @traced()
     def _display_current_library_level(self):
         """
         Отображает содержимое текущего уровня библиотеки в QListWidget.
+        Готовые строки уровней и позиция прокрутки берутся из кэша, поэтому возврат назад мгновенный.
         """
+        self._leave_displayed_level()
+        self._displayed_playlist = None
         self.library_list_widget.clear()
-        current_node = self.library_data
 
-        current_level_full_path = self.root_library_folder
-        if current_level_full_path is None:
-            logging.warning("Корневая папка библиотеки не установлена. Невозможно отобразить библиотеку.")
+        if self.library_tree is None:
+            logging.info("Корни библиотеки не заданы или еще не просканированы.")
+            self.back_button.setEnabled(False)
             return
 
-        for part in self.current_library_path:
-            current_level_full_path = os.path.join(current_level_full_path, part)
-
-        temp_node = self.library_data
-        is_valid_path = True
-        for part in self.current_library_path:
-            if part in temp_node and isinstance(temp_node[part], dict):
-                temp_node = temp_node[part]
-            else:
-                is_valid_path = False
-                break
-        if is_valid_path:
-            current_node = temp_node
-        else:
+        current_node = self.library_tree.find(self.current_library_path)
+        if current_node is None:
             self.current_library_path = []
-            current_node = self.library_data
-            current_level_full_path = self.root_library_folder
+            current_node = self.library_tree.root
             logging.info("Недействительный путь к библиотеке, сброс до корня.")
 
+        level_key = tuple(self.current_library_path)
+        rows = self.level_view_cache.get(level_key)
+        if rows is None:
+            rows = self._build_level_rows(current_node)
+            self.level_view_cache.put(level_key, rows)
+
         # Динамический размер шрифта элементов списка
         list_item_font_size = max(12, int(min(self.width(), self.height()) * 0.01))
         list_item_font = QFont("Arial", list_item_font_size)
 
-        folders = sorted([k for k, v in current_node.items() if isinstance(v, dict)])
-        for folder_name in folders:
-            item_image_data = None
-            folder_full_path = os.path.join(current_level_full_path, folder_name)
-
-            logging.debug(f"Processing folder: {folder_full_path}")
-
-            found_artist_image_file = False
-            for ext in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']:
-                artist_image_path = os.path.join(folder_full_path, folder_name + ext)
-                if os.path.exists(artist_image_path):
-                    item_image_data = artist_image_path
-                    found_artist_image_file = True
-                    logging.debug(f"Found artist image file for '{folder_name}' at: {artist_image_path}")
-                    break
-
-            if not found_artist_image_file:
-                logging.debug(
-                    f"No dedicated artist image file found for '{folder_name}'. Attempting to extract from audio files.")
-                found_audio_file_for_cover = False
-                try:
-                    for file_inner in os.listdir(folder_full_path):
-                        audio_file_path = os.path.join(folder_full_path, file_inner)
-                        logging.debug(f"Checking file for cover: {audio_file_path}")
-                        if os.path.isfile(audio_file_path) and audio_file_path.lower().endswith(
-                                self.supported_extensions):
-                            try:
-                                audio = None
-                                if audio_file_path.lower().endswith('.mp3'):
-                                    audio = MP3(audio_file_path)
-                                elif audio_file_path.lower().endswith('.flac'):
-                                    audio = FLAC(audio_file_path)
-
-                                if audio:
-                                    if audio_file_path.lower().endswith('.mp3'):
-                                        for tag in audio.getall('APIC'):
-                                            if tag.type == 3:
-                                                item_image_data = tag.data
-                                                found_audio_file_for_cover = True
-                                                logging.debug(
-                                                    f"Found MP3 cover data for {folder_name} from {audio_file_path}")
-                                                break
-                                    elif audio_file_path.lower().endswith('.flac') and audio.pictures:
-                                        for pic in audio.pictures:
-                                            if pic.type == 3:
-                                                item_image_data = pic.data
-                                                found_audio_file_for_cover = True
-                                                logging.debug(
-                                                    f"Found FLAC cover data for {folder_name} from {audio_file_path}")
-                                                break
-                            except ID3NoHeaderError:
-                                logging.debug(f"No ID3 tags found for {audio_file_path}. Skipping cover extraction.")
-                            except Exception as e:
-                                logging.debug(f"Error reading metadata for album cover from {audio_file_path}: {e}")
-
-                            if found_audio_file_for_cover:
-                                break
-                except FileNotFoundError:
-                    logging.debug(f"Folder not found: {folder_full_path}")
-                except Exception as e:
-                    logging.debug(f"Error listing directory {folder_full_path}: {e}")
-
-            item_widget = ListItemWidget(folder_name, item_image_data, list_item_font, item_type="folder")
-            item = QListWidgetItem(self.library_list_widget)
-            item.setSizeHint(item_widget.sizeHint())
-            item.setData(Qt.UserRole, "folder")
-            self.library_list_widget.addItem(item)
-            self.library_list_widget.setItemWidget(item, item_widget)
+        # Кэш хранит папки по имени; другой порядок и итоги берутся из узлов дерева при показе
+        if self.library_sort != "name":
+            order = {folder.name: i for i, folder in enumerate(sorted_folders(current_node, self.library_sort))}
+            folder_rows = sorted((row for row in rows if row[1] == "folder"), key=lambda row: order.get(row[2], 0))
+            rows = folder_rows + [row for row in rows if row[1] != "folder"]
 
-        files = sorted([k for k, v in current_node.items() if isinstance(v, str)])
-        for file_name in files:
-            display_name = os.path.splitext(file_name)[0]
-            track_cover_data = None
-            full_file_path = os.path.join(current_level_full_path, file_name)
-            logging.debug(f"Checking file for track cover: {full_file_path}")
-            try:
-                audio = None
-                if full_file_path.lower().endswith('.mp3'):
-                    audio = MP3(full_file_path)
-                elif full_file_path.lower().endswith('.flac'):
-                    audio = FLAC(full_file_path)
-
-                if audio:
-                    if full_file_path.lower().endswith('.mp3'):
-                        for tag in audio.getall('APIC'):
-                            if tag.type == 3:
-                                track_cover_data = tag.data
-                                logging.debug(f"Found MP3 cover data for track {file_name}")
-                                break
-                    elif full_file_path.lower().endswith('.flac') and audio.pictures:
-                        for pic in audio.pictures:
-                            if pic.type == 3:
-                                track_cover_data = pic.data
-                                logging.debug(f"Found FLAC cover data for track {file_name}")
-                                break
-            except ID3NoHeaderError:
-                logging.debug(f"No ID3 tags found for track {file_name}. Skipping cover extraction.")
-            except Exception as e:
-                logging.debug(f"Error reading metadata for track cover from {full_file_path}: {e}")
-
-            item_widget = ListItemWidget(display_name, track_cover_data, list_item_font, item_type="file")
+        for text, item_type, file_name, avatar in rows:
+            label = text
+            if item_type == "folder":
+                summary = self._folder_summary(current_node.child(file_name))
+                if summary:
+                    label = f"{text}\n{summary}"
+            item_widget = ListItemWidget(label, avatar, list_item_font, item_type=item_type)
             item = QListWidgetItem(self.library_list_widget)
             item.setSizeHint(item_widget.sizeHint())
-            item.setData(Qt.UserRole, "file")
-            item.setData(Qt.UserRole + 1, file_name)
+            item.setData(Qt.UserRole, item_type)
+            item.setData(Qt.UserRole + 2, text)
+            if file_name is not None:
+                item.setData(Qt.UserRole + 1, file_name)
             self.library_list_widget.addItem(item)
             self.library_list_widget.setItemWidget(item, item_widget)
 
-        if not folders and not files:
+        if not rows:
             item_widget = ListItemWidget("Пусто.", None, list_item_font, item_type="empty")
             item = QListWidgetItem(self.library_list_widget)
             item.setSizeHint(item_widget.sizeHint())
             self.library_list_widget.addItem(item)
             self.library_list_widget.setItemWidget(item, item_widget)
 
+        self._displayed_level_key = level_key
+        # Диапазон полосы прокрутки обновляется после раскладки, поэтому позиция восстанавливается отложенно
+        scroll_position = self.level_view_cache.scroll_position(level_key)
+        if self._restored_scroll is not None:
+            if self._restored_scroll[0] == level_key:
+                scroll_position = self._restored_scroll[1]
+            self._restored_scroll = None
+        QTimer.singleShot(0, lambda: self._restore_scroll_position(level_key, scroll_position))
+
         self.back_button.setEnabled(len(self.current_library_path) > 0)
 
+    def _restore_scroll_position(self, level_key, scroll_position):
+        if self._displayed_level_key == level_key:
+            self.library_list_widget.verticalScrollBar().setValue(scroll_position)
+
+    def _on_library_item_entered(self, item):
+        """Запоминает папку под курсором, чтобы заранее подготовить ее уровень."""
+        if item.data(Qt.UserRole) != "folder" or self.library_tree is None:
+            return
+        self._hovered_level_key = tuple(self.current_library_path) + (item.data(Qt.UserRole + 1),)
+        self.prebuild_timer.start()
+
+    def _prebuild_hovered_level(self):
+        """Строит в фоне уровень папки, на которую наведен курсор."""
+        level_key = self._hovered_level_key
+        tree = self.library_tree
+        if level_key is None or tree is None:
+            return
+        node = tree.find(level_key)
+        if node is None or not self.level_view_cache.mark_pending(level_key):
+            return
+        self.executor.submit(self._prebuild_level_in_thread, tree, node, level_key, priority=PRIORITY_VISIBLE)
+
+    def _prebuild_level_in_thread(self, token, tree, node, level_key):
+        try:
+            rows = self._build_level_rows(node)
+            # Библиотека могла быть пересканирована, пока уровень строился
+            if self.library_tree is tree:
+                self.level_view_cache.put(level_key, rows)
+        except Exception as e:
+            logging.debug(f"Ошибка предварительной подготовки уровня {level_key}: {e}")
+        finally:
+            self.level_view_cache.unmark_pending(level_key)
+
+    @traced()
     def load_track_from_library(self, item):
         """
         Загружает и воспроизводит трек или переходит в папку, выбранную из списка библиотеки.
@@ -979,25 +1808,44 @@ class MusicPlayer(QWidget):
             item_type = item.data(Qt.UserRole)
 
             if item_type == "folder":
-                folder_name = item_widget.text_label.text()
+                folder_name = item.data(Qt.UserRole + 1)
+                self._pending_session_view = None
                 self.current_library_path.append(folder_name)
                 self._display_current_library_level()
+            elif item_type == "playlist_track":
+                # Остальные треки плейлиста после выбранного играют через очередь
+                playlist_paths = [self.library_list_widget.item(row).data(Qt.UserRole + 1)
+                                  for row in range(self.library_list_widget.count())]
+                clicked_row = self.library_list_widget.row(item)
+                self.current_album_tracks = ()
+                self.current_album_node = None
+                self.current_track_index = -1
+                self._radio_back_stack.clear()
+                self.play_queue.clear()
+                self.play_queue.extend(playlist_paths[clicked_row + 1:])
+                full_path = item.data(Qt.UserRole + 1)
+                tracer.begin_track_start(full_path)
+                self.open_file(full_path)
             elif item_type == "file":
                 full_file_name = item.data(Qt.UserRole + 1)
-                current_node = self.library_data
-                for part in self.current_library_path:
-                    current_node = current_node[part]
+                current_node = self.library_tree.find(self.current_library_path)
+                if current_node is None or not current_node.has_file(full_file_name):
+                    logging.error(f"Ошибка: Не удалось найти полный путь для файла: {full_file_name}")
+                    return
 
-                album_files = sorted([k for k, v in current_node.items() if isinstance(v, str)])
-                self.current_album_tracks = album_files
+                # Файлы узла уже отсортированы при сканировании
+                self.current_album_node = current_node
+                self.current_album_tracks = current_node.files
+                self._radio_back_stack.clear()
 
                 try:
                     self.current_track_index = self.current_album_tracks.index(full_file_name)
                 except ValueError:
                     self.current_track_index = -1
 
-                full_path = current_node.get(full_file_name)
+                full_path = current_node.file_path(full_file_name)
                 if full_path:
+                    tracer.begin_track_start(full_path)
                     self.open_file(full_path)
                 else:
                     logging.error(f"Ошибка: Не удалось найти полный путь для файла: {full_file_name}")
@@ -1010,14 +1858,92 @@ class MusicPlayer(QWidget):
         """
         Возвращается на предыдущий уровень в иерархии библиотеки.
         """
+        if self._displayed_playlist is not None:
+            self._display_current_library_level()
+            return
+        self._pending_session_view = None
         if self.current_library_path:
             self.current_library_path.pop()
             self._display_current_library_level()
 
+    def enqueue(self, paths):
+        """Добавляет файлы в очередь воспроизведения. Возвращает длину очереди."""
+        if isinstance(paths, str):
+            paths = [paths]
+        for path in paths:
+            if path.lower().endswith(self.supported_extensions):
+                self.play_queue.append(path)
+        if self.current_file is None and self.play_queue:
+            self.open_file(self.play_queue.popleft())
+        return len(self.play_queue)
+
+    def open_paths(self, paths):
+        """
+        Открывает пути, переданные из командной строки или канала управления:
+        первый файл воспроизводится сразу, остальные ставятся в очередь, папки добавляются в библиотеку.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        files = [path for path in paths if path.lower().endswith(self.supported_extensions)]
+        folders = [path for path in paths if self.fs.isdir(path)]
+        for folder in folders:
+            self.add_library_root(folder)
+        if files:
+            self.play_queue.clear()
+            self.open_file(files[0])
+            self.play_queue.extend(files[1:])
+        self.activate()
+        return {"opened": files[:1], "queued": len(self.play_queue)}
+
+    def activate(self):
+        """Показывает и выводит окно на передний план (повторный запуск, канал управления, MPRIS Raise)."""
+        self.showNormal() if self.isMinimized() else self.show()
+        self.raise_()
+        self.activateWindow()
+
+    def status(self):
+        """Текущее состояние плеера для канала управления."""
+        state = self.media_player.get_state()
+        return {
+            "state": str(state).split('.')[-1],
+            "file": self.current_file,
+            "title": self.current_track_title.text(),
+            "artist": self.current_track_artist.text(),
+            "position_ms": max(0, self.current_time_ms()),
+            "length_ms": self.total_length_ms,
+            "volume": self.volume_slider.value(),
+            "shuffle": self.is_shuffling,
+            "repeat": self.is_repeating,
+            "queue_length": len(self.play_queue),
+            "radio": self.radio_mode,
+            "click_to_sound_ms": tracer.latency_summary(),
+        }
+
     def play_next_track(self):
         """
         Воспроизводит следующий трек в текущем альбоме/папке.
+        Треки из очереди воспроизведения имеют приоритет; когда альбом закончился
+        и повтор выключен, режим радио продолжает похожими треками.
         """
+        if self.play_queue:
+            self.open_file(self.play_queue.popleft())
+            return
+
+        album_finished = (not self.current_album_tracks or self.current_track_index == -1
+                          or self.current_track_index + 1 >= len(self.current_album_tracks))
+        if album_finished and not self.is_repeating:
+            radio_path = self._pick_radio_track()
+            if radio_path is not None:
+                # Дальше радио продолжается от нового трека, контекст альбома сбрасывается;
+                # "Предыдущий" вернет его из стека
+                self._radio_back_stack.append((self.current_file, self.current_album_tracks,
+                                               self.current_album_node, self.current_track_index))
+                self.current_album_tracks = ()
+                self.current_album_node = None
+                self.current_track_index = -1
+                self.open_file(radio_path)
+                return
+
         if not self.current_album_tracks or self.current_track_index == -1:
             logging.info("Нет контекста альбома или трек не воспроизводится из библиотеки.")
             return
@@ -1028,11 +1954,7 @@ class MusicPlayer(QWidget):
 
         next_file_name = self.current_album_tracks[next_index]
 
-        current_node = self.library_data
-        for part in self.current_library_path:
-            current_node = current_node[part]
-
-        full_path = current_node.get(next_file_name)
+        full_path = self.current_album_node.file_path(next_file_name)
         if full_path:
             self.current_track_index = next_index
             self.open_file(full_path)
@@ -1042,7 +1964,16 @@ class MusicPlayer(QWidget):
     def play_previous_track(self):
         """
         Воспроизводит предыдущий трек в текущем альбоме/папке.
+        После треков радио возвращает к звучавшему до них треку вместе с его альбомом.
         """
+        if self.current_track_index == -1 and self._radio_back_stack:
+            path, album_tracks, album_node, track_index = self._radio_back_stack.pop()
+            self.current_album_tracks = album_tracks
+            self.current_album_node = album_node
+            self.current_track_index = track_index
+            self.open_file(path)
+            return
+
         if not self.current_album_tracks or self.current_track_index == -1:
             logging.info("Нет контекста альбома или трек не воспроизводится из библиотеки.")
             return
@@ -1053,11 +1984,7 @@ class MusicPlayer(QWidget):
 
         prev_file_name = self.current_album_tracks[prev_index]
 
-        current_node = self.library_data
-        for part in self.current_library_path:
-            current_node = current_node[part]
-
-        full_path = current_node.get(prev_file_name)
+        full_path = self.current_album_node.file_path(prev_file_name)
         if full_path:
             self.current_track_index = prev_index
             self.open_file(full_path)
@@ -1076,17 +2003,163 @@ class MusicPlayer(QWidget):
         self.open_library_folder()  # Можно переиспользовать для выбора папки
 
     def _create_new_playlist(self):
+        """Создает умный плейлист по запросу и сразу показывает его."""
+        logging.info("Нажата кнопка 'Создать'.")
+        name, accepted = QInputDialog.getText(self, "Умный плейлист", "Название:")
+        if not accepted or not name.strip():
+            return
+        query_text, accepted = QInputDialog.getText(
+            self, "Умный плейлист", "Условие (например: genre is Jazz and added in the last 30 days):")
+        if not accepted or not query_text.strip():
+            return
+        try:
+            self.smart_playlists.add(name.strip(), query_text.strip())
+        except QueryError as e:
+            QMessageBox.warning(self, "Умный плейлист", f"Ошибка в условии: {e}")
+            return
+        self._show_smart_playlist(name.strip())
+
+    def _show_smart_playlist(self, name):
+        """Открывает умный плейлист в списке библиотеки; треки выбираются в фоне."""
+        self._leave_displayed_level()
+        self.library_list_widget.clear()
+        self._displayed_playlist = name
+        self.back_button.setEnabled(True)
+        self._load_smart_playlist(name)
+
+    def _load_smart_playlist(self, name, scroll_position=0):
+        # Первый и устаревший по времени запрос - полный пересчет по индексу, не для потока интерфейса
+        self.executor.submit(self._smart_playlist_tracks_in_thread, name, scroll_position,
+                             priority=PRIORITY_INTERACTIVE, channel="smart_playlist")
+
+    def _smart_playlist_tracks_in_thread(self, token, name, scroll_position):
+        self.smart_playlist_ready_signal.emit(token, name, self.smart_playlists.tracks(name), scroll_position)
+
+    def _on_smart_playlist_ready(self, token, name, paths, scroll_position):
+        if not self.executor.is_current(token) or self._displayed_playlist != name:
+            return
+        self.library_list_widget.clear()
+        list_item_font = QFont("Arial", max(12, int(min(self.width(), self.height()) * 0.01)))
+        # Треки недоступных корней скрываются до их возвращения
+        paths = [path for path in paths if self.library_roots.is_path_online(path)]
+        for path in paths:
+            item_widget = ListItemWidget(os.path.splitext(os.path.basename(path))[0], None, list_item_font,
+                                         item_type="file")
+            item = QListWidgetItem(self.library_list_widget)
+            item.setSizeHint(item_widget.sizeHint())
+            item.setData(Qt.UserRole, "playlist_track")
+            item.setData(Qt.UserRole + 1, path)
+            self.library_list_widget.addItem(item)
+            self.library_list_widget.setItemWidget(item, item_widget)
+
+        if not paths:
+            item_widget = ListItemWidget("Пусто.", None, list_item_font, item_type="empty")
+            item = QListWidgetItem(self.library_list_widget)
+            item.setSizeHint(item_widget.sizeHint())
+            self.library_list_widget.addItem(item)
+            self.library_list_widget.setItemWidget(item, item_widget)
+
+        self.library_list_widget.verticalScrollBar().setValue(scroll_position)
+        logging.info(f"Умный плейлист '{name}': {len(paths)} треков")
+
+    def export_current_view(self):
+        """Экспортирует открытую папку библиотеки или умный плейлист в выбранные папку и формат."""
+        if self._displayed_playlist is None and self.library_tree is None:
+            return
+        destination = QFileDialog.getExistingDirectory(self, "Папка для экспорта",
+                                                       self.settings.value("export_destination", "", type=str))
+        if not destination:
+            return
+        formats = list(export.EXPORT_FORMATS)
+        current = self.settings.value("export_format", "mp3", type=str)
+        format_name, accepted = QInputDialog.getItem(self, "Экспорт", "Формат:", formats,
+                                                     formats.index(current) if current in formats else 0, False)
+        if not accepted:
+            return
+        if self._displayed_playlist is not None:
+            self.export_to(destination, format_name, playlist=self._displayed_playlist)
+        else:
+            node = self.library_tree.find(self.current_library_path) or self.library_tree.root
+            self.export_to(destination, format_name, folder=node.path())
+
+    def export_to(self, destination, format_name="mp3", folder=None, playlist=None):
         """
-        Заглушка для создания нового плейлиста.
-        Здесь можно реализовать логику для открытия диалога создания плейлиста
-        или переключения на соответствующий интерфейс.
+        Запускает фоновый экспорт папки библиотеки (folder - абсолютный путь) или умного плейлиста.
+        Новый экспорт отменяет предыдущий. Возвращает число треков в задании; для умного плейлиста
+        треки выбираются уже в фоновой задаче, и возвращается None.
         """
-        logging.info("Нажата кнопка 'Создать'.")
-        # Добавьте здесь логику создания нового плейлиста
+        export_format = export.EXPORT_FORMATS.get(format_name)
+        if export_format is None:
+            raise ValueError(f"Неизвестный формат экспорта: {format_name}")
+        encoder = export.create_encoder(self.settings.value("export_encoder", "vlc", type=str))
+        if encoder is None:
+            raise ValueError("Нет доступного кодировщика (libvlc или ffmpeg)")
+        if playlist is not None:
+            items = None
+        else:
+            node = self.library_tree.node_for_path(folder) if self.library_tree is not None and folder else None
+            if node is None and self.library_tree is not None and not folder:
+                node = self.library_tree.root
+            if node is None:
+                raise ValueError(f"Папка не найдена в библиотеке: {folder}")
+            items = export.items_from_node(node)
+        self.settings.setValue("export_destination", destination)
+        self.settings.setValue("export_format", format_name)
+        job = export.ExportJob(items or [], destination, export_format, encoder, fs=self.fs)
+        self._export_token = self.executor.submit(self._export_in_thread, job, playlist,
+                                                  priority=PRIORITY_BACKGROUND, channel="export")
+        source = f"умного плейлиста '{playlist}'" if items is None else f"{len(items)} треков"
+        logging.info(f"Экспорт {source} в {destination} ({format_name}, {encoder.name})")
+        return len(items) if items is not None else None
+
+    def cancel_export(self):
+        self.executor.cancel("export")
+
+    def _export_in_thread(self, token, job, playlist=None):
+        try:
+            if playlist is not None:
+                job.items = export.items_from_paths(self.smart_playlists.tracks(playlist), playlist)
+            result = job.run(progress=lambda report: self.export_progress_signal.emit(token, report),
+                             cancel_event=token.cancel_event)
+        except Exception as e:
+            logging.error(f"Ошибка экспорта: {e}")
+            result = None
+        self.export_finished_signal.emit(token, result)
+
+    def _on_export_progress(self, token, report):
+        if not self.executor.is_current(token):
+            return
+        text = (f"Экспорт: {report.files_done}/{report.files_total}, "
+                f"{report.throughput / (1024 * 1024):.1f} МБ/с")
+        if report.eta is not None:
+            text += f", осталось {self.format_time(report.eta * 1000)}"
+        self.library_status_label.setText(text)
+
+    def _on_export_finished(self, token, result):
+        # is_current не подходит: после cancel_export токен отменен, но статус "Экспорт отменен" нужен
+        if token is not self._export_token:
+            return
+        self._export_token = None
+        if result is None:
+            self.library_status_label.setText("Экспорт завершился с ошибкой")
+        elif result.cancelled:
+            self.library_status_label.setText(f"Экспорт отменен: готово {result.exported} треков")
+        else:
+            self.library_status_label.setText(
+                f"Экспорт завершен: {result.exported} перекодировано, {result.skipped} без изменений"
+                + (f", ошибок {result.failed}" if result.failed else ""))
+
+    def _on_smart_playlists_changed(self, names):
+        if self._displayed_playlist in names:
+            self._load_smart_playlist(self._displayed_playlist,
+                                      self.library_list_widget.verticalScrollBar().value())
 
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     player = MusicPlayer()
     player.show()
+    launch_paths = [arg for arg in sys.argv[1:] if not arg.startswith('-')]
+    if launch_paths:
+        player.open_paths([os.path.abspath(path) for path in launch_paths])
     sys.exit(app.exec_())
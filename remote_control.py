@@ -0,0 +1,106 @@
+# Легковесный клиент канала управления запущенным плеером (JSON-RPC 2.0 поверх локального сокета).
+# Модуль не импортирует Qt на POSIX-системах, чтобы повторный запуск мог передать
+# аргументы работающему экземпляру и завершиться за миллисекунды.
+import os
+import sys
+import json
+import socket
+import tempfile
+
+SERVER_NAME = "dostup_k_muzyke"
+CLIENT_TIMEOUT = 0.5
+
+
+def server_address():
+    """Путь к Unix-сокету (POSIX) или имя локального сервера Qt (Windows)."""
+    if os.name != 'posix':
+        return SERVER_NAME
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f"{SERVER_NAME}-{os.getuid()}.sock")
+
+
+def encode_message(message):
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8')
+
+
+class RemoteControlError(Exception):
+    pass
+
+
+def _request_posix(payload, timeout):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(server_address())
+        client.sendall(payload)
+        buffer = b""
+        while not buffer.endswith(b"\n"):
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            buffer += chunk
+    return buffer
+
+
+def _request_qt(payload, timeout):
+    from PyQt5.QtNetwork import QLocalSocket
+
+    client = QLocalSocket()
+    client.connectToServer(server_address())
+    if not client.waitForConnected(int(timeout * 1000)):
+        raise ConnectionRefusedError(client.errorString())
+    client.write(payload)
+    client.flush()
+    buffer = b""
+    while not buffer.endswith(b"\n") and client.waitForReadyRead(int(timeout * 1000)):
+        buffer += bytes(client.readAll())
+    client.disconnectFromServer()
+    return buffer
+
+
+def call(method, *params, timeout=CLIENT_TIMEOUT):
+    """Вызывает метод запущенного плеера и возвращает результат."""
+    payload = encode_message({"jsonrpc": "2.0", "id": 1, "method": method, "params": list(params)})
+    if os.name == 'posix':
+        raw = _request_posix(payload, timeout)
+    else:
+        raw = _request_qt(payload, timeout)
+    if not raw:
+        raise RemoteControlError("Пустой ответ от плеера")
+    response = json.loads(raw.decode('utf-8'))
+    if "error" in response:
+        raise RemoteControlError(response["error"].get("message", "Ошибка"))
+    return response.get("result")
+
+
+def forward_to_running_instance(args):
+    """
+    Передает аргументы командной строки уже запущенному экземпляру.
+    Возвращает True, если экземпляр найден и принял аргументы.
+    """
+    paths = [os.path.abspath(arg) for arg in args if not arg.startswith('-')]
+    try:
+        if paths:
+            call("open", paths)
+        else:
+            call("activate")
+        return True
+    except (OSError, ValueError, RemoteControlError):
+        return False
+
+
+if __name__ == '__main__':
+    # Пример: python remote_control.py status | toggle_play_pause | set_volume 30
+    if len(sys.argv) < 2:
+        print("Использование: remote_control.py <метод> [параметры...]")
+        sys.exit(1)
+    params = []
+    for arg in sys.argv[2:]:
+        try:
+            params.append(json.loads(arg))
+        except ValueError:
+            params.append(arg)
+    try:
+        print(json.dumps(call(sys.argv[1], *params), ensure_ascii=False, indent=2))
+    except (OSError, RemoteControlError) as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
@@ -0,0 +1,162 @@
+import json
+import inspect
+import logging
+
+from PyQt5.QtCore import QObject
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
+
+from remote_control import server_address, encode_message, CLIENT_TIMEOUT
+from tracing import tracer
+
+# Коды ошибок JSON-RPC 2.0; APPLICATION_ERROR - ошибка самого метода плеера (неверное значение и т.п.)
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+APPLICATION_ERROR = -32000
+
+
+class RemoteControlServer(QObject):
+    """
+    Сервер канала управления (JSON-RPC 2.0, по одному сообщению на строку).
+    Работает в цикле событий Qt, поэтому методы плеера вызываются в UI-потоке
+    без дополнительной синхронизации.
+    """
+
+    def __init__(self, player, parent=None):
+        super().__init__(parent)
+        self.player = player
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.UserAccessOption)
+        self.server.newConnection.connect(self._on_new_connection)
+        self._buffers = {}
+        self.methods = {
+            "toggle_play_pause": player.toggle_play_pause,
+            "play_next_track": player.play_next_track,
+            "play_previous_track": player.play_previous_track,
+            "set_position": player.set_position,
+            "set_volume": self._set_volume,
+            "enqueue": player.enqueue,
+            "open": player.open_paths,
+            "activate": player.activate,
+            "status": player.status,
+            "export_trace": self._export_trace,
+            "set_radio_mode": player.set_radio_mode,
+            "shortcuts": player.key_bindings.bindings,
+            "set_shortcut": player.key_bindings.set_binding,
+            "reset_shortcuts": player.key_bindings.reset,
+            "library_roots": player.library_roots_status,
+            "add_library_root": player.add_library_root,
+            "remove_library_root": player.remove_library_root,
+            "export": player.export_to,
+            "cancel_export": player.cancel_export,
+            "integrity_report": player.integrity_report,
+            "set_library_sort": player.set_library_sort,
+        }
+
+    def listen(self):
+        """Начинает прием подключений. Вызывается, когда другой экземпляр не ответил."""
+        address = server_address()
+        # Сокет мог остаться от аварийно завершенного экземпляра. Удаляется он, только если к нему
+        # нельзя подключиться: занятый экземпляр мог не успеть ответить на пересылку аргументов.
+        # Проверка идет до listen: с UserAccessOption Qt создает сокет заново и переименовывает его
+        # поверх существующего, не сообщая о занятом адресе
+        if self._is_server_alive(address):
+            logging.warning(f"Канал управления {address} занят работающим экземпляром")
+            return False
+        QLocalServer.removeServer(address)
+        if not self.server.listen(address):
+            logging.error(f"Не удалось открыть канал управления {address}: {self.server.errorString()}")
+            return False
+        logging.info(f"Канал управления открыт: {address}")
+        return True
+
+    def close(self):
+        self.server.close()
+
+    @staticmethod
+    def _is_server_alive(address):
+        probe = QLocalSocket()
+        probe.connectToServer(address)
+        alive = probe.waitForConnected(int(CLIENT_TIMEOUT * 1000))
+        probe.abort()
+        return alive
+
+    def _set_volume(self, volume):
+        volume = max(0, min(100, int(volume)))
+        self.player.volume_slider.setValue(volume)
+        self.player.set_volume(volume)
+        return volume
+
+    def _export_trace(self, path):
+        """Сохраняет текущую трассировку в формате Chrome Trace Event и возвращает сводку задержек."""
+        tracer.export_chrome_trace(path)
+        return tracer.latency_summary()
+
+    def _on_new_connection(self):
+        while self.server.hasPendingConnections():
+            connection = self.server.nextPendingConnection()
+            self._buffers[connection] = b""
+            connection.readyRead.connect(lambda c=connection: self._on_ready_read(c))
+            connection.disconnected.connect(lambda c=connection: self._on_disconnected(c))
+
+    def _on_disconnected(self, connection):
+        self._buffers.pop(connection, None)
+        connection.deleteLater()
+
+    def _on_ready_read(self, connection):
+        buffer = self._buffers.get(connection, b"") + bytes(connection.readAll())
+        *lines, rest = buffer.split(b"\n")
+        self._buffers[connection] = rest
+        for line in lines:
+            if line.strip():
+                response = self.handle_message(line)
+                # На уведомления (запросы без id) ответ не отправляется
+                if response is not None:
+                    connection.write(encode_message(response))
+        connection.flush()
+
+    @staticmethod
+    def _error(request_id, code, message):
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+    def handle_message(self, raw):
+        """
+        Обрабатывает одно сообщение JSON-RPC и возвращает ответ или None для уведомления (запроса без id).
+        Ошибки разбора и неверные запросы возвращаются всегда: их id определить нельзя.
+        """
+        try:
+            request = json.loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return self._error(None, PARSE_ERROR, str(e))
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return self._error(None, INVALID_REQUEST, "Запрос должен быть объектом с полем method")
+        request_id = request.get("id")
+        is_notification = "id" not in request
+        response = self._dispatch(request, request_id)
+        return None if is_notification else response
+
+    def _dispatch(self, request, request_id):
+        method = self.methods.get(request["method"])
+        if method is None:
+            return self._error(request_id, METHOD_NOT_FOUND, f"Неизвестный метод: {request['method']}")
+        params = request.get("params", [])
+        if not isinstance(params, (list, dict)):
+            return self._error(request_id, INVALID_PARAMS, "params должен быть массивом или объектом")
+        args, kwargs = (params, {}) if isinstance(params, list) else ([], params)
+        try:
+            inspect.signature(method).bind(*args, **kwargs)
+        except TypeError as e:
+            return self._error(request_id, INVALID_PARAMS, str(e))
+        except ValueError:
+            # Сигнатуру встроенного вызываемого объекта получить нельзя - проверку выполнит сам вызов
+            pass
+        try:
+            result = method(*args, **kwargs)
+        except (ValueError, TypeError) as e:
+            return self._error(request_id, APPLICATION_ERROR, str(e))
+        except Exception as e:
+            logging.error(f"Канал управления: ошибка обработки запроса {request['method']}: {e}")
+            return self._error(request_id, INTERNAL_ERROR, str(e))
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
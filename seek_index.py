@@ -0,0 +1,338 @@
+import os
+import mmap
+import struct
+import hashlib
+import logging
+from array import array
+from bisect import bisect_right
+
+from app_paths import cache_dir
+
+# Битрейты (кбит/с) по (версия MPEG, слой); для MPEG 2.5 используются таблицы MPEG 2
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    25: (11025, 12000, 8000),
+}
+VERSION_BITS = {0: 25, 2: 2, 3: 1}
+LAYER_BITS = {1: 3, 2: 2, 3: 1}
+
+# Шаг таблицы при сканировании кадров (мс)
+SCAN_INTERVAL_MS = 250.0
+
+CACHE_MAGIC = b'SKIX'
+CACHE_HEADER = struct.Struct('<4sBc2xqqqqddI')
+# Ограничения кэша таблиц перемотки: давно не использованные таблицы (по mtime файла кэша) удаляются
+MAX_CACHED_TABLES = 2000
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+# Папка кэша просматривается для очистки не чаще, чем раз в столько сохранений
+PRUNE_EVERY_SAVES = 50
+
+
+def parse_frame_header(header):
+    """
+    Разбирает 32-битный заголовок кадра MPEG audio.
+    Возвращает (длина кадра, сэмплов в кадре, частота, версия, режим каналов) или None.
+    """
+    if (header >> 21) & 0x7FF != 0x7FF:
+        return None
+    version = VERSION_BITS.get((header >> 19) & 3)
+    layer = LAYER_BITS.get((header >> 17) & 3)
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (header >> 9) & 1
+    channel_mode = (header >> 6) & 3
+
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, version, channel_mode
+    if layer == 2 or version == 1:
+        return 144 * bitrate // sample_rate + padding, 1152, sample_rate, version, channel_mode
+    return 72 * bitrate // sample_rate + padding, 576, sample_rate, version, channel_mode
+
+
+class SeekTable:
+    """
+    Компактная таблица смещений кадров: offsets[i] - байтовое смещение кадра,
+    звучащего в момент i * interval_ms. Между точками используется линейная интерполяция.
+    """
+    __slots__ = ('duration_ms', 'interval_ms', 'audio_start', 'audio_end', 'offsets')
+
+    def __init__(self, duration_ms, interval_ms, audio_start, audio_end, offsets):
+        self.duration_ms = duration_ms
+        self.interval_ms = interval_ms
+        self.audio_start = audio_start
+        self.audio_end = audio_end
+        self.offsets = offsets
+
+    def offset_for_time(self, time_ms):
+        if not self.offsets or self.interval_ms <= 0:
+            return self.audio_start
+        point = max(0.0, min(time_ms, self.duration_ms)) / self.interval_ms
+        index = min(int(point), len(self.offsets) - 1)
+        start = self.offsets[index]
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.audio_end
+        return int(start + (end - start) * min(1.0, point - index))
+
+    def time_for_offset(self, offset):
+        if not self.offsets:
+            return 0
+        index = max(0, bisect_right(self.offsets, offset) - 1)
+        start = self.offsets[index]
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.audio_end
+        fraction = (offset - start) / (end - start) if end > start else 0.0
+        return min(self.duration_ms, int((index + max(0.0, min(1.0, fraction))) * self.interval_ms))
+
+    def position_for_time(self, time_ms):
+        """Доля потока (0..1), которую libvlc ожидает в set_position для MPEG audio."""
+        span = self.audio_end - self.audio_start
+        return (self.offset_for_time(time_ms) - self.audio_start) / span if span > 0 else 0.0
+
+    def time_for_position(self, position):
+        return self.time_for_offset(self.audio_start + position * (self.audio_end - self.audio_start))
+
+
+def _id3v2_size(mm):
+    if len(mm) < 10 or mm[:3] != b'ID3':
+        return 0
+    size = (mm[6] << 21) | (mm[7] << 14) | (mm[8] << 7) | mm[9]
+    footer = 10 if mm[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _find_first_frame(mm, start, end):
+    """Ищет первый кадр, за которым сразу следует еще один корректный кадр."""
+    pos = start
+    while 0 <= pos < end - 4:
+        info = parse_frame_header(struct.unpack_from('>I', mm, pos)[0])
+        if info is not None:
+            next_pos = pos + info[0]
+            if next_pos + 4 > end or parse_frame_header(struct.unpack_from('>I', mm, next_pos)[0]):
+                return pos, info
+        pos = mm.find(b'\xff', pos + 1, end)
+    return -1, None
+
+
+def _read_xing(mm, frame_pos, info, end):
+    """Читает заголовок Xing/Info. Возвращает (кадров, байт, TOC) или None."""
+    frame_length, samples, sample_rate, version, channel_mode = info
+    mono = channel_mode == 3
+    if version == 1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    pos = frame_pos + 4 + side_info
+    if pos + 8 > end or mm[pos:pos + 4] not in (b'Xing', b'Info'):
+        return None
+    flags = struct.unpack_from('>I', mm, pos + 4)[0]
+    pos += 8
+    frames = total_bytes = toc = None
+    if flags & 1:
+        frames = struct.unpack_from('>I', mm, pos)[0]
+        pos += 4
+    if flags & 2:
+        total_bytes = struct.unpack_from('>I', mm, pos)[0]
+        pos += 4
+    if flags & 4 and pos + 100 <= end:
+        toc = bytes(mm[pos:pos + 100])
+    return frames, total_bytes, toc
+
+
+def _offset_array(file_size):
+    return array('I' if file_size < 2 ** 32 else 'Q')
+
+
+def _scan_frames(mm, start, end, file_size):
+    """Однократный проход по всем кадрам с записью смещений через SCAN_INTERVAL_MS."""
+    offsets = _offset_array(file_size)
+    next_mark = 0.0
+    samples_total = 0
+    sample_rate = None
+    pos = start
+    unpack = struct.Struct('>I').unpack_from
+    while pos + 4 <= end:
+        info = parse_frame_header(unpack(mm, pos)[0])
+        if info is None:
+            # Потеря синхронизации: ищем следующий кадр, подтвержденный соседним заголовком
+            pos, info = _find_first_frame(mm, pos + 1, end)
+            if pos < 0:
+                break
+        frame_length, samples, frame_rate = info[0], info[1], info[2]
+        if sample_rate is None:
+            sample_rate = frame_rate
+        time_ms = samples_total * 1000.0 / sample_rate
+        while time_ms >= next_mark:
+            offsets.append(pos)
+            next_mark += SCAN_INTERVAL_MS
+        samples_total += samples
+        pos += frame_length
+    duration_ms = int(samples_total * 1000 / sample_rate) if sample_rate else 0
+    return duration_ms, offsets
+
+
+def build_seek_table(file_path):
+    """
+    Строит таблицу перемотки для MP3: из TOC заголовка Xing, если он есть,
+    иначе однократным сканированием всех кадров. Для других форматов возвращает None.
+    """
+    if not file_path.lower().endswith('.mp3'):
+        return None
+    with open(file_path, 'rb') as file:
+        file_size = os.fstat(file.fileno()).st_size
+        if file_size == 0:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = file_size
+            if file_size >= 128 and mm[file_size - 128:file_size - 125] == b'TAG':
+                end -= 128
+            frame_pos, info = _find_first_frame(mm, _id3v2_size(mm), end)
+            if frame_pos < 0:
+                return None
+
+            xing = _read_xing(mm, frame_pos, info, end)
+            if xing is not None and xing[0] and xing[2] is not None:
+                frames, total_bytes, toc = xing
+                duration_ms = frames * info[1] * 1000.0 / info[2]
+                total_bytes = total_bytes or (end - frame_pos)
+                offsets = _offset_array(file_size)
+                offsets.extend(frame_pos + toc_value * total_bytes // 256 for toc_value in toc)
+                return SeekTable(int(duration_ms), duration_ms / 100.0, frame_pos, file_size, offsets)
+
+            # Кадр Xing/Info без TOC не содержит звука и пропускается
+            audio_start = frame_pos + info[0] if xing is not None else frame_pos
+            duration_ms, offsets = _scan_frames(mm, audio_start, end, file_size)
+            if not offsets:
+                return None
+            return SeekTable(duration_ms, SCAN_INTERVAL_MS, frame_pos, file_size, offsets)
+
+
+class SeekIndexStore:
+    """
+    Хранит таблицы перемотки в кэше библиотеки, по одному файлу на трек.
+    Таблица измененного трека удаляется при первом обращении к ней; число и общий размер
+    таблиц ограничены, лишние удаляются в порядке давности использования (mtime файла кэша
+    обновляется при каждом чтении - atime на многих системах не ведется).
+    """
+
+    def __init__(self, directory=None, max_tables=MAX_CACHED_TABLES, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory or cache_dir("seek_index")
+        self.max_tables = max_tables
+        self.max_bytes = max_bytes
+        # Первое сохранение после запуска сразу проверяет размер кэша
+        self._saves_until_prune = 1
+
+    def _cache_path(self, file_path):
+        return os.path.join(self.directory, hashlib.sha1(file_path.encode('utf-8')).hexdigest() + '.seek')
+
+    @staticmethod
+    def _remove(cache_path):
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+
+    def load(self, file_path, stat_result):
+        cache_path = self._cache_path(file_path)
+        try:
+            with open(cache_path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        if len(data) < CACHE_HEADER.size:
+            self._remove(cache_path)
+            return None
+        (magic, version, typecode, mtime_ns, size, audio_start, audio_end,
+         duration_ms, interval_ms, count) = CACHE_HEADER.unpack_from(data)
+        if magic != CACHE_MAGIC or version != 1 or mtime_ns != stat_result.st_mtime_ns \
+                or size != stat_result.st_size:
+            # Трек изменился или формат устарел - таблица больше не пригодится
+            self._remove(cache_path)
+            return None
+        offsets = array(typecode.decode('ascii'))
+        offsets.frombytes(data[CACHE_HEADER.size:])
+        if len(offsets) != count:
+            self._remove(cache_path)
+            return None
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return SeekTable(int(duration_ms), interval_ms, audio_start, audio_end, offsets)
+
+    def prune(self):
+        """Удаляет давно не использованные таблицы сверх max_tables и max_bytes. Возвращает число удаленных."""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.seek'):
+                        try:
+                            stat_result = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat_result.st_mtime_ns, stat_result.st_size, entry.path))
+        except OSError:
+            return 0
+        total_bytes = sum(size for _, size, _ in entries)
+        if len(entries) <= self.max_tables and total_bytes <= self.max_bytes:
+            return 0
+        entries.sort()
+        removed = 0
+        for _, size, cache_path in entries:
+            if len(entries) - removed <= self.max_tables and total_bytes <= self.max_bytes:
+                break
+            self._remove(cache_path)
+            total_bytes -= size
+            removed += 1
+        logging.debug(f"SeekIndexStore: удалено таблиц перемотки: {removed}")
+        return removed
+
+    def save(self, file_path, stat_result, table):
+        header = CACHE_HEADER.pack(CACHE_MAGIC, 1, table.offsets.typecode.encode('ascii'),
+                                   stat_result.st_mtime_ns, stat_result.st_size, table.audio_start,
+                                   table.audio_end, float(table.duration_ms), table.interval_ms,
+                                   len(table.offsets))
+        cache_path = self._cache_path(file_path)
+        temp_path = cache_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(header)
+                file.write(table.offsets.tobytes())
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logging.debug(f"SeekIndexStore: не удалось сохранить таблицу для {file_path}: {e}")
+            return
+        self._saves_until_prune -= 1
+        if self._saves_until_prune <= 0:
+            self._saves_until_prune = PRUNE_EVERY_SAVES
+            self.prune()
+
+    def get_or_build(self, file_path):
+        """Возвращает таблицу из кэша или строит и сохраняет новую."""
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return None
+        table = self.load(file_path, stat_result)
+        if table is not None:
+            return table
+        try:
+            table = build_seek_table(file_path)
+        except (OSError, ValueError, struct.error) as e:
+            logging.debug(f"SeekIndexStore: ошибка построения таблицы для {file_path}: {e}")
+            return None
+        if table is not None:
+            self.save(file_path, stat_result, table)
+        return table
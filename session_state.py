@@ -0,0 +1,142 @@
+import os
+import struct
+import logging
+import threading
+
+from app_paths import cache_dir
+
+SESSION_MAGIC = b'SESS'
+SESSION_VERSION = 1
+# Магия, версия, громкость, флаги, позиция и длительность (мс), прокрутка, основной и акцентный цвета обложки
+SESSION_HEADER = struct.Struct('<4sBBBxqqiii')
+_LENGTH = struct.Struct('<I')
+
+FLAG_SHUFFLE = 0x1
+FLAG_REPEAT = 0x2
+
+
+class SessionState:
+    """
+    Снимок сеанса: текущий трек с позицией, очередь, громкость, режимы и место в библиотеке.
+    Название, исполнитель, уменьшенная обложка (PNG) и ее цвета сохраняются вместе с треком,
+    чтобы при запуске показать их до чтения файла и сканирования библиотеки.
+    """
+    __slots__ = ('current_file', 'position_ms', 'length_ms', 'volume', 'shuffle', 'repeat', 'title', 'artist',
+                 'cover_png', 'cover_colors', 'album_folder', 'queue', 'library_path', 'scroll')
+
+    def __init__(self, current_file=None, position_ms=0, length_ms=0, volume=50, shuffle=False, repeat=False,
+                 title='', artist='', cover_png=b'', cover_colors=None, album_folder='', queue=(),
+                 library_path=(), scroll=0):
+        self.current_file = current_file
+        self.position_ms = position_ms
+        self.length_ms = length_ms
+        self.volume = volume
+        self.shuffle = shuffle
+        self.repeat = repeat
+        self.title = title
+        self.artist = artist
+        self.cover_png = cover_png
+        self.cover_colors = cover_colors
+        self.album_folder = album_folder
+        self.queue = list(queue)
+        self.library_path = list(library_path)
+        self.scroll = scroll
+
+
+def _pack_bytes(parts, data):
+    parts.append(_LENGTH.pack(len(data)))
+    parts.append(data)
+
+
+def _unpack_bytes(data, offset):
+    (length,), offset = _LENGTH.unpack_from(data, offset), offset + _LENGTH.size
+    if offset + length > len(data):
+        raise ValueError("Обрезанный снимок сеанса")
+    return data[offset:offset + length], offset + length
+
+
+def encode_session(state):
+    """Сериализует SessionState: заголовок фиксированной длины, затем строки UTF-8 и списки с длинами."""
+    dominant, accent = state.cover_colors if state.cover_colors is not None else (-1, -1)
+    flags = (FLAG_SHUFFLE if state.shuffle else 0) | (FLAG_REPEAT if state.repeat else 0)
+    parts = [SESSION_HEADER.pack(SESSION_MAGIC, SESSION_VERSION, max(0, min(100, state.volume)), flags,
+                                 max(0, state.position_ms), max(0, state.length_ms), max(0, state.scroll),
+                                 dominant, accent)]
+    for text in (state.current_file or '', state.title, state.artist, state.album_folder):
+        _pack_bytes(parts, text.encode('utf-8'))
+    for items in (state.queue, state.library_path):
+        parts.append(_LENGTH.pack(len(items)))
+        for text in items:
+            _pack_bytes(parts, text.encode('utf-8'))
+    _pack_bytes(parts, state.cover_png or b'')
+    return b''.join(parts)
+
+
+def decode_session(data):
+    """Разбирает снимок; ValueError или struct.error для поврежденных данных, None для чужой версии."""
+    (magic, version, volume, flags, position_ms, length_ms, scroll,
+     dominant, accent) = SESSION_HEADER.unpack_from(data)
+    if magic != SESSION_MAGIC or version != SESSION_VERSION:
+        return None
+    offset = SESSION_HEADER.size
+    texts = []
+    for _ in range(4):
+        raw, offset = _unpack_bytes(data, offset)
+        texts.append(raw.decode('utf-8'))
+    lists = []
+    for _ in range(2):
+        (count,), offset = _LENGTH.unpack_from(data, offset), offset + _LENGTH.size
+        items = []
+        for _ in range(count):
+            raw, offset = _unpack_bytes(data, offset)
+            items.append(raw.decode('utf-8'))
+        lists.append(items)
+    cover_png, offset = _unpack_bytes(data, offset)
+    current_file, title, artist, album_folder = texts
+    return SessionState(current_file=current_file or None, position_ms=position_ms, length_ms=length_ms,
+                        volume=volume, shuffle=bool(flags & FLAG_SHUFFLE), repeat=bool(flags & FLAG_REPEAT),
+                        title=title, artist=artist, cover_png=cover_png,
+                        cover_colors=(dominant, accent) if dominant >= 0 else None, album_folder=album_folder,
+                        queue=lists[0], library_path=lists[1], scroll=scroll)
+
+
+class SessionStore:
+    """Хранит последний снимок сеанса в одном файле кэша; запись атомарная (временный файл и os.replace)."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), "session.bin")
+        self._last_saved = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        try:
+            state = decode_session(data)
+        except (ValueError, struct.error, UnicodeDecodeError) as e:
+            logging.warning(f"SessionStore: снимок сеанса поврежден и не будет восстановлен: {e}")
+            return None
+        self._last_saved = data
+        return state
+
+    def save(self, state):
+        """Записывает снимок, если он изменился с прошлой записи. Вызывается из фонового потока."""
+        data = encode_session(state)
+        with self._lock:
+            if data == self._last_saved:
+                return False
+            temp_path = self.path + '.tmp'
+            try:
+                with open(temp_path, 'wb') as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logging.error(f"SessionStore: не удалось сохранить сеанс: {e}")
+                return False
+            self._last_saved = data
+            return True
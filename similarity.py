@@ -0,0 +1,371 @@
+import os
+import math
+import time
+import wave
+import zlib
+import random
+import shutil
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from app_paths import cache_dir
+import archive
+
+try:
+    import numpy as np
+except ImportError:
+    # Без NumPy режим радио недоступен, плеер работает как раньше
+    np = None
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+# Блоки вектора признаков: хэшированные категориальные признаки и числовые признаки
+ARTIST_BUCKETS = 16
+GENRE_BUCKETS = 8
+FOLDER_BUCKETS = 8
+NUMERIC_FEATURES = 4  # длительность, оценка, темп, спектральный центроид
+FEATURE_DIM = ARTIST_BUCKETS + GENRE_BUCKETS + FOLDER_BUCKETS + NUMERIC_FEATURES
+
+# Веса блоков: исполнитель важнее жанра, жанр важнее папки (альбома)
+ARTIST_WEIGHT = 1.0
+GENRE_WEIGHT = 0.8
+FOLDER_WEIGHT = 0.5
+NUMERIC_WEIGHT = 0.35
+
+# Приближенный поиск (IVF) включается для больших библиотек
+IVF_MIN_TRACKS = 50000
+IVF_PROBES = 8
+KMEANS_ITERATIONS = 6
+KMEANS_SAMPLE = 100000
+
+# Анализ звука: фрагмент из середины трека и параметры окон
+ANALYSIS_SECONDS = 30
+ANALYSIS_FRAME = 2048
+ANALYSIS_HOP = 1024
+AUDIO_FEATURE_EXTENSIONS = ('.wav', '.flac') if soundfile is not None else ('.wav',)
+
+
+def is_available():
+    return np is not None
+
+
+def _bucket(text, buckets):
+    """Стабильный хэш строки в (номер корзины, знак) - знак уменьшает искажения от коллизий."""
+    value = zlib.crc32(text.lower().encode('utf-8'))
+    return value % buckets, 1.0 if (value >> 16) & 1 else -1.0
+
+
+def build_feature_matrix(rows):
+    """
+    Строит матрицу признаков float32 (N x FEATURE_DIM) с нормированными строками.
+    rows - итерируемое (path, artist, genre, folder, duration_ms, rating, tempo, centroid).
+    Возвращает (пути, матрица).
+    """
+    paths = []
+    matrix = np.zeros((len(rows), FEATURE_DIM), dtype=np.float32)
+    genre_offset = ARTIST_BUCKETS
+    folder_offset = genre_offset + GENRE_BUCKETS
+    numeric_offset = folder_offset + FOLDER_BUCKETS
+    for i, (path, artist, genre, folder, duration_ms, rating, tempo, centroid) in enumerate(rows):
+        paths.append(path)
+        vector = matrix[i]
+        if artist:
+            bucket, sign = _bucket(artist, ARTIST_BUCKETS)
+            vector[bucket] = sign * ARTIST_WEIGHT
+        if genre:
+            bucket, sign = _bucket(genre, GENRE_BUCKETS)
+            vector[genre_offset + bucket] = sign * GENRE_WEIGHT
+        if folder:
+            bucket, sign = _bucket(folder, FOLDER_BUCKETS)
+            vector[folder_offset + bucket] = sign * FOLDER_WEIGHT
+        # Числовые признаки центрированы около 0, чтобы не давать сходства всем трекам сразу
+        minutes = (duration_ms or 0) / 60000.0
+        vector[numeric_offset] = NUMERIC_WEIGHT * (math.log1p(minutes) - 1.4)
+        vector[numeric_offset + 1] = NUMERIC_WEIGHT * ((rating or 0) - 2.5) / 2.5
+        if tempo is not None:
+            vector[numeric_offset + 2] = NUMERIC_WEIGHT * (2 * tempo - 1)
+        if centroid is not None:
+            vector[numeric_offset + 3] = NUMERIC_WEIGHT * (2 * centroid - 1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-6)
+    return paths, matrix
+
+
+class SimilarityIndex:
+    """
+    Поиск похожих треков по косинусной близости векторов признаков.
+    Все векторы - одна матрица float32; для небольших библиотек скалярные произведения
+    считаются по всей матрице, для больших строится IVF-индекс: строки сгруппированы
+    по кластерам k-means и проверяются только IVF_PROBES ближайших кластеров.
+    """
+
+    def __init__(self, paths, matrix, centroids=None, offsets=None):
+        self.paths = paths
+        self.matrix = matrix
+        self.row_of = {path: i for i, path in enumerate(paths)}
+        self.centroids = centroids
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, paths, matrix):
+        if len(paths) < IVF_MIN_TRACKS:
+            return cls(paths, matrix)
+        centroids, assignment = _kmeans(matrix, int(math.sqrt(len(paths))))
+        # Строки переупорядочиваются так, чтобы каждый кластер был непрерывным срезом
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=len(centroids))
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return cls([paths[i] for i in order], np.ascontiguousarray(matrix[order]), centroids, offsets)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def nearest(self, path, count=10, exclude=()):
+        """Возвращает до count пар (путь, сходство) для трека path, исключая exclude."""
+        row = self.row_of.get(path)
+        if row is None:
+            return []
+        query = self.matrix[row]
+        if self.centroids is None:
+            candidates = None
+            scores = self.matrix @ query
+        else:
+            clusters = np.argpartition(-(self.centroids @ query), min(IVF_PROBES, len(self.centroids) - 1))
+            candidates = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1])
+                                         for c in clusters[:IVF_PROBES]])
+            scores = self.matrix[candidates] @ query
+
+        # Берем с запасом, затем отбрасываем исключенные
+        take = min(len(scores), count + len(exclude) + 1)
+        if take == 0:
+            return []
+        top = np.argpartition(-scores, take - 1)[:take]
+        top = top[np.argsort(-scores[top])]
+        result = []
+        for index in top:
+            row_index = int(candidates[index]) if candidates is not None else int(index)
+            candidate_path = self.paths[row_index]
+            if row_index == row or candidate_path in exclude:
+                continue
+            result.append((candidate_path, float(scores[index])))
+            if len(result) >= count:
+                break
+        return result
+
+    def pick_next(self, path, exclude=(), count=10):
+        """Выбирает следующий трек радио: случайный из count ближайших, с весом по сходству."""
+        neighbours = self.nearest(path, count, exclude)
+        if not neighbours:
+            return None
+        weights = [max(score, 0.0) + 1e-3 for _, score in neighbours]
+        return random.choices([candidate for candidate, _ in neighbours], weights=weights)[0]
+
+    def save(self, directory=None):
+        """
+        Сохраняет матрицу и пути в кэш (матрица загружается потом через mmap).
+        Файлы пишутся в новую папку поколения, а переключение на нее - одна атомарная замена
+        файла CURRENT, поэтому load никогда не увидит смесь файлов разных поколений.
+        """
+        directory = directory or cache_dir("similarity")
+        generation = f"gen-{time.time_ns()}"
+        generation_dir = os.path.join(directory, generation)
+        os.makedirs(generation_dir)
+        np.save(os.path.join(generation_dir, "features.npy"), self.matrix)
+        with open(os.path.join(generation_dir, "paths.txt"), "w", encoding="utf-8") as file:
+            file.write("\n".join(self.paths))
+        if self.centroids is not None:
+            np.savez(os.path.join(generation_dir, "ivf.npz"), centroids=self.centroids, offsets=self.offsets)
+        with open(os.path.join(directory, "CURRENT.tmp"), "w", encoding="utf-8") as file:
+            file.write(generation)
+        os.replace(os.path.join(directory, "CURRENT.tmp"), os.path.join(directory, "CURRENT"))
+        # Старые поколения (и файлы прежнего формата) больше не нужны; открытые через mmap
+        # на Windows удалить не получится - они уберутся при следующем сохранении
+        for name in os.listdir(directory):
+            if name in (generation, "CURRENT"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                logging.debug(f"SimilarityIndex: не удалось удалить {path}: {e}")
+
+    @classmethod
+    def load(cls, directory=None):
+        """Загружает сохраненный индекс или возвращает None."""
+        directory = directory or cache_dir("similarity")
+        try:
+            with open(os.path.join(directory, "CURRENT"), encoding="utf-8") as file:
+                directory = os.path.join(directory, file.read().strip())
+            matrix = np.load(os.path.join(directory, "features.npy"), mmap_mode='r')
+            with open(os.path.join(directory, "paths.txt"), encoding="utf-8") as file:
+                paths = file.read().split("\n")
+            centroids = offsets = None
+            ivf_path = os.path.join(directory, "ivf.npz")
+            if os.path.exists(ivf_path):
+                with np.load(ivf_path) as ivf:
+                    centroids, offsets = ivf["centroids"], ivf["offsets"]
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(paths) != len(matrix) or matrix.shape[1:] != (FEATURE_DIM,):
+            return None
+        return cls(paths, matrix, centroids, offsets)
+
+
+def _kmeans(matrix, clusters):
+    """Сферический k-means на выборке строк; возвращает (центроиды, номер кластера каждой строки)."""
+    rng = np.random.default_rng(0)
+    sample = matrix[rng.choice(len(matrix), min(len(matrix), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(clusters):
+            members = sample[labels == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-6)
+    assignment = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), 65536):
+        block = matrix[start:start + 65536]
+        assignment[start:start + 65536] = np.argmax(block @ centroids.T, axis=1)
+    return centroids.astype(np.float32), assignment
+
+
+def build_from_index(library_index):
+    """Строит SimilarityIndex из индекса библиотеки."""
+    rows = library_index.query(
+        "SELECT t.path, t.artist, t.genre, t.folder, t.duration_ms, t.rating, a.tempo, a.centroid "
+        "FROM tracks t LEFT JOIN audio_features a ON a.path = t.path AND a.mtime_ns = t.mtime_ns "
+        "WHERE t.error IS NULL")
+    start_time = time.perf_counter()
+    paths, matrix = build_feature_matrix(rows)
+    index = SimilarityIndex.build(paths, matrix)
+    logging.info(f"Индекс похожих треков: {len(paths)} треков за {time.perf_counter() - start_time:.1f} с"
+                 f"{' (IVF)' if index.centroids is not None else ''}")
+    return index
+
+
+def _read_samples(path):
+    """Читает моно-фрагмент трека длиной до ANALYSIS_SECONDS из середины. Возвращает (сэмплы, частота)."""
+    if archive.is_archive_member(path):
+        # wave и soundfile читают член архива из потока с произвольным доступом
+        with archive.open_member(path) as member:
+            return _read_samples_from(path, member)
+    return _read_samples_from(path, path)
+
+
+def _read_samples_from(path, source):
+    if path.lower().endswith('.wav'):
+        with wave.open(source, 'rb') as wav:
+            rate, channels, width = wav.getframerate(), wav.getnchannels(), wav.getsampwidth()
+            total = wav.getnframes()
+            length = min(total, rate * ANALYSIS_SECONDS)
+            wav.setpos(max(0, (total - length) // 2))
+            raw = wav.readframes(length)
+        if width == 1:
+            data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+        elif width in (2, 4):
+            data = np.frombuffer(raw, dtype=np.int16 if width == 2 else np.int32).astype(np.float32)
+            data /= float(2 ** (8 * width - 1))
+        else:
+            return None, 0
+        return data.reshape(-1, channels).mean(axis=1), rate
+    with soundfile.SoundFile(source) as sound:
+        length = min(sound.frames, sound.samplerate * ANALYSIS_SECONDS)
+        sound.seek(max(0, (sound.frames - length) // 2))
+        data = sound.read(frames=length, dtype='float32', always_2d=True)
+        rate = sound.samplerate
+    return data.mean(axis=1), rate
+
+
+def audio_features(samples, rate):
+    """
+    Темп и спектральный центроид фрагмента, нормированные в 0..1.
+    Темп ищется автокорреляцией спектрального потока в диапазоне 60-180 BPM.
+    """
+    if samples is None or len(samples) < ANALYSIS_FRAME * 4:
+        return None, None
+    frames = np.lib.stride_tricks.sliding_window_view(samples, ANALYSIS_FRAME)[::ANALYSIS_HOP]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(ANALYSIS_FRAME), axis=1))
+    frequencies = np.fft.rfftfreq(ANALYSIS_FRAME, 1.0 / rate)
+    energy = spectrum.sum(axis=1)
+    centroid = float((spectrum @ frequencies).sum() / max(energy.sum(), 1e-9)) / (rate / 2)
+
+    flux = np.maximum(np.diff(spectrum, axis=0), 0).sum(axis=1)
+    flux -= flux.mean()
+    frames_per_second = rate / ANALYSIS_HOP
+    min_lag = max(1, int(frames_per_second * 60 / 180))
+    max_lag = int(frames_per_second * 60 / 60)
+    if len(flux) <= max_lag:
+        return None, min(1.0, centroid)
+    correlation = np.correlate(flux, flux, mode='full')[len(flux) - 1:]
+    lag = min_lag + int(np.argmax(correlation[min_lag:max_lag + 1]))
+    bpm = 60.0 * frames_per_second / lag
+    return min(1.0, max(0.0, (bpm - 60) / 120)), min(1.0, centroid)
+
+
+def audio_features_chunk(entries):
+    """Выполняется в процессе пула: entries - (путь, mtime_ns); возвращает строки audio_features."""
+    rows = []
+    for path, mtime_ns in entries:
+        try:
+            tempo, centroid = audio_features(*_read_samples(path))
+        except Exception as e:
+            logging.debug(f"Анализ звука {path}: {e}")
+            tempo = centroid = None
+        rows.append((path, mtime_ns, tempo, centroid))
+    return rows
+
+
+def analyze_audio(library_index, cancel_event=None, max_workers=None, chunk_size=8):
+    """
+    Вычисляет звуковые признаки для треков без актуальных признаков в пуле процессов.
+    Прерывается по cancel_event; уже посчитанное сохраняется. Возвращает число обработанных треков.
+    """
+    patterns = " OR ".join("lower(t.path) LIKE ?" for _ in AUDIO_FEATURE_EXTENSIONS)
+    pending = [tuple(row) for row in library_index.query(
+        "SELECT t.path, t.mtime_ns FROM tracks t LEFT JOIN audio_features a "
+        "ON a.path = t.path AND a.mtime_ns = t.mtime_ns "
+        f"WHERE a.path IS NULL AND t.error IS NULL AND ({patterns})",
+        [f"%{extension}" for extension in AUDIO_FEATURE_EXTENSIONS])]
+    if not pending:
+        return 0
+    max_workers = max_workers or os.cpu_count() or 1
+    processed = 0
+    in_flight = set()
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    def collect(futures):
+        nonlocal processed
+        for future in futures:
+            rows = future.result()
+            library_index.write_audio_features(rows)
+            processed += len(rows)
+
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        for start in range(0, len(pending), chunk_size):
+            if cancelled():
+                break
+            while len(in_flight) >= max_workers * 2 and not cancelled():
+                done, in_flight = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(audio_features_chunk, pending[start:start + chunk_size]))
+        while in_flight and not cancelled():
+            done, in_flight = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+            collect(done)
+    finally:
+        # При отмене ожидающие куски снимаются, сохраняется только уже посчитанное
+        pool.shutdown(wait=True, cancel_futures=True)
+        collect(future for future in in_flight
+                if future.done() and not future.cancelled() and future.exception() is None)
+    logging.info(f"Анализ звука: {processed} из {len(pending)} треков{' (отменено)' if cancelled() else ''}")
+    return processed
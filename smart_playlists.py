@@ -0,0 +1,401 @@
+import re
+import time
+import logging
+import threading
+
+# Умный плейлист задается запросом, например:
+#   genre is Jazz and added in the last 30 days
+#   rated 4+ and never played
+#   (artist contains "Davis" or album is "Kind of Blue") and duration > 300
+# Поля: title, artist, album, genre, path - текст; rating, plays - числа;
+# duration - секунды; added, played - даты (in the last N days/weeks/months, before/after ГГГГ-ММ-ДД).
+
+TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<string>"[^"]*"|'[^']*')
+  | (?P<op>>=|<=|!=|[<>=()])
+  | (?P<date>\d{4}-\d{2}-\d{2})
+  | (?P<number>\d+(?:\.\d+)?\+?)
+  | (?P<word>[^\s()<>=!"']+)
+)""", re.VERBOSE)
+
+# Поле -> (выражение SQL, тип, сопоставление для сравнения).
+# Сопоставление совпадает с индексом столбца, иначе SQLite не сможет его использовать:
+# индексы artist/album/genre - NOCASE, path - первичный ключ с BINARY
+NOCASE = " COLLATE NOCASE"
+FIELDS = {
+    'title': ('t.title', 'text', NOCASE),
+    'artist': ('t.artist', 'text', NOCASE),
+    'album': ('t.album', 'text', NOCASE),
+    'genre': ('t.genre', 'text', NOCASE),
+    'path': ('t.path', 'text', ""),
+    'rating': ('t.rating', 'number', ""),
+    'duration': ('t.duration_ms', 'duration', ""),
+    'plays': ('COALESCE(s.play_count, 0)', 'number', ""),
+    'added': ('t.added_at', 'date', ""),
+    'played': ('s.last_played', 'date', ""),
+}
+COMPARISONS = {'=': '=', '>': '>', '<': '<', '>=': '>=', '<=': '<=', '!=': '<>'}
+TIME_UNITS = {'hour': 3600, 'hours': 3600, 'day': 86400, 'days': 86400,
+              'week': 7 * 86400, 'weeks': 7 * 86400, 'month': 30 * 86400, 'months': 30 * 86400}
+
+# Сколько путей проверяется одним запросом при инкрементальном обновлении
+UPDATE_CHUNK_SIZE = 500
+# Плейлисты с относительными датами пересчитываются полностью не реже этого интервала (с)
+TIME_RELATIVE_MAX_AGE = 3600
+
+
+class QueryError(ValueError):
+    pass
+
+
+class _Condition:
+    """Лист дерева запроса: готовый фрагмент SQL с параметрами."""
+    __slots__ = ('sql', 'params', 'uses_stats', 'requires_stats', 'time_relative')
+
+    def __init__(self, sql, params=(), uses_stats=False, requires_stats=False, time_relative=False):
+        self.sql = sql
+        self.params = list(params)
+        self.uses_stats = uses_stats
+        # Условие ложно для треков без строки в play_stats - можно использовать внутреннее соединение
+        self.requires_stats = requires_stats
+        self.time_relative = time_relative
+
+
+class _Node:
+    __slots__ = ('kind', 'children')
+
+    def __init__(self, kind, children):
+        self.kind = kind
+        self.children = children
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if match is None or match.end() == pos:
+            raise QueryError(f"Непонятный фрагмент запроса: {text[pos:]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1]
+        tokens.append((kind, value))
+    return tokens
+
+
+def _since(seconds):
+    return lambda: int(time.time()) - seconds
+
+
+def _parse_date(value):
+    try:
+        return int(time.mktime(time.strptime(value, "%Y-%m-%d")))
+    except ValueError:
+        raise QueryError(f"Ожидалась дата ГГГГ-ММ-ДД: {value!r}")
+
+
+class _Parser:
+    """Рекурсивный спуск: or -> and -> not -> условие."""
+
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek_word(self, offset=0):
+        index = self.pos + offset
+        if index < len(self.tokens) and self.tokens[index][0] == 'word':
+            return self.tokens[index][1].lower()
+        return None
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        if token[0] is None:
+            raise QueryError("Запрос неожиданно закончился")
+        self.pos += 1
+        return token
+
+    def expect_word(self, *words):
+        kind, value = self.take()
+        if kind != 'word' or value.lower() not in words:
+            raise QueryError(f"Ожидалось {' или '.join(words)}, получено {value!r}")
+        return value.lower()
+
+    def take_value(self):
+        kind, value = self.take()
+        if kind == 'op':
+            raise QueryError(f"Ожидалось значение, получено {value!r}")
+        return value
+
+    def take_number(self):
+        kind, value = self.take()
+        if kind != 'number':
+            raise QueryError(f"Ожидалось число, получено {value!r}")
+        return value
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("Пустой запрос")
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise QueryError(f"Лишний фрагмент запроса: {self.tokens[self.pos][1]!r}")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek_word() == 'or':
+            self.pos += 1
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else _Node('or', children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek_word() == 'and':
+            self.pos += 1
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else _Node('and', children)
+
+    def parse_not(self):
+        if self.peek_word() == 'not':
+            self.pos += 1
+            return _Node('not', [self.parse_not()])
+        if self.peek() == ('op', '('):
+            self.pos += 1
+            node = self.parse_or()
+            if self.take() != ('op', ')'):
+                raise QueryError("Ожидалась закрывающая скобка")
+            return node
+        return self.parse_condition()
+
+    def parse_condition(self):
+        word = self.peek_word()
+        if word == 'never':
+            self.pos += 1
+            self.expect_word('played')
+            return _Condition("COALESCE(s.play_count, 0) = 0", uses_stats=True)
+        if word == 'rated':
+            self.pos += 1
+            number = self.take_number()
+            if number.endswith('+'):
+                return _Condition("t.rating >= ?", [int(float(number[:-1]))])
+            return _Condition("t.rating = ?", [int(float(number))])
+
+        if word not in FIELDS:
+            raise QueryError(f"Неизвестное поле: {self.peek()[1]!r}")
+        self.pos += 1
+        column, field_type, collate = FIELDS[word]
+        uses_stats = column.startswith(('s.', 'COALESCE(s.'))
+        if field_type == 'date':
+            return self.parse_date_condition(column, uses_stats)
+
+        kind, value = self.peek()
+        if kind == 'op' and value in COMPARISONS:
+            self.pos += 1
+            if field_type == 'text':
+                operand = self.take_value()
+            else:
+                operand = float(self.take_number().rstrip('+'))
+                if field_type == 'duration':
+                    operand *= 1000
+            return _Condition(f"{column} {COMPARISONS[value]} ?{collate}", [operand], uses_stats)
+
+        operator = self.expect_word('is', 'contains')
+        if operator == 'contains':
+            if field_type != 'text':
+                raise QueryError("Оператор contains применим только к текстовым полям")
+            pattern = self.take_value().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            return _Condition(f"{column} LIKE ? ESCAPE '\\'", [f"%{pattern}%"], uses_stats)
+
+        negate = self.peek_word() == 'not'
+        if negate:
+            self.pos += 1
+        operand = self.take_value()
+        if field_type != 'text':
+            operand = float(operand.rstrip('+'))
+            if field_type == 'duration':
+                operand *= 1000
+        if negate:
+            return _Condition(f"({column} IS NULL OR {column} <> ?{collate})", [operand], uses_stats)
+        return _Condition(f"{column} = ?{collate}", [operand], uses_stats)
+
+    def parse_date_condition(self, column, uses_stats):
+        word = self.expect_word('in', 'before', 'after')
+        if word == 'in':
+            self.expect_word('the')
+            self.expect_word('last')
+            amount = int(float(self.take_number().rstrip('+')))
+            unit = self.expect_word(*TIME_UNITS)
+            return _Condition(f"{column} >= ?", [_since(amount * TIME_UNITS[unit])], uses_stats,
+                              requires_stats=uses_stats, time_relative=True)
+        timestamp = _parse_date(self.take_value())
+        if word == 'before':
+            return _Condition(f"{column} < ?", [timestamp], uses_stats)
+        return _Condition(f"{column} >= ?", [timestamp + 86400], uses_stats, requires_stats=uses_stats)
+
+
+def parse_query(text):
+    """Разбирает текст запроса в дерево условий. Ошибки - QueryError."""
+    return _Parser(text).parse()
+
+
+def _walk_conditions(node):
+    if isinstance(node, _Condition):
+        yield node
+        return
+    for child in node.children:
+        yield from _walk_conditions(child)
+
+
+def _emit(node, params):
+    if isinstance(node, _Condition):
+        params.extend(node.params)
+        return node.sql
+    if node.kind == 'not':
+        # Сравнение с NULL (нет жанра, трек ни разу не играл) дает NULL, и NOT его не обращает:
+        # неизвестное условие считается ложным, а его отрицание - истинным
+        return f"NOT COALESCE({_emit(node.children[0], params)}, 0)"
+    # Порядок условий SQLite выбирает сам по статистике индексов (ANALYZE после индексации)
+    joiner = " AND " if node.kind == 'and' else " OR "
+    return "(" + joiner.join(_emit(child, params) for child in node.children) + ")"
+
+
+class QueryPlan:
+    """
+    Скомпилированный запрос. Таблица play_stats подключается только если нужна;
+    если верхнеуровневое условие отбрасывает треки без прослушиваний, соединение
+    делается внутренним, чтобы SQLite мог начать обход с индекса play_stats.
+    Параметры относительных дат вычисляются при каждом выполнении.
+    """
+
+    def __init__(self, root):
+        params = []
+        self.where = _emit(root, params)
+        self._params = params
+        conditions = list(_walk_conditions(root))
+        self.time_relative = any(condition.time_relative for condition in conditions)
+        top_level = root.children if isinstance(root, _Node) and root.kind == 'and' else [root]
+        # Внутреннее соединение только по условиям верхнего уровня: под NOT и OR треки
+        # без прослушиваний тоже могут подойти, для них нужно LEFT JOIN
+        if any(isinstance(node, _Condition) and node.requires_stats for node in top_level):
+            self.source = "tracks t JOIN play_stats s ON s.path = t.path"
+        elif any(condition.uses_stats for condition in conditions):
+            self.source = "tracks t LEFT JOIN play_stats s ON s.path = t.path"
+        else:
+            self.source = "tracks t"
+
+    def params(self):
+        return [param() if callable(param) else param for param in self._params]
+
+    def select_all(self):
+        return f"SELECT t.path FROM {self.source} WHERE {self.where}", self.params()
+
+    def select_among(self, count):
+        """Запрос для проверки count конкретных путей (инкрементальное обновление)."""
+        placeholders = ", ".join("?" * count)
+        return f"SELECT t.path FROM {self.source} WHERE t.path IN ({placeholders}) AND {self.where}"
+
+
+def plan_query(text):
+    return QueryPlan(parse_query(text))
+
+
+class SmartPlaylist:
+    """
+    Умный плейлист с материализованным набором путей.
+    Полный пересчет выполняется при первом обращении; дальше набор обновляется
+    только для путей, измененных индексацией, удалением или прослушиванием.
+    """
+
+    def __init__(self, name, query_text):
+        self.name = name
+        self.query_text = query_text
+        self.plan = plan_query(query_text)
+        self.paths = set()
+        self.evaluated_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, index):
+        sql, params = self.plan.select_all()
+        paths = {row[0] for row in index.query(sql, params)}
+        with self._lock:
+            self.paths = paths
+            self.evaluated_at = time.time()
+
+    def is_stale(self):
+        if self.evaluated_at is None:
+            return True
+        return self.plan.time_relative and time.time() - self.evaluated_at > TIME_RELATIVE_MAX_AGE
+
+    def update(self, index, changed_paths):
+        """Перепроверяет только измененные пути. Возвращает True, если состав изменился."""
+        if self.evaluated_at is None:
+            return False
+        changed = False
+        for start in range(0, len(changed_paths), UPDATE_CHUNK_SIZE):
+            chunk = changed_paths[start:start + UPDATE_CHUNK_SIZE]
+            matched = {row[0] for row in index.query(self.plan.select_among(len(chunk)),
+                                                      chunk + self.plan.params())}
+            with self._lock:
+                for path in chunk:
+                    if path in matched:
+                        if path not in self.paths:
+                            self.paths.add(path)
+                            changed = True
+                    elif path in self.paths:
+                        self.paths.discard(path)
+                        changed = True
+        return changed
+
+    def tracks(self, index):
+        if self.is_stale():
+            self.refresh(index)
+        with self._lock:
+            return sorted(self.paths)
+
+
+class SmartPlaylistManager:
+    """Хранит умные плейлисты индекса и поддерживает их в актуальном состоянии."""
+
+    BUILTIN = {"Недавние": "added in the last 30 days"}
+
+    def __init__(self, index):
+        self.index = index
+        self.playlists = {}
+        self._listeners = []
+        for name, query_text in list(self.BUILTIN.items()) + index.smart_playlists():
+            try:
+                self.playlists[name] = SmartPlaylist(name, query_text)
+            except QueryError as e:
+                logging.error(f"Умный плейлист '{name}' пропущен: {e}")
+        index.add_listener(self._on_index_changed)
+
+    def add_listener(self, callback):
+        """callback(имена) вызывается в потоке записи индекса, когда состав плейлистов меняется."""
+        self._listeners.append(callback)
+
+    def add(self, name, query_text):
+        """Создает или заменяет плейлист. Ошибки запроса - QueryError."""
+        playlist = SmartPlaylist(name, query_text)
+        self.index.save_smart_playlist(name, query_text)
+        self.playlists[name] = playlist
+        return playlist
+
+    def remove(self, name):
+        self.playlists.pop(name, None)
+        self.index.delete_smart_playlist(name)
+
+    def tracks(self, name):
+        playlist = self.playlists.get(name)
+        return playlist.tracks(self.index) if playlist is not None else []
+
+    def _on_index_changed(self, paths):
+        changed = [name for name, playlist in list(self.playlists.items())
+                   if playlist.update(self.index, paths)]
+        if changed:
+            for callback in self._listeners:
+                callback(changed)
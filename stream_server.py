@@ -0,0 +1,454 @@
+import os
+import io
+import json
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs, unquote, quote
+
+from PIL import Image
+
+from library_tree import scan_library
+import archive
+from metadata_service import MetadataService
+
+MIME_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.flac': 'audio/flac',
+    '.wav': 'audio/wav',
+}
+
+STATUS_TEXT = {
+    200: 'OK',
+    206: 'Partial Content',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    416: 'Range Not Satisfiable',
+    500: 'Internal Server Error',
+}
+
+# Ограничения на соединение
+MAX_HEADER_BYTES = 16 * 1024
+KEEP_ALIVE_TIMEOUT = 15.0
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or STATUS_TEXT.get(status, ''))
+        self.status = status
+
+
+def parse_range(header, file_size):
+    """
+    Разбирает заголовок Range (один диапазон байт).
+    Возвращает (start, end) включительно или None, если заголовка нет.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        raise HttpError(416)
+    start_text, _, end_text = spec.strip().partition('-')
+    try:
+        if start_text == '':
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise HttpError(416)
+            start = max(0, file_size - suffix)
+            end = file_size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else file_size - 1
+    except ValueError:
+        raise HttpError(416)
+    end = min(end, file_size - 1)
+    if start > end or start >= file_size:
+        raise HttpError(416)
+    return start, end
+
+
+class ThumbnailCache:
+    """LRU-кэш готовых JPEG-миниатюр обложек, ограниченный суммарным размером."""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._total_bytes -= len(old)
+            self._items[key] = data
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+
+def make_thumbnail(cover_data, size):
+    """Уменьшает обложку до size по большей стороне и кодирует в JPEG."""
+    image = Image.open(io.BytesIO(cover_data))
+    image.draft('RGB', (size, size))
+    image = image.convert('RGB')
+    image.thumbnail((size, size), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=85)
+    return output.getvalue()
+
+
+class LibraryHttpServer:
+    """
+    HTTP-сервер библиотеки на asyncio.
+    /api/browse?path=A/B - содержимое папки, /api/search?q=... - поиск по именам,
+    /stream/<путь> - аудио с поддержкой Range (os.sendfile через loop.sendfile),
+    /cover/<путь>?size=N - миниатюра обложки трека.
+    Отдаются только файлы, присутствующие в дереве библиотеки.
+    Авторизации нет, поэтому по умолчанию сервер слушает только 127.0.0.1;
+    доступ из локальной сети включается явно (host='0.0.0.0').
+    """
+
+    def __init__(self, library_tree=None, metadata_service=None, host='127.0.0.1', port=8765):
+        self.library_tree = library_tree
+        self.metadata_service = metadata_service or MetadataService()
+        self.host = host
+        self.port = port
+        self.thumbnails = ThumbnailCache()
+        self._search_index = None
+        self._server = None
+        self._loop = None
+
+    def set_library(self, library_tree):
+        """Подменяет дерево библиотеки (например, после повторного сканирования)."""
+        self.library_tree = library_tree
+        self._search_index = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"HTTP-сервер библиотеки запущен на {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """Запускает сервер в отдельном потоке со своим циклом событий (для GUI)."""
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except OSError as e:
+                errors.append(e)
+                started.set()
+                loop.close()
+                return
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="http-server", daemon=True).start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def stop_from_thread(self):
+        if self._loop is not None:
+            future = asyncio.run_coroutine_threadsafe(self.close(), self._loop)
+            future.result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # --- Обработка соединений ---
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._send_simple(writer, 400, keep_alive=False)
+                    break
+                if len(head) > MAX_HEADER_BYTES:
+                    await self._send_simple(writer, 400, keep_alive=False)
+                    break
+
+                method, target, keep_alive = None, None, False
+                try:
+                    method, target, version, headers = self._parse_head(head)
+                    keep_alive = self._wants_keep_alive(version, headers)
+                    await self._dispatch(writer, method, target, headers, keep_alive)
+                except HttpError as e:
+                    await self._send_simple(writer, e.status, keep_alive=keep_alive)
+                except ConnectionError:
+                    break
+                except Exception as e:
+                    logging.error(f"HTTP: ошибка обработки {method} {target}: {e}")
+                    await self._send_simple(writer, 500, keep_alive=False)
+                    break
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_head(head):
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise HttpError(400)
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, version, headers
+
+    @staticmethod
+    def _wants_keep_alive(version, headers):
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    async def _dispatch(self, writer, method, target, headers, keep_alive):
+        if method not in ('GET', 'HEAD'):
+            raise HttpError(405)
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        path = unquote(url.path)
+        head_only = method == 'HEAD'
+
+        try:
+            limit = int(query.get('limit', ['100'])[0])
+            size = int(query.get('size', ['256'])[0])
+        except ValueError:
+            raise HttpError(400)
+
+        # Разбор тегов и обход дерева выполняются вне цикла событий
+        if path == '/api/browse':
+            payload = await self._loop.run_in_executor(None, self._browse, query.get('path', [''])[0])
+            await self._send_json(writer, payload, keep_alive, head_only)
+        elif path == '/api/search':
+            payload = await self._loop.run_in_executor(None, self._search, query.get('q', [''])[0], limit)
+            await self._send_json(writer, payload, keep_alive, head_only)
+        elif path.startswith('/stream/'):
+            await self._send_audio(writer, path[len('/stream/'):], headers, keep_alive, head_only)
+        elif path.startswith('/cover/'):
+            await self._send_cover(writer, path[len('/cover/'):], size, headers, keep_alive, head_only)
+        else:
+            raise HttpError(404)
+
+    # --- Библиотека ---
+
+    def _resolve_folder(self, relative_path):
+        if self.library_tree is None:
+            raise HttpError(404)
+        parts = [part for part in relative_path.split('/') if part]
+        node = self.library_tree.find(parts)
+        if node is None:
+            raise HttpError(404)
+        return node
+
+    def _resolve_file(self, relative_path):
+        folder_path, _, file_name = relative_path.rpartition('/')
+        node = self._resolve_folder(folder_path)
+        if not node.has_file(file_name):
+            raise HttpError(404)
+        return node.file_path(file_name)
+
+    def _track_entry(self, node, file_name, record=None):
+        relative = '/'.join(node.relative_parts() + [file_name])
+        entry = {
+            'name': file_name,
+            'path': relative,
+            'stream_url': '/stream/' + quote(relative),
+        }
+        if record is not None:
+            entry.update(title=record.title, artist=record.artist, album=record.album,
+                         duration_ms=record.duration_ms)
+            if record.has_cover:
+                entry['cover_url'] = '/cover/' + quote(relative)
+        return entry
+
+    def _browse(self, relative_path):
+        node = self._resolve_folder(relative_path)
+        records = self.metadata_service.get_many([node.file_path(name) for name in node.files])
+        return {
+            'path': '/'.join(node.relative_parts()),
+            'folders': [{'name': child.name, 'path': '/'.join(child.relative_parts())}
+                        for child in node.folders],
+            'tracks': [self._track_entry(node, name, record) for name, record in zip(node.files, records)],
+        }
+
+    def _build_search_index(self):
+        index = []
+        for node in self.library_tree.iter_nodes():
+            if node.parent is not None:
+                index.append((node.name.lower(), node, None))
+            for file_name in node.files:
+                index.append((file_name.lower(), node, file_name))
+        return index
+
+    def _search(self, query, limit):
+        query = query.strip().lower()
+        if not query or self.library_tree is None:
+            return {'query': query, 'folders': [], 'tracks': []}
+        if self._search_index is None:
+            self._search_index = self._build_search_index()
+        folders, tracks = [], []
+        for name, node, file_name in self._search_index:
+            if query not in name:
+                continue
+            if file_name is None:
+                folders.append({'name': node.name, 'path': '/'.join(node.relative_parts())})
+            else:
+                tracks.append(self._track_entry(node, file_name))
+            if len(folders) + len(tracks) >= limit:
+                break
+        return {'query': query, 'folders': folders, 'tracks': tracks}
+
+    # --- Ответы ---
+
+    @staticmethod
+    def _headers_block(status, headers):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    def _base_headers(self, keep_alive):
+        return {
+            'Date': formatdate(usegmt=True),
+            'Server': 'dostup-k-muzyke',
+            'Connection': 'keep-alive' if keep_alive else 'close',
+        }
+
+    async def _send_simple(self, writer, status, keep_alive):
+        body = STATUS_TEXT.get(status, '').encode()
+        headers = self._base_headers(keep_alive)
+        headers.update({'Content-Type': 'text/plain; charset=utf-8', 'Content-Length': str(len(body))})
+        writer.write(self._headers_block(status, headers) + body)
+        await writer.drain()
+
+    async def _send_bytes(self, writer, body, content_type, keep_alive, head_only, extra_headers=None):
+        headers = self._base_headers(keep_alive)
+        headers.update({'Content-Type': content_type, 'Content-Length': str(len(body))})
+        if extra_headers:
+            headers.update(extra_headers)
+        writer.write(self._headers_block(200, headers) + (b'' if head_only else body))
+        await writer.drain()
+
+    async def _send_json(self, writer, payload, keep_alive, head_only):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        await self._send_bytes(writer, body, 'application/json; charset=utf-8', keep_alive, head_only)
+
+    async def _send_audio(self, writer, relative_path, request_headers, keep_alive, head_only):
+        file_path = self._resolve_file(relative_path)
+        try:
+            # stat и открытие (для архива - разбор оглавления) могут ждать медленный диск, поэтому идут в пуле;
+            # члены архивов отдаются из потока архива, sendfile для них переходит на чтение блоками
+            stat_result, file = await self._loop.run_in_executor(None, self._open_audio, file_path)
+        except OSError:
+            raise HttpError(404)
+        with file:
+            file_size = stat_result.st_size
+            etag = f'"{stat_result.st_mtime_ns:x}-{file_size:x}"'
+            byte_range = parse_range(request_headers.get('range'), file_size)
+
+            headers = self._base_headers(keep_alive)
+            headers.update({
+                'Content-Type': MIME_TYPES.get(os.path.splitext(file_path)[1].lower(), 'application/octet-stream'),
+                'Accept-Ranges': 'bytes',
+                'ETag': etag,
+                'Cache-Control': 'no-cache',
+            })
+            if byte_range is None:
+                status, offset, count = 200, 0, file_size
+            else:
+                status = 206
+                offset, count = byte_range[0], byte_range[1] - byte_range[0] + 1
+                headers['Content-Range'] = f"bytes {byte_range[0]}-{byte_range[1]}/{file_size}"
+            headers['Content-Length'] = str(count)
+
+            writer.write(self._headers_block(status, headers))
+            await writer.drain()
+            if head_only or count == 0:
+                return
+            # loop.sendfile использует os.sendfile (без копирования в пространство пользователя),
+            # если транспорт это поддерживает, иначе читает файл блоками
+            await self._loop.sendfile(writer.transport, file, offset, count)
+
+    @staticmethod
+    def _open_audio(file_path):
+        stat_result = archive.stat_path(file_path)
+        return stat_result, archive.open_file(file_path)
+
+    async def _send_cover(self, writer, relative_path, size, request_headers, keep_alive, head_only):
+        file_path = self._resolve_file(relative_path)
+        size = next((level for level in THUMBNAIL_SIZES if level >= size), THUMBNAIL_SIZES[-1])
+        record = await self._loop.run_in_executor(None, self.metadata_service.get, file_path)
+        if not record.has_cover:
+            raise HttpError(404)
+        cache_key = (record.cover_ref, size)
+        etag = f'"{record.cover_ref[1]:x}-{size}"'
+        if request_headers.get('if-none-match') == etag:
+            headers = self._base_headers(keep_alive)
+            headers.update({'ETag': etag, 'Content-Length': '0'})
+            writer.write(self._headers_block(304, headers))
+            await writer.drain()
+            return
+
+        thumbnail = self.thumbnails.get(cache_key)
+        if thumbnail is None:
+            cover_data = await self._loop.run_in_executor(None, self.metadata_service.get_cover_data, record)
+            if not cover_data:
+                raise HttpError(404)
+            thumbnail = await self._loop.run_in_executor(None, make_thumbnail, cover_data, size)
+            self.thumbnails.put(cache_key, thumbnail)
+        await self._send_bytes(writer, thumbnail, 'image/jpeg', keep_alive, head_only,
+                               {'ETag': etag, 'Cache-Control': 'max-age=3600'})
+
+
+if __name__ == '__main__':
+    # Автономный режим без GUI: python stream_server.py <папка> [порт] [--lan]
+    import sys
+    from logger_config import setup_logging
+
+    setup_logging()
+    args = [arg for arg in sys.argv[1:] if arg != '--lan']
+    root_folder = args[0]
+    port = int(args[1]) if len(args) > 1 else 8765
+    server = LibraryHttpServer(scan_library(root_folder, tuple(MIME_TYPES)),
+                               host='0.0.0.0' if '--lan' in sys.argv else '127.0.0.1', port=port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -1,3 +1,8 @@
+import colorsys
+
+# Число корзин оттенка для цветов обложки (cover_colors.hue_bucket)
+ACCENT_BUCKETS = 12
+
 app_stylesheet = """
 QWidget {
     background-color: #121212; /* Темно-серый фон для всего приложения */
@@ -32,6 +37,32 @@ QPushButton:disabled {
     color: #aaaaaa; /* Более тусклый текст для неактивных кнопок */
 }
 
+/* Кнопки управления воспроизведением; состояние задается динамическим свойством active */
+QPushButton[playerControl="true"] {
+    background-color: #333333;
+    color: transparent;
+}
+
+QPushButton[playerControl="true"][active="true"] {
+    background-color: #007bff;
+}
+
+/* Переключатель режима радио: текстовая кнопка с тем же состоянием active */
+QPushButton#radioButton {
+    background-color: #333333;
+    color: white;
+    padding: 4px 10px;
+}
+
+QPushButton#radioButton[active="true"] {
+    background-color: #007bff;
+}
+
+QPushButton#playPauseButton {
+    background-color: white;
+    color: transparent;
+}
+
 QSlider::groove:horizontal {
     border: 1px solid #444444;
     height: 8px;
@@ -87,3 +118,27 @@ ListItemWidget QLabel {
     color: white; /* Убедимся, что цвет текста белый */
 }
 """
+
+
+def _hsv_hex(hue, saturation, value):
+    return '#%02x%02x%02x' % tuple(int(round(c * 255)) for c in colorsys.hsv_to_rgb(hue, saturation, value))
+
+
+def _accent_rules():
+    """
+    Правила для цветов текущей обложки. Нижняя панель получает свойство tint (оттенок основного цвета),
+    активные кнопки управления - accent; смена трека меняет только свойства, таблица стилей не разбирается заново.
+    """
+    rules = [
+        "QWidget#bottomPlayerPanel QLabel, QWidget#bottomPlayerPanel QSlider { background-color: transparent; }",
+    ]
+    for bucket in range(ACCENT_BUCKETS):
+        hue = bucket / ACCENT_BUCKETS
+        rules.append(f'QWidget#bottomPlayerPanel[tint="{bucket}"] {{ background-color: {_hsv_hex(hue, 0.45, 0.16)}; }}')
+        rules.append(f'QPushButton[playerControl="true"][active="true"][accent="{bucket}"], '
+                     f'QPushButton#radioButton[active="true"][accent="{bucket}"] '
+                     f'{{ background-color: {_hsv_hex(hue, 0.75, 0.8)}; }}')
+    return "\n".join(rules) + "\n"
+
+
+app_stylesheet += _accent_rules()
@@ -0,0 +1,176 @@
+import time
+import heapq
+import logging
+import threading
+import itertools
+
+# Приоритетные полосы: меньше - важнее
+PRIORITY_INTERACTIVE = 0
+PRIORITY_VISIBLE = 1
+PRIORITY_BACKGROUND = 2
+
+
+class TaskToken:
+    """
+    Токен поколения задачи. Новая задача в том же канале отменяет токены предыдущих,
+    поэтому устаревшие результаты можно отбросить проверкой is_current().
+    cancel_event можно передавать в долгие операции для кооперативной отмены.
+    """
+    __slots__ = ('channel', 'generation', 'cancel_event')
+
+    def __init__(self, channel, generation):
+        self.channel = channel
+        self.generation = generation
+        self.cancel_event = threading.Event()
+
+    def is_current(self):
+        return not self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class _Task:
+    __slots__ = ('priority', 'sequence', 'fn', 'args', 'token', 'resources')
+
+    def __init__(self, priority, sequence, fn, args, token, resources):
+        self.priority = priority
+        self.sequence = sequence
+        self.fn = fn
+        self.args = args
+        self.token = token
+        self.resources = resources
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class TaskExecutor:
+    """
+    Общий пул фоновых задач приложения.
+    Задачи выбираются по приоритету, затем по порядку постановки; для ресурсов
+    (диск, разбор медиа и т.п.) задается предел одновременно выполняемых задач.
+    Задача может занимать несколько ресурсов сразу (кортеж), тогда проверяются все пределы.
+    Отмененные задачи, еще не начавшие выполнение, отбрасываются без запуска.
+    Функция задачи вызывается как fn(token, *args).
+    """
+
+    def __init__(self, max_workers=4, resource_limits=None):
+        self.resource_limits = dict(resource_limits or {})
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running = {}
+        self._active_tokens = set()
+        self._channels = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._workers = [threading.Thread(target=self._worker, name=f"task-{i}", daemon=True)
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn, *args, priority=PRIORITY_BACKGROUND, channel=None, resource=None):
+        """Ставит задачу в очередь и возвращает ее TaskToken (None после shutdown)."""
+        with self._condition:
+            if self._stopped:
+                return None
+            if channel is not None:
+                previous = self._channels.get(channel)
+                if previous is not None:
+                    previous.cancel()
+                token = TaskToken(channel, previous.generation + 1 if previous is not None else 1)
+                self._channels[channel] = token
+            else:
+                token = TaskToken(None, 0)
+            resources = resource if isinstance(resource, tuple) else (resource,)
+            heapq.heappush(self._queue, _Task(priority, next(self._sequence), fn, args, token, resources))
+            self._condition.notify()
+        return token
+
+    def set_resource_limit(self, resource, limit):
+        """Задает (limit=None - снимает) предел одновременных задач ресурса."""
+        with self._condition:
+            if limit is None:
+                self.resource_limits.pop(resource, None)
+            else:
+                self.resource_limits[resource] = limit
+            self._condition.notify_all()
+
+    def cancel(self, channel):
+        """Отменяет текущую задачу канала."""
+        with self._condition:
+            token = self._channels.pop(channel, None)
+        if token is not None:
+            token.cancel()
+
+    def is_current(self, token):
+        """True, если токен не отменен и остается последним в своем канале."""
+        if token is None or not token.is_current():
+            return False
+        return token.channel is None or self._channels.get(token.channel) is token
+
+    def _take_task(self):
+        """Извлекает самую приоритетную задачу, для ресурса которой есть свободное место."""
+        deferred = []
+        task = None
+        while self._queue:
+            candidate = heapq.heappop(self._queue)
+            if not candidate.token.is_current():
+                continue
+            if not self._has_capacity(candidate.resources):
+                deferred.append(candidate)
+                continue
+            task = candidate
+            break
+        for candidate in deferred:
+            heapq.heappush(self._queue, candidate)
+        return task
+
+    def _has_capacity(self, resources):
+        for resource in resources:
+            limit = self.resource_limits.get(resource)
+            if limit is not None and self._running.get(resource, 0) >= limit:
+                return False
+        return True
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                task = self._take_task()
+                while task is None and not self._stopped:
+                    self._condition.wait()
+                    task = self._take_task()
+                if self._stopped:
+                    return
+                for resource in task.resources:
+                    self._running[resource] = self._running.get(resource, 0) + 1
+                self._active_tokens.add(task.token)
+            try:
+                task.fn(task.token, *task.args)
+            except Exception as e:
+                logging.error(f"Ошибка фоновой задачи {getattr(task.fn, '__name__', task.fn)}: {e}")
+            finally:
+                with self._condition:
+                    for resource in task.resources:
+                        self._running[resource] -= 1
+                    self._active_tokens.discard(task.token)
+                    # Освободившийся ресурс может разблокировать отложенные задачи
+                    self._condition.notify_all()
+
+    def shutdown(self, timeout=2.0):
+        """Отменяет все задачи и ждет завершения выполняющихся не дольше timeout секунд."""
+        with self._condition:
+            self._stopped = True
+            for task in self._queue:
+                task.token.cancel()
+            self._queue.clear()
+            for token in (*self._channels.values(), *self._active_tokens):
+                token.cancel()
+            self._channels.clear()
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                logging.warning(f"Фоновая задача в {worker.name} не завершилась за {timeout} с")
+                break
@@ -0,0 +1,50 @@
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+from unittest import mock
+
+import archive
+
+
+class SplitArchivePathTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.directory, "album.zip")
+        with zipfile.ZipFile(self.zip_path, 'w') as file:
+            file.writestr("CD1/01.mp3", b"data")
+        os.mkdir(os.path.join(self.directory, "folder.zip"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_split(self):
+        member = os.path.join(self.zip_path, "CD1", "01.mp3")
+        self.assertEqual(archive.split_archive_path(member), (self.zip_path, "CD1/01.mp3"))
+        self.assertEqual(archive.split_archive_path(self.zip_path), (self.zip_path, ""))
+        self.assertTrue(archive.is_archive_member(member))
+        self.assertFalse(archive.is_archive_member(self.zip_path))
+
+    def test_not_archives(self):
+        self.assertIsNone(archive.split_archive_path(os.path.join(self.directory, "track.mp3")))
+        self.assertIsNone(archive.split_archive_path(os.path.join(self.directory, "folder.zip", "01.mp3")))
+        self.assertIsNone(archive.split_archive_path(os.path.join(self.directory, "missing.zip", "01.mp3")))
+
+    def test_known_archive_is_not_checked_on_disk_again(self):
+        member = os.path.join(self.zip_path, "CD1", "01.mp3")
+        archive.split_archive_path(member)
+        with mock.patch("os.path.isfile", side_effect=AssertionError), \
+                mock.patch("os.path.isdir", side_effect=AssertionError):
+            self.assertEqual(archive.split_archive_path(member), (self.zip_path, "CD1/01.mp3"))
+
+    def test_removed_archive_is_forgotten(self):
+        member = os.path.join(self.zip_path, "CD1", "01.mp3")
+        self.assertIsNotNone(archive.member_stat(member))
+        os.remove(self.zip_path)
+        self.assertIsNone(archive.member_stat(member))
+        self.assertIsNone(archive.split_archive_path(member))
+
+
+if __name__ == '__main__':
+    unittest.main()
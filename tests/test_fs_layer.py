@@ -0,0 +1,59 @@
+import os
+import unittest
+
+from fs_layer import CachingFileSystem, FileSystem
+
+
+class _CountingFileSystem(FileSystem):
+    def __init__(self):
+        self.calls = 0
+
+    def listdir(self, path):
+        self.calls += 1
+        return ()
+
+    def stat(self, path):
+        self.calls += 1
+        return None
+
+
+class CachingInvalidateTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = _CountingFileSystem()
+        self.fs = CachingFileSystem(self.backend)
+        self.paths = [os.path.join(os.sep, "music", "a"), os.path.join(os.sep, "music", "a", "b"),
+                      os.path.join(os.sep, "music", "ab"), os.path.join(os.sep, "other")]
+        for path in self.paths:
+            self.fs.listdir(path)
+            self.fs.stat(path)
+        self.backend.calls = 0
+
+    def tearDown(self):
+        self.fs.shutdown()
+
+    def refetched(self):
+        self.backend.calls = 0
+        refetched = []
+        for path in self.paths:
+            calls = self.backend.calls
+            self.fs.listdir(path)
+            self.fs.stat(path)
+            if self.backend.calls != calls:
+                refetched.append(path)
+        return refetched
+
+    def test_recursive_invalidate_keeps_other_roots(self):
+        self.fs.invalidate(self.paths[0], recursive=True)
+        self.assertEqual(self.refetched(), self.paths[:2])
+
+    def test_single_path(self):
+        self.fs.invalidate(self.paths[0])
+        self.assertEqual(self.refetched(), self.paths[:1])
+
+    def test_everything(self):
+        self.fs.invalidate()
+        self.assertEqual(self.refetched(), self.paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
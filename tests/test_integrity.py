@@ -0,0 +1,185 @@
+import io
+import wave
+import struct
+import unittest
+from unittest import mock
+
+import integrity
+from integrity import (STATUS_OK, STATUS_DAMAGED, STATUS_BROKEN, STATUS_UNSUPPORTED, crc8, crc16,
+                       verify_flac, verify_mp3, verify_wav)
+
+# MPEG-1 Layer III, 128 кбит/с, 44100 Гц, стерео: кадр 417 байт, side info 32 байта
+FRAME_HEADER = 0xFFFB9000
+FRAME_LENGTH = 417
+SIDE_INFO = 32
+
+
+def _frame(protected=False, fill=0):
+    header = FRAME_HEADER & ~0x10000 if protected else FRAME_HEADER
+    head = struct.pack('>I', header)
+    if not protected:
+        return head + bytes([fill]) * (FRAME_LENGTH - 4)
+    side_info = bytes([fill]) * SIDE_INFO
+    crc = crc16(side_info, crc16(head[2:4], 0xFFFF))
+    return head + struct.pack('>H', crc) + side_info + bytes(FRAME_LENGTH - 6 - SIDE_INFO)
+
+
+def _flac_frame(number, payload):
+    # Блок 4096 сэмплов, 44100 Гц, стерео, 16 бит; подкадры не разбираются, поэтому звук не нужен
+    header = bytearray(b'\xff\xf8')
+    header.append((12 << 4) | 9)
+    header.append((1 << 4) | (4 << 1))
+    header += chr(number).encode('utf-8')
+    header.append(crc8(header))
+    frame = bytes(header) + payload
+    return frame + struct.pack('>H', crc16(frame))
+
+
+def _flac(frames=20, payload_size=1000):
+    payload = bytes(range(1, 251)) * (payload_size // 250)
+    frame_size = len(_flac_frame(0, payload)) + 8
+    streaminfo = struct.pack('>HH', 4096, 4096) + bytes(3) + frame_size.to_bytes(3, 'big')
+    streaminfo += ((44100 << 44) | (1 << 41) | (15 << 36) | (frames * 4096)).to_bytes(8, 'big') + bytes(16)
+    header = b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo
+    return header + b''.join(_flac_frame(number, payload) for number in range(frames))
+
+
+def _wav(frames=100, channels=2, sample_width=2):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as file:
+        file.setnchannels(channels)
+        file.setsampwidth(sample_width)
+        file.setframerate(44100)
+        file.writeframes(bytes(frames * channels * sample_width))
+    return buffer.getvalue()
+
+
+class Crc16Test(unittest.TestCase):
+    def test_check_values(self):
+        # CRC-16/UMTS (FLAC) и CRC-16/CMS (MPEG, начальное 0xFFFF) для строки "123456789"
+        self.assertEqual(crc16(b"123456789"), 0xFEE8)
+        self.assertEqual(crc16(b"123456789", 0xFFFF), 0xAEE7)
+
+    def test_chaining(self):
+        data = bytes(range(256)) * 3
+        self.assertEqual(crc16(data[500:], crc16(data[:500])), crc16(data))
+
+    @unittest.skipIf(integrity.np is None, "нужен NumPy")
+    def test_many_matches_bytewise(self):
+        data = bytes((i * 37 + 11) % 256 for i in range(20000))
+        spans = [(0, 0), (3, 4), (10, 1011), (5000, 5001), (100, 19999), (7, 2000)]
+        expected = [crc16(data[start:end]) for start, end in spans]
+        self.assertEqual(integrity.crc16_many(data, spans), expected)
+        with mock.patch.object(integrity, "FLAC_CRC_BATCH_BYTES", 3000):
+            self.assertEqual(integrity.crc16_many(data, spans), expected)
+
+
+class VerifyMp3Test(unittest.TestCase):
+    def check(self, data):
+        return verify_mp3(data, len(data))
+
+    def test_clean_stream(self):
+        status, detail = self.check(_frame() * 10)
+        self.assertEqual(status, STATUS_OK)
+        self.assertIn("кадров: 10", detail)
+
+    def test_id3v1_tag_is_not_garbage(self):
+        self.assertEqual(self.check(_frame() * 5 + b'TAG' + bytes(125))[0], STATUS_OK)
+
+    def test_protected_frames(self):
+        status, detail = self.check(_frame(protected=True, fill=0x5A) * 4)
+        self.assertEqual(status, STATUS_OK)
+        self.assertIn("с CRC: 4", detail)
+
+    def test_crc_mismatch(self):
+        frame = bytearray(_frame(protected=True, fill=0x5A))
+        frame[10] ^= 0xFF
+        status, detail = self.check(_frame(protected=True) * 2 + bytes(frame) + _frame(protected=True))
+        self.assertEqual(status, STATUS_DAMAGED)
+        self.assertIn("неверная CRC кадра", detail)
+
+    def test_lost_sync(self):
+        status, detail = self.check(_frame() * 3 + bytes(50) + _frame() * 3)
+        self.assertEqual(status, STATUS_DAMAGED)
+        self.assertIn("потеря синхронизации (50 байт)", detail)
+
+    def test_truncated_last_frame(self):
+        status, detail = self.check((_frame() * 4)[:-100])
+        self.assertEqual(status, STATUS_DAMAGED)
+        self.assertIn("обрезан последний кадр", detail)
+
+    def test_no_frames(self):
+        self.assertEqual(self.check(bytes(2000))[0], STATUS_BROKEN)
+
+
+class VerifyFlacTest(unittest.TestCase):
+    def check(self, data):
+        return verify_flac(data, len(data), None)
+
+    @unittest.skipIf(integrity.np is None, "нужен NumPy")
+    def test_clean_stream(self):
+        self.assertEqual(self.check(_flac()), (STATUS_OK, "кадров: 20"))
+
+    @unittest.skipIf(integrity.np is None, "нужен NumPy")
+    def test_corrupted_frame(self):
+        data = bytearray(_flac())
+        data[len(data) // 2] ^= 0x01
+        status, detail = self.check(bytes(data))
+        self.assertEqual(status, STATUS_DAMAGED)
+        self.assertIn("неверная CRC кадра", detail)
+
+    def test_frame_crc_is_skipped_without_numpy(self):
+        data = bytearray(_flac())
+        data[len(data) // 2] ^= 0x01
+        with mock.patch.object(integrity, "np", None):
+            status, detail = self.check(bytes(data))
+        self.assertEqual(status, STATUS_OK)
+        self.assertIn("CRC кадров не проверена", detail)
+
+    def test_missing_frames_and_samples(self):
+        data = _flac(frames=3)
+        frame_length = (len(data) - 42) // 3
+        status, detail = self.check(data[:42 + frame_length] + data[42 + 2 * frame_length:])
+        self.assertEqual(status, STATUS_DAMAGED)
+        self.assertIn("пропущены кадры", detail)
+        self.assertIn("сэмплов 8192 вместо 12288", detail)
+
+    def test_not_flac(self):
+        self.assertEqual(self.check(b'OggS' + bytes(100))[0], STATUS_BROKEN)
+
+
+class VerifyWavTest(unittest.TestCase):
+    def check(self, data):
+        return verify_wav(data, len(data))
+
+    def test_valid_file(self):
+        status, detail = self.check(_wav())
+        self.assertEqual(status, STATUS_OK)
+        self.assertIn("данных: 400 байт", detail)
+
+    def test_truncated_data(self):
+        status, detail = self.check(_wav()[:-10])
+        self.assertEqual(status, STATUS_DAMAGED)
+        self.assertIn("размер RIFF больше файла", detail)
+
+    def test_data_not_multiple_of_block(self):
+        data = bytearray(_wav())
+        data_size_offset = data.index(b'data') + 4
+        struct.pack_into('<I', data, data_size_offset, 399)
+        struct.pack_into('<I', data, 4, len(data) - 9)
+        status, detail = self.check(bytes(data[:-1]))
+        self.assertEqual(status, STATUS_DAMAGED)
+        self.assertIn("не кратен блоку 4", detail)
+
+    def test_structure_errors(self):
+        self.assertEqual(self.check(b'OggS' + bytes(100))[0], STATUS_BROKEN)
+        self.assertEqual(self.check(b'RF64' + bytes(100))[0], STATUS_UNSUPPORTED)
+        header_only = b'RIFF' + struct.pack('<I', 4) + b'WAVE'
+        self.assertEqual(self.check(header_only), (STATUS_BROKEN, "нет чанка fmt"))
+        fmt = _wav()[12:36]
+        self.assertEqual(self.check(b'RIFF' + struct.pack('<I', 28) + b'WAVE' + fmt),
+                         (STATUS_BROKEN, "нет чанка data"))
+
+
+if __name__ == '__main__':
+    unittest.main()
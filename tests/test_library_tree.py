@@ -0,0 +1,57 @@
+import unittest
+
+from library_tree import tree_from_record
+
+
+def _tree():
+    return tree_from_record('/music', ('music', (), (), (
+        ('Artist', (), (), (
+            ('Album', ('01.mp3', '03.mp3'), (), ()),
+        )),
+    )))
+
+
+class UpdateFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = _tree()
+        self.album = self.tree.find(['Artist', 'Album'])
+
+    def totals(self, node):
+        return node.total_tracks, node.total_duration_ms, node.total_size
+
+    def test_update_moves_delta_to_ancestors(self):
+        self.assertTrue(self.album.update_file('01.mp3', 1000, 10))
+        self.assertTrue(self.album.update_file('01.mp3', 1500, 15))
+        self.assertFalse(self.album.update_file('01.mp3', 1500, 15))
+        for node in (self.album, self.album.parent, self.tree.root):
+            self.assertEqual(self.totals(node), (2, 1500, 15))
+
+    def test_remove_decrements_track_count(self):
+        self.album.update_file('01.mp3', 1000, 10)
+        self.assertTrue(self.album.remove_file('01.mp3'))
+        self.assertFalse(self.album.remove_file('01.mp3'))
+        self.assertEqual(self.totals(self.tree.root), (1, 0, 0))
+        self.assertTrue(self.album.update_file('01.mp3', 1000, 10))
+        self.assertEqual(self.totals(self.tree.root), (2, 1000, 10))
+
+    def test_file_missing_from_tree_is_added(self):
+        self.assertTrue(self.album.update_file('02.mp3', 2000, 20))
+        self.assertEqual(self.album.files, ('01.mp3', '02.mp3', '03.mp3'))
+        self.assertTrue(self.album.has_file('02.mp3'))
+        self.assertEqual(self.totals(self.tree.root), (3, 2000, 20))
+
+    def test_incremental_totals_match_full_recount(self):
+        self.album.update_file('01.mp3', 1000, 10)
+        self.album.update_file('02.mp3', 2000, 20)
+        self.album.remove_file('03.mp3')
+        incremental = [self.totals(node) for node in self.tree.iter_nodes()]
+        self.tree.compute_totals()
+        self.assertEqual([self.totals(node) for node in self.tree.iter_nodes()], incremental)
+
+    def test_unknown_file_removal(self):
+        self.assertFalse(self.album.remove_file('missing.mp3'))
+        self.assertEqual(self.totals(self.tree.root), (2, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
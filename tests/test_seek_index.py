@@ -0,0 +1,67 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from seek_index import SeekIndexStore
+
+# MPEG-1 Layer III, 128 кбит/с, 44100 Гц: кадр 417 байт, 26 мс звука
+FRAME = struct.pack('>I', 0xFFFB9000) + bytes(413)
+
+
+class SeekIndexStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = os.path.join(self.directory, "cache")
+        os.mkdir(self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def track(self, name, frames=100):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as file:
+            file.write(FRAME * frames)
+        return path
+
+    def cached_files(self):
+        return sorted(os.listdir(self.cache))
+
+    def test_table_is_reused(self):
+        store = SeekIndexStore(self.cache)
+        path = self.track("a.mp3")
+        table = store.get_or_build(path)
+        self.assertIsNotNone(table)
+        self.assertEqual(len(self.cached_files()), 1)
+        self.assertEqual(store.load(path, os.stat(path)).offsets, table.offsets)
+
+    def test_stale_table_is_removed(self):
+        store = SeekIndexStore(self.cache)
+        path = self.track("a.mp3")
+        store.get_or_build(path)
+        self.track("a.mp3", frames=50)
+        self.assertIsNone(store.load(path, os.stat(path)))
+        self.assertEqual(self.cached_files(), [])
+
+    def test_prune_keeps_recently_used(self):
+        store = SeekIndexStore(self.cache, max_tables=2)
+        paths = [self.track(f"{i}.mp3") for i in range(3)]
+        for age, path in enumerate(paths):
+            store.get_or_build(path)
+            cache_path = store._cache_path(path)
+            os.utime(cache_path, ns=(age * 10 ** 9, age * 10 ** 9))
+        # Чтение обновляет время использования: первая таблица становится самой свежей
+        store.load(paths[0], os.stat(paths[0]))
+        self.assertEqual(store.prune(), 1)
+        self.assertFalse(os.path.exists(store._cache_path(paths[1])))
+        self.assertTrue(os.path.exists(store._cache_path(paths[0])))
+
+    def test_prune_by_size(self):
+        store = SeekIndexStore(self.cache, max_bytes=1)
+        store.get_or_build(self.track("a.mp3"))
+        self.assertEqual(self.cached_files(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
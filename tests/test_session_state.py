@@ -0,0 +1,72 @@
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+
+from session_state import SessionState, SessionStore, SESSION_HEADER, encode_session, decode_session
+
+
+def _state():
+    return SessionState(current_file="/музыка/альбом/01.flac", position_ms=61000, length_ms=240000, volume=35,
+                        shuffle=True, repeat=False, title="Первая", artist="Исполнитель", cover_png=b'\x89PNG',
+                        cover_colors=(0x102030, 0xFF8800), album_folder="/музыка/альбом",
+                        queue=["/музыка/a.mp3", "/музыка/b.mp3"], library_path=["Исполнитель", "Альбом"],
+                        scroll=120)
+
+
+class SessionEncodingTest(unittest.TestCase):
+    def test_round_trip(self):
+        decoded = decode_session(encode_session(_state()))
+        for name in SessionState.__slots__:
+            with self.subTest(field=name):
+                self.assertEqual(getattr(decoded, name), getattr(_state(), name))
+
+    def test_empty_session(self):
+        decoded = decode_session(encode_session(SessionState()))
+        self.assertIsNone(decoded.current_file)
+        self.assertIsNone(decoded.cover_colors)
+        self.assertEqual(decoded.queue, [])
+
+    def test_values_are_clamped(self):
+        decoded = decode_session(encode_session(SessionState(volume=150, position_ms=-5)))
+        self.assertEqual(decoded.volume, 100)
+        self.assertEqual(decoded.position_ms, 0)
+
+    def test_other_version_is_ignored(self):
+        data = bytearray(encode_session(_state()))
+        data[4] += 1
+        self.assertIsNone(decode_session(bytes(data)))
+
+    def test_truncated_data_raises(self):
+        data = encode_session(_state())
+        for length in (SESSION_HEADER.size - 1, SESSION_HEADER.size + 2, len(data) - 1):
+            with self.subTest(length=length), self.assertRaises((ValueError, struct.error)):
+                decode_session(data[:length])
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "session.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_save_skips_unchanged_state(self):
+        store = SessionStore(self.path)
+        self.assertTrue(store.save(_state()))
+        self.assertFalse(store.save(_state()))
+        self.assertEqual(SessionStore(self.path).load().title, "Первая")
+
+    def test_damaged_file_is_not_restored(self):
+        with open(self.path, 'wb') as file:
+            file.write(encode_session(_state())[:-3])
+        self.assertIsNone(SessionStore(self.path).load())
+
+    def test_missing_file(self):
+        self.assertIsNone(SessionStore(self.path).load())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from library_index import LibraryIndex
+from smart_playlists import QueryError, _tokenize, parse_query, plan_query, _Condition, _Node
+
+
+def _row(path, genre=None, rating=0, duration_ms=0, artist=None):
+    return (path, os.path.dirname(path), 1, 1, os.path.basename(path), artist, None, genre, rating,
+            duration_ms, None, None)
+
+
+class TokenizerTest(unittest.TestCase):
+    def test_quoted_strings_and_operators(self):
+        self.assertEqual(_tokenize('artist contains "Miles Davis" and rating>=4'),
+                         [('word', 'artist'), ('word', 'contains'), ('string', 'Miles Davis'), ('word', 'and'),
+                          ('word', 'rating'), ('op', '>='), ('number', '4')])
+
+    def test_unquoted_date_is_one_token(self):
+        self.assertEqual(_tokenize("added after 2024-01-31"),
+                         [('word', 'added'), ('word', 'after'), ('date', '2024-01-31')])
+
+    def test_rating_with_plus(self):
+        self.assertEqual(_tokenize("rated 4+"), [('word', 'rated'), ('number', '4+')])
+
+    def test_garbage_is_rejected(self):
+        with self.assertRaises(QueryError):
+            _tokenize('title is "unterminated')
+
+
+class ParserTest(unittest.TestCase):
+    def test_precedence(self):
+        root = parse_query("genre is Jazz or genre is Blues and rated 5")
+        self.assertEqual(root.kind, 'or')
+        self.assertIsInstance(root.children[0], _Condition)
+        self.assertEqual(root.children[1].kind, 'and')
+
+    def test_parentheses_and_not(self):
+        root = parse_query("not (genre is Jazz or genre is Blues)")
+        self.assertIsInstance(root, _Node)
+        self.assertEqual(root.kind, 'not')
+        self.assertEqual(root.children[0].kind, 'or')
+
+    def test_errors(self):
+        for text in ("", "colour is red", "genre is", "(genre is Jazz", "genre is Jazz )",
+                     "rating contains 5", "added after yesterday"):
+            with self.subTest(text=text), self.assertRaises(QueryError):
+                parse_query(text)
+
+
+class QueryPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = LibraryIndex(os.path.join(self.directory, "library.sqlite3"))
+        self.index.write_batch([
+            _row("/music/jazz.mp3", genre="Jazz", rating=5, duration_ms=400000, artist="Miles Davis"),
+            _row("/music/rock.mp3", genre="Rock", rating=3, duration_ms=200000),
+            _row("/music/untagged.mp3"),
+        ])
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def select(self, text):
+        sql, params = plan_query(text).select_all()
+        return sorted(os.path.basename(row[0]) for row in self.index.query(sql, params))
+
+    def test_text_comparisons_ignore_case(self):
+        self.assertEqual(self.select("genre is jazz"), ["jazz.mp3"])
+        self.assertEqual(self.select('artist contains "davis"'), ["jazz.mp3"])
+
+    def test_numbers_and_duration(self):
+        self.assertEqual(self.select("rated 4+"), ["jazz.mp3"])
+        self.assertEqual(self.select("duration > 300"), ["jazz.mp3"])
+
+    def test_not_includes_null_values(self):
+        # У трека без жанра сравнение дает NULL; NOT должен его включить
+        self.assertEqual(self.select("not genre is Jazz"), ["rock.mp3", "untagged.mp3"])
+        self.assertEqual(self.select("genre is not Jazz"), ["rock.mp3", "untagged.mp3"])
+
+    def test_play_stats(self):
+        self.index.record_play("/music/rock.mp3")
+        self.assertEqual(self.select("never played"), ["jazz.mp3", "untagged.mp3"])
+        self.assertEqual(self.select("played in the last 1 day"), ["rock.mp3"])
+        self.assertEqual(self.select("not played in the last 1 day"), ["jazz.mp3", "untagged.mp3"])
+        self.assertEqual(self.select("plays >= 1"), ["rock.mp3"])
+
+    def test_unquoted_dates(self):
+        today = time.strftime("%Y-%m-%d")
+        self.assertEqual(self.select("added before 2000-01-01"), [])
+        self.assertEqual(self.select(f"added before {today} or added after {today}"), [])
+        self.assertEqual(len(self.select("added after 2000-01-01")), 3)
+
+    def test_path_uses_primary_key(self):
+        sql, params = plan_query('path = "/music/rock.mp3"').select_all()
+        plan = " ".join(row[3] for row in self.index.query("EXPLAIN QUERY PLAN " + sql, params))
+        self.assertIn("sqlite_autoindex_tracks_1", plan)
+        self.assertEqual(self.select('path = "/music/rock.mp3"'), ["rock.mp3"])
+
+    def test_relative_dates_are_evaluated_per_run(self):
+        plan = plan_query("added in the last 2 days")
+        self.assertTrue(plan.time_relative)
+        self.assertNotEqual(plan.params(), [])
+        self.assertFalse(plan_query("genre is Jazz").time_relative)
+
+
+if __name__ == '__main__':
+    unittest.main()
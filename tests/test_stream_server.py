@@ -0,0 +1,26 @@
+import unittest
+
+from stream_server import HttpError, parse_range
+
+
+class ParseRangeTest(unittest.TestCase):
+    def test_no_header(self):
+        self.assertIsNone(parse_range(None, 1000))
+        self.assertIsNone(parse_range("", 1000))
+
+    def test_ranges(self):
+        self.assertEqual(parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range("bytes=500-", 1000), (500, 999))
+        self.assertEqual(parse_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-5000", 1000), (0, 999))
+        self.assertEqual(parse_range("bytes=990-5000", 1000), (990, 999))
+
+    def test_unsatisfiable(self):
+        for header in ("bytes=1000-", "bytes=5-2", "bytes=-0", "bytes=0-1,5-6", "items=0-1", "bytes=a-b"):
+            with self.subTest(header=header), self.assertRaises(HttpError) as context:
+                parse_range(header, 1000)
+            self.assertEqual(context.exception.status, 416)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from tracing import Tracer
+
+
+class TrackStartLatencyTest(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+
+    def test_matching_track_is_measured(self):
+        self.tracer.begin_track_start("/music/a.mp3")
+        self.assertIsNotNone(self.tracer.end_track_start("/music/a.mp3"))
+        self.assertEqual(self.tracer.latency_summary()["count"], 1)
+
+    def test_other_track_discards_measurement(self):
+        self.tracer.begin_track_start("/music/a.mp3")
+        self.assertIsNone(self.tracer.end_track_start("/music/b.mp3"))
+        self.assertIsNone(self.tracer.end_track_start("/music/a.mp3"))
+        self.assertEqual(self.tracer.latency_summary()["count"], 0)
+
+    def test_cancel(self):
+        self.tracer.begin_track_start("/music/a.mp3")
+        self.tracer.cancel_track_start()
+        self.assertIsNone(self.tracer.end_track_start("/music/a.mp3"))
+
+    def test_end_without_begin(self):
+        self.assertIsNone(self.tracer.end_track_start("/music/a.mp3"))
+
+
+if __name__ == '__main__':
+    unittest.main()
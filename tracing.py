@@ -0,0 +1,178 @@
+import os
+import json
+import math
+import time
+import functools
+import logging
+import threading
+from collections import deque
+
+# Переменная окружения с путем файла трассировки; если задана, трассировка включена
+TRACE_ENV_VAR = "MUSIC_PLAYER_TRACE"
+
+
+class _NullSpan:
+    """Пустой участок для выключенной трассировки: вход и выход ничего не делают."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start_ns')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._record(self.name, self.category, self.start_ns,
+                            time.perf_counter_ns() - self.start_ns, self.args)
+        return False
+
+
+def _percentile(sorted_values, fraction):
+    """Перцентиль методом ближайшего ранга."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Tracer:
+    """
+    Трассировка этапов работы плеера.
+    В выключенном состоянии span() возвращает общий пустой объект и почти ничего не стоит.
+    Включенная трассировка хранит последние max_events участков и выгружает их
+    в формате Chrome Trace Event (открывается в chrome://tracing и Perfetto).
+    Задержка "клик - звук" измеряется всегда и хранится в скользящем окне.
+    """
+
+    def __init__(self, enabled=False, max_events=100000, latency_window=256):
+        self.enabled = enabled
+        self._events = deque(maxlen=max_events)
+        self._thread_names = {}
+        self._latencies_ms = deque(maxlen=latency_window)
+        self._track_start_ns = None
+        self._track_start_key = None
+        self._lock = threading.Lock()
+        self._origin_ns = time.perf_counter_ns()
+
+    def configure(self, enabled):
+        self.enabled = enabled
+
+    def span(self, name, category="player", **args):
+        """Контекстный менеджер, измеряющий участок кода."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def _record(self, name, category, start_ns, duration_ns, args):
+        thread = threading.current_thread()
+        self._thread_names.setdefault(thread.ident, thread.name)
+        self._events.append((name, category, start_ns, duration_ns, thread.ident, args))
+
+    def begin_track_start(self, key):
+        """
+        Отмечает клик по треку; key - путь трека, начало звучания которого завершит замер.
+        Незавершенное предыдущее измерение отбрасывается.
+        """
+        with self._lock:
+            self._track_start_ns = time.perf_counter_ns()
+            self._track_start_key = key
+
+    def end_track_start(self, key):
+        """
+        Отмечает начало звучания трека key (может вызываться из потока libvlc).
+        Возвращает задержку в мс или None, если замер не начинался или начинался для другого трека;
+        в последнем случае он отбрасывается, чтобы не дать ложного значения.
+        """
+        end_ns = time.perf_counter_ns()
+        with self._lock:
+            start_ns = self._track_start_ns
+            start_key = self._track_start_key
+            self._track_start_ns = self._track_start_key = None
+            if start_ns is None or start_key != key:
+                return None
+            latency_ms = (end_ns - start_ns) / 1e6
+            self._latencies_ms.append(latency_ms)
+        if self.enabled:
+            self._record("click_to_sound", "latency", start_ns, end_ns - start_ns,
+                         {"track": os.path.basename(key)} if key else {})
+        return latency_ms
+
+    def cancel_track_start(self):
+        """Отбрасывает незавершенный замер (ошибка воспроизведения, остановка)."""
+        with self._lock:
+            self._track_start_ns = self._track_start_key = None
+
+    def latency_summary(self):
+        """p50/p95/p99 задержки "клик - звук" по скользящему окну (мс)."""
+        with self._lock:
+            values = sorted(self._latencies_ms)
+        return {
+            "count": len(values),
+            "p50": round(_percentile(values, 0.50), 1),
+            "p95": round(_percentile(values, 0.95), 1),
+            "p99": round(_percentile(values, 0.99), 1),
+        }
+
+    def chrome_trace(self):
+        """Возвращает трассировку как словарь формата Chrome Trace Event."""
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in list(self._thread_names.items())]
+        for name, category, start_ns, duration_ns, tid, args in list(self._events):
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start_ns - self._origin_ns) / 1000.0,
+                "dur": duration_ns / 1000.0,
+                "pid": pid,
+                "tid": tid,
+            }
+            if args:
+                event["args"] = args
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        """Записывает трассировку в JSON-файл (атомарно через временный файл)."""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.chrome_trace(), file, ensure_ascii=False)
+        os.replace(temp_path, path)
+        logging.info(f"Трассировка сохранена: {path} ({len(self._events)} участков)")
+
+
+# Общий трассировщик приложения
+tracer = Tracer(enabled=bool(os.environ.get(TRACE_ENV_VAR)))
+
+
+def traced(name=None, category="player"):
+    """Декоратор: выполняет функцию внутри участка трассировки с ее именем."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with _Span(tracer, span_name, category, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
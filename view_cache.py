@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+
+
+class LevelViewCache:
+    """
+    LRU-кэш подготовленных уровней библиотеки.
+    Для каждого уровня (ключ - кортеж имен папок от корня) хранятся готовые строки
+    списка с аватарами и последняя позиция прокрутки.
+    """
+
+    def __init__(self, max_levels=32):
+        self.max_levels = max_levels
+        self._levels = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает строки уровня или None."""
+        with self._lock:
+            entry = self._levels.get(key)
+            if entry is None:
+                return None
+            self._levels.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, rows):
+        with self._lock:
+            old = self._levels.get(key)
+            scroll = old[1] if old is not None else 0
+            self._levels[key] = [rows, scroll]
+            self._levels.move_to_end(key)
+            self._pending.discard(key)
+            while len(self._levels) > self.max_levels:
+                self._levels.popitem(last=False)
+
+    def scroll_position(self, key):
+        with self._lock:
+            entry = self._levels.get(key)
+            return entry[1] if entry is not None else 0
+
+    def set_scroll_position(self, key, value):
+        with self._lock:
+            entry = self._levels.get(key)
+            if entry is not None:
+                entry[1] = value
+
+    def mark_pending(self, key):
+        """Отмечает уровень как строящийся в фоне. Возвращает False, если он уже есть или строится."""
+        with self._lock:
+            if key in self._levels or key in self._pending:
+                return False
+            self._pending.add(key)
+            return True
+
+    def unmark_pending(self, key):
+        with self._lock:
+            self._pending.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._levels.clear()
+            self._pending.clear()